@@ -0,0 +1,223 @@
+"""
+Versioned read-only JSON API with keyset pagination, sparse fieldsets and incremental sync
+
+GET /api/v1/<resource>?case_id=&fields=&since=&cursor=&limit=
+GET /api/v1/<resource>/<id>?fields=
+
+Sync: page through ?since= until next_cursor is null, then pass that
+response's sync_token as since= next time. updated_at is stamped before a
+transaction commits, so the token reaches SYNC_OVERLAP back and a sync may
+return rows the client already has; merge rows by id. Archiving a closed
+case deletes its rows: sync responses list the cases archived since the
+token in archived_cases (drop their rows locally), and once a case is
+rehydrated all its rows are sent again.
+"""
+
+import base64
+import json
+from datetime import datetime, date, timedelta
+
+from flask import request, jsonify, url_for
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import load_only
+
+from app import app, db
+from models import Case, Child, Parent, Document, Incident, Deadline, CaseNote
+
+API_PREFIX = '/api/v1'
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+SYNC_OVERLAP = timedelta(minutes=2)  # Longest a write is expected to take between stamping and committing
+
+RESOURCES = {
+    'cases': Case,
+    'children': Child,
+    'parents': Parent,
+    'documents': Document,
+    'incidents': Incident,
+    'deadlines': Deadline,
+    'case_notes': CaseNote,
+}
+
+# Server-side storage details that clients never need
+HIDDEN_FIELDS = {
+    'documents': {'filename', 'file_path'},
+}
+
+# Computed fields, with the columns they are built from
+VIRTUAL_FIELDS = {
+    'documents': {'file_url': ('filename', lambda document: url_for('uploaded_file', filename=document.filename))},
+}
+
+
+class APIError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@app.errorhandler(APIError)
+def handle_api_error(error):
+    return jsonify({'error': error.message}), error.status_code
+
+
+def resource_fields(resource):
+    model = RESOURCES[resource]
+    columns = [column.name for column in model.__table__.columns if column.name not in HIDDEN_FIELDS.get(resource, ())]
+    return columns + list(VIRTUAL_FIELDS.get(resource, {}))
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def serialize(resource, obj, fields):
+    virtual = VIRTUAL_FIELDS.get(resource, {})
+    return {field: virtual[field][1](obj) if field in virtual else _json_value(getattr(obj, field))
+            for field in fields}
+
+
+def _parse_fields(resource):
+    allowed = resource_fields(resource)
+    raw = request.args.get('fields')
+    if not raw:
+        return allowed
+    requested = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise APIError(f"Unknown fields for {resource}: {', '.join(unknown)}")
+    # The id and sync key are always returned so clients can page and merge
+    return list(dict.fromkeys(['id'] + requested + (['updated_at'] if 'since' in request.args else [])))
+
+
+def _load_columns(resource, fields):
+    model = RESOURCES[resource]
+    virtual = VIRTUAL_FIELDS.get(resource, {})
+    needed = {virtual[field][0] if field in virtual else field for field in fields} | {'id', 'updated_at'}
+    return load_only(*[getattr(model, name) for name in needed])
+
+
+def _parse_datetime(value, name):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        raise APIError(f"{name} must be an ISO 8601 timestamp")
+    if parsed.tzinfo is not None:
+        # Timestamps are stored as naive UTC
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def encode_cursor(values):
+    payload = json.dumps([_json_value(value) for value in values], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sync):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sync:
+            updated_at, last_id = values
+            return datetime.fromisoformat(updated_at), int(last_id)
+        (last_id,) = values
+        return (int(last_id),)
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise APIError('Invalid cursor')
+
+
+def _parse_limit():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise APIError('limit must be a whole number')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _get_resource(resource):
+    if resource not in RESOURCES:
+        raise APIError(f"Unknown resource: {resource}", 404)
+    return RESOURCES[resource]
+
+
+@app.route(f'{API_PREFIX}/')
+def api_index():
+    """Available resources and their fields"""
+    return jsonify({'version': 1, 'resources': {
+        resource: {'url': url_for('api_list', resource=resource, _external=True), 'fields': resource_fields(resource)}
+        for resource in RESOURCES
+    }})
+
+
+@app.route(f'{API_PREFIX}/<resource>')
+def api_list(resource):
+    """One page of a resource, ordered by id, or by (updated_at, id) when syncing with since=
+
+    Pages are fetched with a keyset cursor rather than an offset, so each page
+    is an index range scan no matter how deep the client has paged.
+    """
+    model = _get_resource(resource)
+    fields = _parse_fields(resource)
+    limit = _parse_limit()
+    since = request.args.get('since')
+    sync = since is not None
+
+    query = model.query.options(_load_columns(resource, fields))
+    case_id = request.args.get('case_id', type=int)
+    if case_id is not None:
+        query = query.filter(model.id == case_id) if model is Case else query.filter(model.case_id == case_id)
+
+    cursor = request.args.get('cursor')
+    if sync:
+        since_at = _parse_datetime(since, 'since')
+        if model is Case:
+            query = query.filter(model.updated_at > since_at)
+        else:
+            # Rehydrated rows keep their old updated_at, so send rehydrated cases whole
+            rehydrated = select(Case.id).where(Case.rehydrated_at > since_at)
+            query = query.filter(or_(model.updated_at > since_at, model.case_id.in_(rehydrated)))
+        if cursor:
+            last_updated, last_id = decode_cursor(cursor, sync=True)
+            query = query.filter(or_(model.updated_at > last_updated,
+                                     and_(model.updated_at == last_updated, model.id > last_id)))
+        query = query.order_by(model.updated_at, model.id)
+    else:
+        if cursor:
+            (last_id,) = decode_cursor(cursor, sync=False)
+            query = query.filter(model.id > last_id)
+        query = query.order_by(model.id)
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor([last.updated_at, last.id] if sync else [last.id])
+
+    body = {
+        'data': [serialize(resource, row, fields) for row in rows],
+        'next_cursor': next_cursor,
+    }
+    if sync:
+        # Once the last page is reached, clients store sync_token and pass it as since= next time
+        latest = max((row.updated_at for row in rows if row.updated_at), default=None)
+        body['sync_token'] = _json_value(max(since_at, latest - SYNC_OVERLAP)) if latest else since
+        archived = select(Case.id).where(Case.status == 'archived', Case.archived_at > since_at)
+        if case_id is not None:
+            archived = archived.where(Case.id == case_id)
+        body['archived_cases'] = list(db.session.execute(archived.order_by(Case.id)).scalars())
+    return jsonify(body)
+
+
+@app.route(f'{API_PREFIX}/<resource>/<int:item_id>')
+def api_detail(resource, item_id):
+    model = _get_resource(resource)
+    fields = _parse_fields(resource)
+    obj = model.query.options(_load_columns(resource, fields)).filter(model.id == item_id).first()
+    if obj is None:
+        raise APIError(f"{resource} {item_id} not found", 404)
+    return jsonify({'data': serialize(resource, obj, fields)})
@@ -4,6 +4,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from database_pool import RoutingSession, engine_options, replica_binds
+from sqlite_tuning import is_sqlite
 
 # Set up logging for debugging
 logging.basicConfig(level=logging.DEBUG)
@@ -11,24 +13,117 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///legal_binder.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+
+# Optional read replica for @read_replica views, skipped for DB_REPLICA_DOWN_SECONDS after a connection
+# error and for DB_REPLICA_STICKY_SECONDS after a browser session writes (see database_pool.py)
+app.config["SQLALCHEMY_BINDS"] = replica_binds(os.environ.get("DATABASE_REPLICA_URL"))
+app.config['DB_REPLICA_DOWN_SECONDS'] = int(os.environ.get('DB_REPLICA_DOWN_SECONDS', '30'))
+app.config['DB_REPLICA_STICKY_SECONDS'] = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', '5'))
+
+# SQLite production mode: WAL, tuned pragmas and a single-writer queue (see sqlite_tuning.py)
+app.config['SQLITE_TUNED'] = os.environ.get('SQLITE_TUNED', 'true').lower() == 'true'
 
 # Configure file uploads
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 
+# Configure semantic search
+app.config['SEMANTIC_INDEX_FOLDER'] = os.environ.get('SEMANTIC_INDEX_FOLDER', 'semantic_index')
+app.config['EMBEDDING_PROVIDER'] = os.environ.get('EMBEDDING_PROVIDER', 'openai')
+
+# Run queued incident severity assessments in a background thread ('thread') or via 'flask assess-incidents' ('off')
+app.config['SEVERITY_WORKER'] = os.environ.get('SEVERITY_WORKER', 'thread')
+
+# Deadline reminders: in-process scheduler ('thread') or 'flask run-reminder-scheduler' ('off')
+app.config['REMINDER_SCHEDULER'] = os.environ.get('REMINDER_SCHEDULER', 'thread')
+app.config['REMINDER_SINKS'] = [s.strip() for s in os.environ.get('REMINDER_SINKS', 'log').split(',') if s.strip()]
+app.config['REMINDER_SMTP_HOST'] = os.environ.get('REMINDER_SMTP_HOST', 'localhost')
+app.config['REMINDER_SMTP_PORT'] = int(os.environ.get('REMINDER_SMTP_PORT', '1025'))
+app.config['REMINDER_EMAIL_FROM'] = os.environ.get('REMINDER_EMAIL_FROM', 'reminders@localhost')
+app.config['REMINDER_EMAIL_TO'] = os.environ.get('REMINDER_EMAIL_TO')
+app.config['REMINDER_WEBHOOK_URL'] = os.environ.get('REMINDER_WEBHOOK_URL')
+
+# Template fragment cache: 'memory' (per-process LRU), 'filesystem' (shared by workers) or 'off'
+app.config['FRAGMENT_CACHE_BACKEND'] = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')
+app.config['FRAGMENT_CACHE_DIR'] = os.environ.get('FRAGMENT_CACHE_DIR', 'fragment_cache')
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', '512'))
+
+# Form autosave drafts expire after DRAFT_TTL_DAYS; pruned by a background thread ('thread') or 'flask prune-drafts' ('off')
+app.config['DRAFT_TTL_DAYS'] = int(os.environ.get('DRAFT_TTL_DAYS', '30'))
+app.config['DRAFT_CLEANUP'] = os.environ.get('DRAFT_CLEANUP', 'thread')
+
+# Static assets are fingerprinted and precompressed into ASSET_BUILD_FOLDER; dynamic responses
+# at least COMPRESS_MIN_SIZE bytes are compressed on the fly
+app.config['ASSET_BUILD_FOLDER'] = os.environ.get('ASSET_BUILD_FOLDER', 'static_build')
+app.config['ASSET_PRECOMPRESS'] = os.environ.get('ASSET_PRECOMPRESS', 'true').lower() == 'true'
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+
+# Admin-only request profiling (see profiling.py); disabled entirely unless PROFILER_TOKEN is set
+app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN')
+app.config['PROFILER_INTERVAL_MS'] = float(os.environ.get('PROFILER_INTERVAL_MS', '5'))
+app.config['PROFILER_MAX_PROFILES'] = int(os.environ.get('PROFILER_MAX_PROFILES', '50'))
+
+# OpenAI model tiers, per-task overrides ("case_summary=small,...") and per-case monthly token budgets
+# (0 = unlimited; cheaper models only past the soft ratio) - see model_router.py
+app.config['OPENAI_MODEL_LARGE'] = os.environ.get('OPENAI_MODEL_LARGE', 'gpt-4o')
+app.config['OPENAI_MODEL_SMALL'] = os.environ.get('OPENAI_MODEL_SMALL', 'gpt-4o-mini')
+app.config['OPENAI_TASK_TIERS'] = dict(item.strip().split('=', 1) for item in os.environ.get('OPENAI_TASK_TIERS', '').split(',') if '=' in item)
+app.config['OPENAI_MAX_IN_FLIGHT'] = int(os.environ.get('OPENAI_MAX_IN_FLIGHT', '8'))
+# Latencies older than the window are forgotten; a tier skipped for latency still gets one probe request per interval
+app.config['OPENAI_LATENCY_WINDOW_SECONDS'] = float(os.environ.get('OPENAI_LATENCY_WINDOW_SECONDS', '300'))
+app.config['OPENAI_LATENCY_PROBE_SECONDS'] = float(os.environ.get('OPENAI_LATENCY_PROBE_SECONDS', '60'))
+app.config['AI_CASE_MONTHLY_TOKEN_BUDGET'] = int(os.environ.get('AI_CASE_MONTHLY_TOKEN_BUDGET', '0'))
+app.config['AI_BUDGET_SOFT_RATIO'] = float(os.environ.get('AI_BUDGET_SOFT_RATIO', '0.8'))
+
+# Preparation checklists are shared per case type and hearing type and regenerated after CHECKLIST_MAX_AGE_DAYS
+# by a background thread ('thread') or 'flask refresh-checklists' ('off')
+app.config['CHECKLIST_MAX_AGE_DAYS'] = int(os.environ.get('CHECKLIST_MAX_AGE_DAYS', '30'))
+app.config['CHECKLIST_REFRESH'] = os.environ.get('CHECKLIST_REFRESH', 'thread')
+
+# Token-bucket limits on the AI routes per client and overall; requests are queued for up to
+# RATE_LIMIT_MAX_WAIT seconds, then shed with 429. Backend 'memory' (per process), 'database' or 'off' (see rate_limit.py)
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+app.config['RATE_LIMIT_CLIENT_PER_MINUTE'] = float(os.environ.get('RATE_LIMIT_CLIENT_PER_MINUTE', '6'))
+app.config['RATE_LIMIT_CLIENT_BURST'] = float(os.environ.get('RATE_LIMIT_CLIENT_BURST', '6'))
+app.config['RATE_LIMIT_GLOBAL_PER_MINUTE'] = float(os.environ.get('RATE_LIMIT_GLOBAL_PER_MINUTE', '60'))
+app.config['RATE_LIMIT_GLOBAL_BURST'] = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', '30'))
+app.config['RATE_LIMIT_MAX_WAIT'] = float(os.environ.get('RATE_LIMIT_MAX_WAIT', '2'))
+app.config['RATE_LIMIT_MAX_QUEUE'] = int(os.environ.get('RATE_LIMIT_MAX_QUEUE', '4'))
+app.config['AI_MAX_CONCURRENT'] = int(os.environ.get('AI_MAX_CONCURRENT', '0'))  # Per process; 0 = no cap
+# Per-client limits key on the client address, taken from X-Forwarded-For through PROXY_FIX_X_FOR trusted proxies
+# (1: the deployment's reverse proxy). Set it to 0 when the app is reached directly, where a client could otherwise
+# send a new X-Forwarded-For for a fresh bucket each time, and to 2 or more behind a chain of proxies
+app.config['PROXY_FIX_X_FOR'] = int(os.environ.get('PROXY_FIX_X_FOR', '1'))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'], x_proto=1, x_host=1)
+
+# Incremental backups of the database, uploads and case archives written by 'flask backup' (see backup.py);
+# BACKUP_KEEP snapshots are kept (0 = all) and files are copied by BACKUP_WORKERS threads
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', 'backups')
+app.config['BACKUP_WORKERS'] = int(os.environ.get('BACKUP_WORKERS', '4'))
+app.config['BACKUP_KEEP'] = int(os.environ.get('BACKUP_KEEP', '0'))
+
+# Closed cases move into compressed archives in ARCHIVE_DIR after ARCHIVE_AFTER_DAYS and come back on first access;
+# archived by a background thread ('thread') or 'flask archive-cases' ('off') - see case_archive.py
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', 'case_archives')
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+app.config['ARCHIVE_VACUUM_FREE_RATIO'] = float(os.environ.get('ARCHIVE_VACUUM_FREE_RATIO', '0.2'))
+app.config['CASE_ARCHIVER'] = os.environ.get('CASE_ARCHIVER', 'thread')
+
+# One SQLite file per case in CASE_SHARD_DIR ('sqlite') rather than every case in the main database ('off');
+# CASE_SHARD_CACHE_SIZE shard engines stay open per process (see case_shards.py)
+app.config['CASE_SHARDING'] = os.environ.get('CASE_SHARDING', 'off')
+app.config['CASE_SHARD_DIR'] = os.environ.get('CASE_SHARD_DIR', 'case_shards')
+app.config['CASE_SHARD_CACHE_SIZE'] = int(os.environ.get('CASE_SHARD_CACHE_SIZE', '32'))
+
 # Create uploads directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
@@ -36,11 +131,64 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 db.init_app(app)
 
 with app.app_context():
+    if is_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]) and app.config['SQLITE_TUNED']:
+        from sqlite_tuning import install_sqlite_mode
+        app.extensions['sqlite_writer'] = install_sqlite_mode(db.engine)
+    
+    from database_pool import init_database_routing
+    init_database_routing(app, db)
+    
     # Import models and routes
     import models  # noqa: F401
     import routes  # noqa: F401
+    import api  # noqa: F401
+    import commands  # noqa: F401
+    
+    from fragment_cache import init_fragment_cache
+    init_fragment_cache(app)
+    
+    from static_assets import init_static_assets
+    from compression import init_response_compression
+    init_static_assets(app)
+    init_response_compression(app)
+    
+    from profiling import init_profiler
+    init_profiler(app)
+    
+    from rate_limit import init_rate_limits
+    init_rate_limits(app, db)
+    
+    from case_shards import init_case_shards
+    init_case_shards(app)
+    
+    from case_archive import init_case_archive
+    init_case_archive(app)
     
     db.create_all()
+    
+    from schema_migrations import upgrade_schema
+    for change in upgrade_schema():
+        app.logger.info(f"Schema upgrade: {change}")
+    
+    if app.config['SEVERITY_WORKER'] == 'thread':
+        from severity_queue import start_severity_worker
+        start_severity_worker(app)
+    
+    if app.config['REMINDER_SCHEDULER'] == 'thread':
+        from reminder_scheduler import start_reminder_scheduler
+        start_reminder_scheduler(app)
+    
+    if app.config['DRAFT_CLEANUP'] == 'thread':
+        from drafts import start_draft_cleanup
+        start_draft_cleanup(app)
+    
+    if app.config['CHECKLIST_REFRESH'] == 'thread':
+        from checklist_catalog import start_checklist_refresher
+        start_checklist_refresher(app)
+    
+    if app.config['CASE_ARCHIVER'] == 'thread':
+        from case_archive import start_case_archiver
+        start_case_archiver(app)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -3,25 +3,180 @@
 Supabase Authentication Service
 """
 
+import hashlib
+import json
 import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+import httpx
+import jwt
 from supabase import create_client, Client
+from supabase_auth.errors import AuthError
 from dotenv import load_dotenv
 from typing import Optional, Dict, Any
 
 # Load environment variables first
 load_dotenv()
 
+_MISSING = object()
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after a per-entry TTL"""
+    
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+class SigningKeyUnavailable(Exception):
+    """Raised when a token's signing key cannot be resolved locally"""
+
+class StaticKeyProvider:
+    """Fixed signing keys, e.g. the project's legacy HS256 JWT secret or a test key"""
+    
+    def __init__(self, keys: Dict[Optional[str], Any], algorithms=("HS256",)):
+        self.keys = keys
+        self.algorithms = list(algorithms)
+    
+    def get_key(self, kid: Optional[str], algorithm: str) -> Any:
+        key = self.keys.get(kid, self.keys.get(None))
+        if key is None or algorithm not in self.algorithms:
+            raise SigningKeyUnavailable(f"No signing key for kid={kid} alg={algorithm}")
+        return key
+
+class JWKSKeyProvider:
+    """Supabase signing keys fetched from the JWKS endpoint and cached in memory
+    
+    Keys are refetched after ``refresh_interval`` or when a token names an
+    unknown ``kid`` (key rotation), but never more often than
+    ``min_refresh_interval`` so forged kids cannot hammer the endpoint.
+    """
+    
+    def __init__(self, jwks_url: str, refresh_interval: float = 3600, min_refresh_interval: float = 30,
+                 timeout: float = 5):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys: Dict[str, Any] = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _fetch(self) -> None:
+        with urllib.request.urlopen(self.jwks_url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read().decode("utf-8"))
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            try:
+                parsed = jwt.PyJWK.from_dict(jwk)
+            except jwt.PyJWTError:
+                continue
+            keys[parsed.key_id] = parsed
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+    
+    def get_key(self, kid: Optional[str], algorithm: str) -> Any:
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            if age > self.refresh_interval or (kid not in self._keys and age > self.min_refresh_interval):
+                try:
+                    self._fetch()
+                except Exception as e:
+                    if not self._keys:
+                        raise SigningKeyUnavailable(f"Could not fetch signing keys: {e}")
+            jwk = self._keys.get(kid)
+        if jwk is None or jwk.algorithm_name != algorithm:
+            raise SigningKeyUnavailable(f"No signing key for kid={kid} alg={algorithm}")
+        return jwk.key
+
+class SessionVerifier:
+    """Verifies Supabase access tokens locally against cached signing keys"""
+    
+    def __init__(self, key_provider, audience: str = "authenticated", issuer: Optional[str] = None,
+                 leeway: int = 10):
+        self.key_provider = key_provider
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+    
+    def verify(self, access_token: str) -> Dict[str, Any]:
+        """Return the token claims, raising jwt.InvalidTokenError or SigningKeyUnavailable"""
+        header = jwt.get_unverified_header(access_token)
+        algorithm = header.get("alg")
+        if not algorithm or algorithm == "none":
+            raise jwt.InvalidAlgorithmError("Unsigned token")
+        key = self.key_provider.get_key(header.get("kid"), algorithm)
+        options = {"require": ["exp", "sub"]}
+        return jwt.decode(access_token, key, algorithms=[algorithm], audience=self.audience,
+                          issuer=self.issuer, leeway=self.leeway, options=options)
+
+def user_from_claims(claims: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape verified JWT claims like the user returned by Supabase"""
+    return {
+        "id": claims.get("sub"),
+        "email": claims.get("email"),
+        "phone": claims.get("phone"),
+        "role": claims.get("role"),
+        "aud": claims.get("aud"),
+        "app_metadata": claims.get("app_metadata", {}),
+        "user_metadata": claims.get("user_metadata", {}),
+        "session_id": claims.get("session_id"),
+        "exp": claims.get("exp"),
+    }
+
+def build_session_verifier(url: str) -> SessionVerifier:
+    """Verifier using SUPABASE_JWT_SECRET if set, otherwise the project's JWKS endpoint"""
+    secret = os.getenv("SUPABASE_JWT_SECRET")
+    if secret:
+        key_provider = StaticKeyProvider({None: secret})
+    else:
+        key_provider = JWKSKeyProvider(f"{url.rstrip('/')}/auth/v1/.well-known/jwks.json")
+    return SessionVerifier(key_provider, issuer=f"{url.rstrip('/')}/auth/v1")
+
 class AuthService:
-    def __init__(self):
+    def __init__(self, client: Optional[Client] = None, verifier: Optional[SessionVerifier] = None):
         url = os.getenv("SUPABASE_URL")
         key = os.getenv("SUPABASE_ANON_KEY")
         
-        if not url or not key:
+        if client is None and (not url or not key):
             print(f"Debug - URL: {url}")
             print(f"Debug - Key: {key[:20]}..." if key else "None")
             raise ValueError("Missing Supabase URL or API key")
             
-        self.supabase: Client = create_client(url, key)
+        self.supabase: Client = client if client is not None else create_client(url, key)
+        self.verifier = verifier if verifier is not None else (build_session_verifier(url) if url else None)
+        
+        # Verified sessions are trusted for a short TTL (capped at token expiry);
+        # rejected tokens are remembered so repeated bad requests stay local
+        self.session_ttl = float(os.getenv("SESSION_CACHE_TTL", "60"))
+        self.negative_ttl = float(os.getenv("SESSION_NEGATIVE_CACHE_TTL", "30"))
+        self._session_cache = TTLCache(self.session_ttl)
     
     def sign_up(self, email: str, password: str, metadata: Optional[Dict] = None) -> Dict[str, Any]:
         """Sign up a new user"""
@@ -103,12 +258,41 @@ class AuthService:
             }
     
     def verify_session(self, access_token: str) -> Optional[Dict[str, Any]]:
-        """Verify a session token"""
+        """Verify a session token, locally where possible and cached for a short TTL"""
+        if not access_token:
+            return None
+        cache_key = hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+        cached = self._session_cache.get(cache_key)
+        if cached is not _MISSING:
+            return cached
+        
+        if self.verifier is not None:
+            try:
+                claims = self.verifier.verify(access_token)
+                ttl = min(self.session_ttl, claims["exp"] - time.time())
+                user = user_from_claims(claims)
+                self._session_cache.set(cache_key, user, ttl=max(ttl, 0))
+                return user
+            except SigningKeyUnavailable:
+                pass  # Fall through to Supabase
+            except jwt.PyJWTError:
+                self._session_cache.set(cache_key, None, ttl=self.negative_ttl)
+                return None
+        
         try:
             response = self.supabase.auth.get_user(access_token)
-            return response.user if response else None
-        except:
-            return None
+            user = response.user if response else None
+        except httpx.HTTPError:
+            return None  # Supabase unreachable (connection refused, timeout): not a verdict on the token, so not cached
+        except AuthError as e:
+            if not 400 <= (getattr(e, "status", 0) or 0) < 500:
+                return None  # Supabase failing: not cached either
+            user = None  # Rejected by Supabase
+        if user is not None and hasattr(user, "model_dump"):
+            user = user.model_dump()
+        self._session_cache.set(cache_key, user, ttl=self.session_ttl if user else self.negative_ttl)
+        return user
+
 
 # Create the auth service instance only when this module is imported
 def get_auth_service():
@@ -0,0 +1,440 @@
+"""
+Incremental backups of the database, case shards and the uploads folder
+
+A backup repository (BACKUP_DIR) holds:
+
+    blobs/ab/abcdef...              upload and case archive contents, stored once per SHA-256
+    snapshots/<id>/database.sqlite.gz   SQLite online backup, gzipped
+    snapshots/<id>/database.dump        or pg_dump custom format (already compressed)
+    snapshots/<id>/shards/case-<id>.db.gz   SQLite online backup of each case shard (CASE_SHARDING)
+    snapshots/<id>/manifest.json.gz     database and shard checksums, upload and archive path -> hash, timings
+
+The database is snapshotted first, online: the SQLite backup API copies a
+consistent image while the app keeps running, and pg_dump runs in one
+transaction; case shards follow, each through the backup API. Uploads, and
+the case archives in ARCHIVE_DIR (an archived
+case's only copy), are then scanned in parallel. A file whose size and
+mtime match the previous manifest reuses its hash without being read; others
+are hashed while being copied, and only contents not already in blobs/ are
+kept, so each backup costs roughly the new and changed files.
+
+Restores copy blobs back in parallel and check every file against its hash,
+and the database against its checksum (plus PRAGMA integrity_check for
+SQLite) before anything replaces the live copies. ``flask verify-backup``
+restores into a scratch directory to prove a snapshot restores and to time
+it.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.request import pathname2url
+
+from sqlalchemy.engine import make_url
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = 'manifest.json.gz'
+MANIFEST_VERSION = 1
+SHARD_PATTERN = re.compile(r'case-\d+\.db')
+
+
+class BackupError(Exception):
+    """A snapshot is missing, incomplete or fails verification"""
+
+
+@contextmanager
+def timed(timings, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - started, 3)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_hashing(source, destination):
+    """Copy a file, returning the SHA-256 of what was copied"""
+    digest = hashlib.sha256()
+    with open(source, 'rb') as reader, open(destination, 'wb') as writer:
+        for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            writer.write(chunk)
+    return digest.hexdigest()
+
+
+def _scratch_file(directory, suffix):
+    descriptor, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(descriptor)
+    return path
+
+
+def _write_json_gz(path, data):
+    partial = path + '.partial'
+    with gzip.open(partial, 'wt', encoding='utf-8') as stream:
+        json.dump(data, stream, indent=1, sort_keys=True)
+    os.replace(partial, path)
+
+
+def _read_json_gz(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as stream:
+        return json.load(stream)
+
+
+def _postgres_command_env(uri):
+    """libpq URL without the SQLAlchemy driver suffix, and the password passed through the environment"""
+    url = make_url(uri)
+    env = dict(os.environ)
+    if url.password:
+        env['PGPASSWORD'] = url.password
+    return url.set(drivername='postgresql', password=None).render_as_string(hide_password=False), env
+
+
+class BackupRepository:
+    def __init__(self, root, workers=4):
+        self.root = root
+        self.workers = max(1, workers)
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.snapshot_dir = os.path.join(root, 'snapshots')
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def snapshots(self):
+        """Complete snapshot IDs, oldest first"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        return sorted(name for name in os.listdir(self.snapshot_dir)
+                      if os.path.exists(os.path.join(self.snapshot_dir, name, MANIFEST_NAME)))
+
+    def manifest(self, snapshot_id=None):
+        snapshots = self.snapshots()
+        if snapshot_id is None:
+            if not snapshots:
+                raise BackupError(f"No snapshots in {self.root}")
+            snapshot_id = snapshots[-1]
+        elif snapshot_id not in snapshots:
+            raise BackupError(f"No complete snapshot {snapshot_id} in {self.root}")
+        return _read_json_gz(os.path.join(self.snapshot_dir, snapshot_id, MANIFEST_NAME))
+
+    def _new_snapshot_dir(self):
+        snapshot_id = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        path = os.path.join(self.snapshot_dir, snapshot_id)
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.snapshot_dir, f"{snapshot_id}-{suffix}")
+        os.makedirs(path)
+        return os.path.basename(path), path
+
+    # Backup
+
+    def _snapshot_sqlite(self, database_path, snapshot_path, name='database.sqlite.gz'):
+        scratch = _scratch_file(snapshot_path, '.sqlite')
+        try:
+            # mode=rw so a database deleted since it was listed is reported, not recreated empty
+            source = sqlite3.connect(f"file:{pathname2url(os.path.abspath(database_path))}?mode=rw", uri=True)
+            target = sqlite3.connect(scratch)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            digest = hashlib.sha256()
+            os.makedirs(os.path.dirname(os.path.join(snapshot_path, name)), exist_ok=True)
+            with open(scratch, 'rb') as reader, gzip.open(os.path.join(snapshot_path, name), 'wb',
+                                                          compresslevel=6) as writer:
+                for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    writer.write(chunk)
+            return {'backend': 'sqlite', 'file': name, 'size': os.path.getsize(scratch),
+                    'sha256': digest.hexdigest()}
+        finally:
+            os.unlink(scratch)
+
+    def _snapshot_shard(self, shard_dir, filename, snapshot_path):
+        try:
+            return self._snapshot_sqlite(os.path.join(shard_dir, filename), snapshot_path,
+                                         f"shards/{filename}.gz")
+        except sqlite3.OperationalError:
+            if not os.path.exists(os.path.join(shard_dir, filename)):
+                return None  # Case deleted since the scan
+            raise
+
+    def _snapshot_postgres(self, uri, snapshot_path):
+        target = os.path.join(snapshot_path, 'database.dump')
+        url, env = _postgres_command_env(uri)
+        subprocess.run(['pg_dump', '--format=custom', '--no-owner', f'--file={target}', url],
+                       env=env, check=True, capture_output=True)
+        return {'backend': 'postgresql', 'file': 'database.dump', 'size': os.path.getsize(target),
+                'sha256': file_sha256(target)}
+
+    def _backup_file(self, upload_folder, relative_path, previous):
+        path = os.path.join(upload_folder, relative_path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None, 'vanished', 0  # Deleted since the scan
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns \
+                and os.path.exists(self.blob_path(previous['sha256'])):
+            return dict(entry, sha256=previous['sha256']), 'unchanged', 0
+        # Hashed while copying so the file is read once; the copy is dropped if the blob already exists
+        os.makedirs(self.blob_dir, exist_ok=True)
+        scratch = _scratch_file(self.blob_dir, '.partial')
+        try:
+            sha256 = copy_hashing(path, scratch)
+            blob = self.blob_path(sha256)
+            if os.path.exists(blob):
+                return dict(entry, sha256=sha256), 'deduplicated', 0
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(scratch, blob)
+            return dict(entry, sha256=sha256), 'copied', stat.st_size
+        finally:
+            if os.path.exists(scratch):
+                os.unlink(scratch)
+
+    def backup(self, database_uri, upload_folder, rehash=False, archive_dir=None, shard_dir=None):
+        """Snapshot the database, case shards, uploads and case archives; returns the new manifest"""
+        timings = {}
+        started = time.perf_counter()
+        previous = {}
+        if not rehash and self.snapshots():
+            previous = self.manifest()
+        snapshot_id, snapshot_path = self._new_snapshot_dir()
+        try:
+            manifest = self._backup_into(snapshot_id, snapshot_path, database_uri, upload_folder, archive_dir,
+                                         shard_dir, previous, timings)
+        except BaseException:
+            shutil.rmtree(snapshot_path, ignore_errors=True)
+            raise
+        timings['total_seconds'] = round(time.perf_counter() - started, 3)
+        # Written last: a snapshot without a manifest is incomplete and ignored
+        _write_json_gz(os.path.join(snapshot_path, MANIFEST_NAME), manifest)
+        return manifest
+
+    def _backup_tree(self, root, previous):
+        """Copy new and changed files under root into blobs; returns (relative path -> entry, counts, bytes copied)"""
+        relative_paths = []
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                relative_paths.append(os.path.relpath(os.path.join(directory, filename), root))
+
+        files, counts, bytes_copied = {}, {'unchanged': 0, 'deduplicated': 0, 'copied': 0, 'vanished': 0}, 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = pool.map(lambda path: (path, self._backup_file(root, path, previous.get(path))),
+                               relative_paths)
+            for relative_path, (entry, outcome, copied) in results:
+                if entry is not None:
+                    files[relative_path] = entry
+                counts[outcome] += 1
+                bytes_copied += copied
+        return files, counts, bytes_copied
+
+    def _backup_into(self, snapshot_id, snapshot_path, database_uri, upload_folder, archive_dir, shard_dir,
+                     previous, timings):
+        with timed(timings, 'database_seconds'):
+            if make_url(database_uri).get_backend_name() == 'sqlite':
+                database = self._snapshot_sqlite(make_url(database_uri).database, snapshot_path)
+            else:
+                database = self._snapshot_postgres(database_uri, snapshot_path)
+
+        # Each case shard is its own SQLite database, snapshotted the same way as the main one
+        shards = {}
+        if shard_dir and os.path.isdir(shard_dir):
+            with timed(timings, 'shards_seconds'), ThreadPoolExecutor(self.workers) as pool:
+                filenames = sorted(name for name in os.listdir(shard_dir) if SHARD_PATTERN.fullmatch(name))
+                for filename, shard in zip(filenames, pool.map(
+                        lambda name: self._snapshot_shard(shard_dir, name, snapshot_path), filenames)):
+                    if shard is not None:
+                        shards[filename] = shard
+
+        with timed(timings, 'files_seconds'):
+            files, counts, bytes_copied = self._backup_tree(upload_folder, previous.get('files', {}))
+
+        # Archived cases exist only as their archive file, so they are backed up like uploads
+        archives = {}
+        if archive_dir:
+            with timed(timings, 'archives_seconds'):
+                archives, archive_counts, archive_bytes = self._backup_tree(archive_dir,
+                                                                            previous.get('archives', {}))
+            for outcome, count in archive_counts.items():
+                counts[outcome] += count
+            bytes_copied += archive_bytes
+
+        return {
+            'version': MANIFEST_VERSION,
+            'id': snapshot_id,
+            'created_at': datetime.utcnow().isoformat(),
+            'database': database,
+            'shards': shards,
+            'files': files,
+            'archives': archives,
+            'stats': dict(counts, files=len(files), archives=len(archives), shards=len(shards),
+                          shard_bytes=sum(shard['size'] for shard in shards.values()), bytes_copied=bytes_copied,
+                          bytes_total=sum(entry['size'] for entry in list(files.values()) + list(archives.values()))),
+            'timings': timings,
+        }
+
+    # Restore
+
+    def _restore_file(self, root, relative_path, entry):
+        target = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        blob = self.blob_path(entry['sha256'])
+        if not os.path.exists(blob):
+            raise BackupError(f"Missing blob for {relative_path}")
+        partial = target + '.partial'
+        if copy_hashing(blob, partial) != entry['sha256']:
+            os.unlink(partial)
+            raise BackupError(f"Checksum mismatch for {relative_path}")
+        os.replace(partial, target)
+        return entry['size']
+
+    def _check_blob(self, relative_path, entry):
+        blob = self.blob_path(entry['sha256'])
+        if not os.path.exists(blob):
+            raise BackupError(f"Missing blob for {relative_path}")
+        if file_sha256(blob) != entry['sha256']:
+            raise BackupError(f"Checksum mismatch for {relative_path}")
+
+    def _restore_sqlite(self, snapshot_path, database, database_path):
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        partial = database_path + '.partial'
+        digest = hashlib.sha256()
+        with gzip.open(os.path.join(snapshot_path, database['file']), 'rb') as reader, open(partial, 'wb') as writer:
+            for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                writer.write(chunk)
+        if digest.hexdigest() != database['sha256']:
+            os.unlink(partial)
+            raise BackupError(f"Checksum mismatch for {database['file']}")
+        connection = sqlite3.connect(partial)
+        try:
+            result = connection.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            connection.close()
+        if result != 'ok':
+            os.unlink(partial)
+            raise BackupError(f"Restored {database['file']} failed integrity_check: {result}")
+        # Stale WAL files from the replaced database must not be applied to the restored one
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(database_path + suffix):
+                os.unlink(database_path + suffix)
+        os.replace(partial, database_path)
+
+    def _restore_postgres(self, snapshot_path, database, database_uri):
+        url, env = _postgres_command_env(database_uri)
+        subprocess.run(['pg_restore', '--clean', '--if-exists', '--no-owner', '--single-transaction',
+                        f'--dbname={url}', os.path.join(snapshot_path, database['file'])],
+                       env=env, check=True, capture_output=True)
+
+    def restore(self, database_uri, upload_folder, snapshot_id=None, archive_dir=None, shard_dir=None):
+        """Restore a snapshot (default: the latest); returns sizes and timings
+
+        With ``database_uri`` None the database archive is only checked, not
+        loaded. Case archives are restored into ``archive_dir``; without one
+        they are still checked against their hashes. Case shards are
+        restored into ``shard_dir``.
+        """
+        manifest = self.manifest(snapshot_id)
+        snapshot_path = os.path.join(self.snapshot_dir, manifest['id'])
+        database = manifest['database']
+        timings = {}
+        started = time.perf_counter()
+
+        with timed(timings, 'files_seconds'), ThreadPoolExecutor(self.workers) as pool:
+            restored_bytes = sum(pool.map(lambda item: self._restore_file(upload_folder, *item),
+                                          manifest['files'].items()))
+
+        archives = manifest.get('archives', {})
+        with timed(timings, 'archives_seconds'):
+            if archive_dir is None:
+                for relative_path, entry in archives.items():
+                    self._check_blob(relative_path, entry)
+            else:
+                with ThreadPoolExecutor(self.workers) as pool:
+                    restored_bytes += sum(pool.map(lambda item: self._restore_file(archive_dir, *item),
+                                                   archives.items()))
+
+        with timed(timings, 'database_seconds'):
+            if database['backend'] == 'postgresql':
+                if file_sha256(os.path.join(snapshot_path, database['file'])) != database['sha256']:
+                    raise BackupError("Database snapshot checksum mismatch")
+                if database_uri is not None:
+                    self._restore_postgres(snapshot_path, database, database_uri)
+            elif database_uri is not None:
+                if make_url(database_uri).get_backend_name() != 'sqlite':
+                    raise BackupError("A SQLite snapshot can only be restored to a SQLite database")
+                self._restore_sqlite(snapshot_path, database, make_url(database_uri).database)
+
+        shards = manifest.get('shards', {})
+        if shards:
+            if shard_dir is None:
+                raise BackupError(f"Snapshot {manifest['id']} has {len(shards)} case shards; "
+                                  f"restore it with CASE_SHARDING on")
+            with timed(timings, 'shards_seconds'), ThreadPoolExecutor(self.workers) as pool:
+                list(pool.map(lambda item: self._restore_sqlite(snapshot_path, item[1],
+                                                                os.path.join(shard_dir, item[0])),
+                              shards.items()))
+
+        timings['total_seconds'] = round(time.perf_counter() - started, 3)
+        return {'id': manifest['id'], 'files': len(manifest['files']), 'archives': len(archives),
+                'shards': len(shards), 'bytes': restored_bytes,
+                'database_bytes': database['size'], 'timings': timings}
+
+    def verify(self, snapshot_id=None):
+        """Restore a snapshot into a scratch directory, checking every checksum, then discard it
+
+        SQLite snapshots are restored in full; pg_restore needs a server, so
+        for PostgreSQL the dump's checksum is checked and only the uploads are
+        restored.
+        """
+        manifest = self.manifest(snapshot_id)
+        scratch = tempfile.mkdtemp(prefix='verify-backup-')
+        try:
+            database_uri = None
+            if manifest['database']['backend'] == 'sqlite':
+                database_uri = f"sqlite:///{os.path.join(scratch, 'database.sqlite')}"
+            return self.restore(database_uri, os.path.join(scratch, 'uploads'), manifest['id'],
+                                archive_dir=os.path.join(scratch, 'archives'),
+                                shard_dir=os.path.join(scratch, 'shards'))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def prune(self, keep):
+        """Delete all but the newest ``keep`` snapshots and the blobs only they used; returns (snapshots, blobs) removed"""
+        snapshots = self.snapshots()
+        expired = snapshots[:-keep] if keep > 0 else []
+        for snapshot_id in expired:
+            shutil.rmtree(os.path.join(self.snapshot_dir, snapshot_id))
+        if not expired:
+            return 0, 0
+        referenced = set()
+        for snapshot_id in self.snapshots():
+            manifest = self.manifest(snapshot_id)
+            for entries in (manifest['files'], manifest.get('archives', {})):
+                referenced.update(entry['sha256'] for entry in entries.values())
+        removed = 0
+        for directory, _, filenames in os.walk(self.blob_dir):
+            for filename in filenames:
+                if filename not in referenced:
+                    os.unlink(os.path.join(directory, filename))
+                    removed += 1
+        return len(expired), removed
@@ -0,0 +1,251 @@
+"""
+Streaming court binder export: a ZIP of case documents plus generated PDFs
+"""
+
+import os
+import re
+import textwrap
+import zipfile
+from datetime import datetime
+
+BLOCK_SIZE = 64 * 1024
+
+# Formats that are already compressed are stored as-is to save CPU
+STORED_TYPES = {'jpg', 'jpeg', 'png', 'gif', 'mp3', 'ogg', 'docx'}
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 54
+LINE_HEIGHT = 14
+WRAP_WIDTH = 95
+
+
+class SimplePDF:
+    """Minimal multi-page text PDF writer using the built-in Helvetica fonts"""
+
+    def __init__(self, title):
+        self.title = title
+        self.pages = []
+        self._lines = []
+        self._y = PAGE_HEIGHT - MARGIN
+
+    @staticmethod
+    def _escape(text):
+        text = str(text).encode('latin-1', 'replace').decode('latin-1')
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    def _emit(self, text, font, size, indent=0):
+        if self._y < MARGIN + LINE_HEIGHT:
+            self._new_page()
+        self._lines.append(f"BT /{font} {size} Tf {MARGIN + indent} {self._y} Td ({self._escape(text)}) Tj ET")
+        self._y -= LINE_HEIGHT + (size - 10)
+
+    def _new_page(self):
+        if self._lines:
+            self.pages.append('\n'.join(self._lines))
+        self._lines = []
+        self._y = PAGE_HEIGHT - MARGIN
+
+    def heading(self, text, size=16):
+        self._emit(text, 'F2', size)
+        self._y -= 4
+
+    def line(self, text='', indent=0, bold=False):
+        self._emit(text, 'F2' if bold else 'F1', 10, indent)
+
+    def paragraph(self, text, indent=0):
+        for source_line in str(text or '').splitlines() or ['']:
+            for wrapped in textwrap.wrap(source_line, WRAP_WIDTH - indent // 6) or ['']:
+                self.line(wrapped, indent)
+
+    def field(self, label, value):
+        if value in (None, ''):
+            return
+        self.line(f"{label}:", bold=True)
+        self.paragraph(value, indent=12)
+
+    def to_bytes(self):
+        self._new_page()
+        if not self.pages:
+            self.pages.append('')
+
+        objects = [
+            '<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # Pages, filled in once page object numbers are known
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+            f"<< /Title ({self._escape(self.title)}) /Producer (Legal Case Binder) >>",
+        ]
+        page_ids = []
+        for content in self.pages:
+            stream = content.encode('latin-1')
+            objects.append(f"<< /Length {len(stream)} >>\nstream\n{content}\nendstream")
+            objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                           f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {len(objects)} 0 R >>")
+            page_ids.append(len(objects))
+        objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+        output = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+        xref_offset = len(output)
+        output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+        for offset in offsets:
+            output += f"{offset:010d} 00000 n \n".encode('latin-1')
+        output += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info 5 0 R >>\n"
+                   f"startxref\n{xref_offset}\n%%EOF\n").encode('latin-1')
+        return bytes(output)
+
+
+def _format_date(value, include_time=False):
+    if not value:
+        return ''
+    return value.strftime('%m/%d/%Y %I:%M %p' if include_time else '%m/%d/%Y')
+
+
+def _safe_name(text):
+    text = re.sub(r'[^A-Za-z0-9._ -]+', '_', text or '').strip(' ._')
+    return text[:100] or 'untitled'
+
+
+def document_archive_name(position, document):
+    """Path of a document inside the binder archive"""
+    category = _safe_name((document.category or 'other').replace('_', ' ').title())
+    return f"Documents/{category}/{position:03d}_{_safe_name(document.original_filename)}"
+
+
+def build_index_pdf(case, documents):
+    """Binder table of contents listing every document and where it sits in the archive"""
+    pdf = SimplePDF(f"{case.case_title} - Binder Index")
+    pdf.heading(case.case_title)
+    pdf.line(f"Case number: {case.case_number or 'N/A'}    Court: {case.court_name or 'N/A'}")
+    pdf.line(f"Prepared {datetime.now().strftime('%m/%d/%Y')}")
+    pdf.line()
+    pdf.heading('Document Index', size=13)
+    for position, document in enumerate(documents, start=1):
+        flags = ', '.join(flag for flag, on in [('court filing', document.is_court_filing),
+                                                ('confidential', document.is_confidential)] if on)
+        pdf.line(f"{position:03d}. {document.original_filename}", bold=True)
+        pdf.line(f"Category: {(document.category or 'other').replace('_', ' ').title()}    "
+                 f"Date: {_format_date(document.document_date) or 'undated'}"
+                 f"{'    (' + flags + ')' if flags else ''}", indent=12)
+        pdf.line(f"File: {document_archive_name(position, document)}", indent=12)
+        if document.description:
+            pdf.paragraph(document.description, indent=12)
+    return pdf.to_bytes()
+
+
+def build_timeline_pdf(case, events):
+    """Chronological timeline of incidents, deadlines and dated documents"""
+    pdf = SimplePDF(f"{case.case_title} - Timeline")
+    pdf.heading(f"{case.case_title} - Timeline")
+    for event in sorted(events, key=lambda e: e['date']):
+        pdf.line(f"{_format_date(event['date'], include_time=True)}  [{event['type'].replace('_', ' ').title()}]  {event['title']}",
+                 bold=True)
+        if event.get('description'):
+            pdf.paragraph(event['description'], indent=12)
+    return pdf.to_bytes()
+
+
+CHILD_FIELDS = [
+    ('Date of birth', 'date_of_birth'), ('Gender', 'gender'), ('School', 'school_name'),
+    ('Grade', 'grade_level'), ('School address', 'school_address'), ('School phone', 'school_phone'),
+    ('Primary doctor', 'primary_doctor'), ('Medical conditions', 'medical_conditions'),
+    ('Medications', 'medications'), ('Allergies', 'allergies'), ('Insurance', 'insurance_info'),
+    ('Activities', 'activities'), ('Preferences', 'preferences'), ('Special needs', 'special_needs'),
+    ('Current residence', 'current_residence'), ('Residence address', 'residence_address'),
+]
+
+PARENT_FIELDS = [
+    ('Relationship to children', 'relationship_to_children'), ('Date of birth', 'date_of_birth'),
+    ('Phone', 'phone'), ('Email', 'email'), ('Address', 'address'), ('Employer', 'employer'),
+    ('Job title', 'job_title'), ('Work phone', 'work_phone'), ('Work address', 'work_address'),
+    ('Income', 'income'), ('Housing type', 'housing_type'), ('Housing stability', 'housing_stability'),
+    ('Criminal history', 'criminal_history'), ('Substance abuse history', 'substance_abuse_history'),
+    ('Mental health history', 'mental_health_history'), ('Parenting time', 'parenting_time'),
+    ('Parenting concerns', 'parenting_concerns'),
+]
+
+
+def build_profile_pdf(profile, fields, kind):
+    """Single child or parent profile"""
+    name = f"{profile.first_name} {profile.last_name}"
+    pdf = SimplePDF(f"{kind} Profile - {name}")
+    pdf.heading(f"{kind} Profile: {name}")
+    for label, attribute in fields:
+        value = getattr(profile, attribute)
+        pdf.field(label, _format_date(value) if hasattr(value, 'strftime') else value)
+    return pdf.to_bytes()
+
+
+class _ZipStreamBuffer:
+    """Write-only file object that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_case_binder(case, documents, events, children, parents, block_size=BLOCK_SIZE):
+    """Yield the binder ZIP in chunks without buffering the archive
+
+    Only document metadata is held in memory; uploaded files are read
+    ``block_size`` bytes at a time and each compressed block is yielded as
+    soon as it is produced, so memory stays flat however large the case is.
+    """
+    buffer = _ZipStreamBuffer()
+    archive = zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def add_bytes(name, data):
+        archive.writestr(name, data)
+        return buffer.drain()
+
+    documents = list(documents)
+    yield add_bytes('00_Index.pdf', build_index_pdf(case, documents))
+    yield add_bytes('01_Timeline.pdf', build_timeline_pdf(case, events))
+    for child in children:
+        yield add_bytes(f"02_Children/{_safe_name(f'{child.first_name} {child.last_name}')}_{child.id}.pdf",
+                        build_profile_pdf(child, CHILD_FIELDS, 'Child'))
+    for parent in parents:
+        yield add_bytes(f"03_Parents/{_safe_name(f'{parent.first_name} {parent.last_name}')}_{parent.id}.pdf",
+                        build_profile_pdf(parent, PARENT_FIELDS, 'Parent'))
+
+    for position, document in enumerate(documents, start=1):
+        if not document.file_path or not os.path.exists(document.file_path):
+            yield add_bytes(document_archive_name(position, document) + '.missing.txt',
+                            f"File not found on server: {document.original_filename}\n")
+            continue
+        info = zipfile.ZipInfo(document_archive_name(position, document),
+                               date_time=(document.created_at or datetime.now()).timetuple()[:6])
+        info.compress_type = zipfile.ZIP_STORED if (document.file_type or '') in STORED_TYPES else zipfile.ZIP_DEFLATED
+        with open(document.file_path, 'rb') as source, archive.open(info, mode='w', force_zip64=True) as target:
+            while True:
+                block = source.read(block_size)
+                if not block:
+                    break
+                target.write(block)
+                data = buffer.drain()
+                if data:
+                    yield data
+        yield buffer.drain()
+
+    archive.close()
+    yield buffer.drain()
@@ -0,0 +1,248 @@
+"""
+Bulk import of incidents, deadlines and case notes from CSV or JSON Lines
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import app, db
+from models import Incident, Deadline, CaseNote
+from validation import safe_date_parse, safe_datetime_parse
+from duplicate_detector import record_signature
+from severity_queue import enqueue_incidents, wake_worker
+from reminder_scheduler import schedule_deadlines
+from change_tracking import bump_version
+from incident_children import link_incident_children
+
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+SEVERITIES = ['low', 'medium', 'high', 'critical']
+PRIORITIES = ['low', 'medium', 'high', 'critical']
+
+DATETIME_FORMATS = ['%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S']
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on', 'x'}
+
+
+def parse_import_datetime(value):
+    """Parse the datetime formats accepted by imports; date-only values become midnight"""
+    if isinstance(value, (int, float)) or value is None:
+        return None
+    for format_string in DATETIME_FORMATS:
+        parsed = safe_datetime_parse(value, format_string)
+        if parsed:
+            return parsed
+    parsed_date = safe_date_parse(value)
+    return datetime.combine(parsed_date, datetime.min.time()) if parsed_date else None
+
+
+def _text(row, field, max_length=None):
+    value = row.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _bool(row, field):
+    value = row.get(field)
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def _required(values, row, *fields):
+    for field in fields:
+        if values.get(field) in (None, ''):
+            raw = row.get(field)
+            if raw in (None, ''):
+                raise ValueError(f"{field} is required")
+            raise ValueError(f"{field} has an invalid value: {raw!r}")
+
+
+def _optional_date(row, field):
+    raw = _text(row, field)
+    if raw is None:
+        return None
+    parsed = safe_date_parse(raw)
+    if parsed is None:
+        raise ValueError(f"{field} must be a YYYY-MM-DD date, got {raw!r}")
+    return parsed
+
+
+def _choice(row, field, choices, default=None):
+    value = (_text(row, field) or default)
+    if value is not None:
+        value = value.lower()
+        if value not in choices:
+            raise ValueError(f"{field} must be one of {', '.join(choices)}, got {value!r}")
+    return value
+
+
+def validate_incident(row):
+    """Column values for an incident row, raising ValueError if the row is invalid"""
+    children = row.get('children_involved')
+    values = {
+        'incident_date': parse_import_datetime(_text(row, 'incident_date')),
+        'incident_type': _text(row, 'incident_type', 100) or 'other',
+        'severity': _choice(row, 'severity', SEVERITIES, 'medium'),
+        'title': _text(row, 'title', 200),
+        'description': _text(row, 'description'),
+        'location': _text(row, 'location', 200),
+        'children_involved': json.dumps(children) if isinstance(children, list) else _text(row, 'children_involved'),
+        'other_party_involved': _bool(row, 'other_party_involved'),
+        'witnesses': _text(row, 'witnesses'),
+        'police_report': _bool(row, 'police_report'),
+        'police_report_number': _text(row, 'police_report_number', 100),
+        'photos_taken': _bool(row, 'photos_taken'),
+        'documentation_notes': _text(row, 'documentation_notes'),
+        'action_taken': _text(row, 'action_taken'),
+        'follow_up_needed': _bool(row, 'follow_up_needed'),
+        'follow_up_date': _optional_date(row, 'follow_up_date'),
+    }
+    _required(values, row, 'incident_date', 'title', 'description')
+    return values
+
+
+def validate_deadline(row):
+    """Column values for a deadline row, raising ValueError if the row is invalid"""
+    reminder_days = _text(row, 'reminder_days')
+    try:
+        reminder_days = int(reminder_days) if reminder_days is not None else 7
+    except ValueError:
+        raise ValueError(f"reminder_days must be a whole number, got {reminder_days!r}")
+    values = {
+        'title': _text(row, 'title', 200),
+        'deadline_date': parse_import_datetime(_text(row, 'deadline_date')),
+        'deadline_type': _text(row, 'deadline_type', 100),
+        'description': _text(row, 'description'),
+        'location': _text(row, 'location', 200),
+        'reminder_days': reminder_days,
+        'is_completed': _bool(row, 'is_completed'),
+        'completion_notes': _text(row, 'completion_notes'),
+        'priority': _choice(row, 'priority', PRIORITIES, 'medium'),
+    }
+    _required(values, row, 'title', 'deadline_date')
+    return values
+
+
+def validate_case_note(row):
+    """Column values for a case note row, raising ValueError if the row is invalid"""
+    values = {
+        'title': _text(row, 'title', 200),
+        'content': _text(row, 'content'),
+        'note_type': _text(row, 'note_type', 100) or 'general',
+        'tags': _text(row, 'tags'),
+        'is_important': _bool(row, 'is_important'),
+        'is_confidential': _bool(row, 'is_confidential'),
+    }
+    # Every row of a batch needs the same keys for its single executemany, so rows without a date get now
+    created_at = _text(row, 'created_at')
+    values['created_at'] = parse_import_datetime(created_at) if created_at else datetime.utcnow()
+    values['updated_at'] = values['created_at']
+    _required(values, row, 'title', 'content', 'created_at')
+    return values
+
+
+IMPORTERS = {
+    'incidents': (Incident, validate_incident),
+    'deadlines': (Deadline, validate_deadline),
+    'notes': (CaseNote, validate_case_note),
+}
+
+
+def iter_rows(stream, file_format):
+    """Yield (line_number, row dict) from a binary CSV or JSON Lines stream without loading it whole"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f"Invalid JSON: {e.msg}")
+                continue
+            yield line_number, row if isinstance(row, dict) else ValueError("Each line must be a JSON object")
+    else:
+        raise ValueError(f"Unsupported import format: {file_format}")
+
+
+def detect_format(filename):
+    """Import format from a filename extension"""
+    return 'jsonl' if filename and filename.lower().rsplit('.', 1)[-1] in ('jsonl', 'ndjson', 'json') else 'csv'
+
+
+def _insert_batch(model, case_id, batch, result, analyze_severity):
+    table = model.__table__
+    rows = [dict(values, case_id=case_id) for _, values in batch]
+    try:
+        ids = db.session.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        if model is Incident:
+            for row_id, row in zip(ids, rows):
+                record_signature(case_id, 'incident', row_id, row['description'])
+            link_incident_children(case_id, [(row_id, row['children_involved']) for row_id, row in zip(ids, rows)])
+            if analyze_severity:
+                enqueue_incidents([(row_id, row['severity']) for row_id, row in zip(ids, rows)])
+                result['severity_queued'] += len(ids)
+        elif model is Deadline:
+            schedule_deadlines(list(zip(ids, rows)))
+        # Core inserts bypass the ORM flush hook, so bump the table version here
+        bump_version(case_id, table.name)
+        db.session.commit()
+        result['imported'] += len(rows)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Bulk import batch failed: {str(e)}")
+        for line_number, _ in batch:
+            _record_error(result, line_number, f"Database error: {str(e).splitlines()[0]}")
+
+
+def _record_error(result, line_number, message):
+    result['failed'] += 1
+    if len(result['errors']) < MAX_REPORTED_ERRORS:
+        result['errors'].append({'row': line_number, 'error': message})
+
+
+def import_records(kind, stream, file_format, case_id, analyze_severity=False, batch_size=BATCH_SIZE):
+    """Validate and insert rows in batched transactions, reporting errors per row
+
+    Returns a dict with 'imported', 'failed', 'severity_queued' and a list of
+    per-row 'errors' (capped at MAX_REPORTED_ERRORS).
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"Unknown import type: {kind}")
+    model, validate = IMPORTERS[kind]
+    result = {'imported': 0, 'failed': 0, 'severity_queued': 0, 'errors': []}
+
+    batch = []
+    for line_number, row in iter_rows(stream, file_format):
+        if isinstance(row, Exception):
+            _record_error(result, line_number, str(row))
+            continue
+        try:
+            batch.append((line_number, validate(row)))
+        except ValueError as e:
+            _record_error(result, line_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            _insert_batch(model, case_id, batch, result, analyze_severity)
+            batch = []
+    if batch:
+        _insert_batch(model, case_id, batch, result, analyze_severity)
+    if result['severity_queued']:
+        wake_worker()
+    return result
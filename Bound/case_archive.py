@@ -0,0 +1,366 @@
+"""
+Case lifecycle: closed cases move into compressed cold storage
+
+A case is 'open' until it is closed. ARCHIVE_AFTER_DAYS after closing, the
+archiver writes every row belonging to the case (children, parents,
+documents and their findings, incidents, deadlines and reminders, notes,
+duplicate-detection data, drafts) and its uploaded files into one
+self-contained tar.xz file in ARCHIVE_DIR, reads the file back to check it,
+then deletes the rows in the transaction that marks the case 'archived' and
+removes the uploads. The case row itself stays, so its id, title and AI
+usage history remain.
+
+The first request that touches an archived case (the case_id in the URL or
+query string, else the default case the pages show) restores everything with
+the original ids before the view runs, and the case is 'closed' again; it is
+archived anew once ARCHIVE_AFTER_DAYS have passed since.
+
+Deleting many rows leaves free pages behind and planner statistics stale, so
+each archiving run ends with ANALYZE, plus VACUUM on SQLite once at least
+ARCHIVE_VACUUM_FREE_RATIO of the file is free pages, or VACUUM (ANALYZE) of
+the affected tables on PostgreSQL.
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+
+from flask import request
+from sqlalchemy import delete, func, insert, select, update
+
+from app import db
+from backup import CHUNK_SIZE, file_sha256, _scratch_file
+from change_tracking import bump_case_versions
+from models import (Case, Child, Parent, Document, DocumentFinding, Incident, Deadline, CaseNote, DuplicateSignature,
+                    DuplicateBucket, Draft, SeverityAssessment, DeadlineReminder, incident_child)
+from reminder_scheduler import current_shard, get_scheduler
+from sqlite_tuning import writer_slot
+
+ARCHIVE_FORMAT = 1
+CASE_MODELS = (Child, Parent, Document, DocumentFinding, Incident, Deadline, CaseNote,
+               DuplicateSignature, DuplicateBucket, Draft)
+# Requests under these paths never touch case data, so they skip the archived-case check
+CASE_FREE_PREFIXES = ('/static/', '/assets/', '/metrics/', '/cache/', '/admin/')
+
+_rehydrate_lock = threading.Lock()
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def case_tables(case_id):
+    """(table, where clause) for every table holding a case's rows, parents before children"""
+    incidents = select(Incident.id).where(Incident.case_id == case_id)
+    deadlines = select(Deadline.id).where(Deadline.case_id == case_id)
+    clauses = {model.__table__: model.case_id == case_id for model in CASE_MODELS}
+    clauses[incident_child] = incident_child.c.incident_id.in_(incidents)
+    clauses[SeverityAssessment.__table__] = SeverityAssessment.incident_id.in_(incidents)
+    clauses[DeadlineReminder.__table__] = DeadlineReminder.deadline_id.in_(deadlines)
+    return [(table, clauses[table]) for table in db.metadata.sorted_tables if table in clauses]
+
+
+def archive_path(archive_dir, case_id):
+    return os.path.join(archive_dir, f"case-{case_id}.tar.xz")
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    return value
+
+
+def _decoder(column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    return {datetime: datetime.fromisoformat, date: date.fromisoformat, bytes: base64.b64decode}.get(python_type)
+
+
+def _decode_rows(table, data):
+    decoders = [_decoder(table.c[name]) for name in data['columns']]
+    return [{name: decoder(value) if decoder and value is not None else value
+             for name, decoder, value in zip(data['columns'], decoders, row)} for row in data['rows']]
+
+
+def _case_engine():
+    # The selected case shard when sharding (see case_shards.py), else the main database
+    return db.session.get_bind(mapper=Case.__mapper__)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _add_bytes(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = time.time()
+    archive.addfile(info, io.BytesIO(data))
+
+
+def write_archive(path, manifest, tables):
+    """Write manifest.json, tables.json and the files the manifest lists into a tar.xz, atomically"""
+    partial = _scratch_file(os.path.dirname(path) or '.', '.partial')
+    try:
+        with tarfile.open(partial, 'w:xz') as archive:
+            _add_bytes(archive, 'manifest.json', json.dumps(manifest, indent=1).encode('utf-8'))
+            _add_bytes(archive, 'tables.json', json.dumps(tables, separators=(',', ':')).encode('utf-8'))
+            for entry in manifest['files']:
+                archive.add(entry['path'], arcname=entry['member'], recursive=False)
+        os.replace(partial, path)
+    except BaseException:
+        _remove(partial)
+        raise
+
+
+def _member_sha256(source, destination=None):
+    # Hash an archive member, copying it to ``destination`` on the way if given
+    digest = hashlib.sha256()
+    with open(destination, 'wb') if destination else nullcontext() as writer:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            if writer is not None:
+                writer.write(chunk)
+    return digest.hexdigest()
+
+
+def read_archive(path, restore_files=False):
+    """(manifest, tables) of an archive after checking row counts and file checksums
+
+    With restore_files, each file is also written back to the path it was
+    archived from; a file that fails its checksum is left out and raises.
+    """
+    try:
+        archive = tarfile.open(path, 'r:xz')
+    except (OSError, tarfile.TarError) as e:
+        raise ArchiveError(f"Cannot open archive {path}: {e}")
+    with archive:
+        manifest = json.load(archive.extractfile('manifest.json'))
+        if manifest.get('format') != ARCHIVE_FORMAT:
+            raise ArchiveError(f"{path} has unsupported archive format {manifest.get('format')!r}")
+        tables = json.load(archive.extractfile('tables.json'))
+        for name, count in manifest['tables'].items():
+            if len(tables.get(name, {}).get('rows', ())) != count:
+                raise ArchiveError(f"{path}: {name} has {len(tables.get(name, {}).get('rows', ()))} rows, expected {count}")
+        for entry in manifest['files']:
+            partial = None
+            if restore_files:
+                directory = os.path.dirname(entry['path']) or '.'
+                os.makedirs(directory, exist_ok=True)
+                partial = _scratch_file(directory, '.partial')
+            checksum = _member_sha256(archive.extractfile(entry['member']), partial)
+            if checksum != entry['sha256']:
+                if partial:
+                    _remove(partial)
+                raise ArchiveError(f"{path}: checksum mismatch for {entry['member']}")
+            if partial:
+                os.replace(partial, entry['path'])
+    return manifest, tables
+
+
+def archive_case(app, case_id):
+    """Move a closed case's rows and uploads into its archive file; returns a summary"""
+    archive_dir = app.config['ARCHIVE_DIR']
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(archive_dir, case_id)
+    started = time.perf_counter()
+    try:
+        with writer_slot(app), _case_engine().begin() as connection:
+            case = connection.execute(select(Case.status).where(Case.id == case_id).with_for_update()).first()
+            if case is None:
+                raise ArchiveError(f"Case {case_id} does not exist")
+            if case.status != 'closed':
+                raise ArchiveError(f"Case {case_id} is {case.status}; only closed cases are archived")
+
+            tables = {}
+            for table, clause in case_tables(case_id):
+                result = connection.execute(select(table).where(clause))
+                tables[table.name] = {'columns': list(result.keys()),
+                                      'rows': [[_encode(value) for value in row] for row in result]}
+            documents = _decode_rows(Document.__table__, tables[Document.__tablename__])
+            files = []
+            for document in documents:
+                if document['file_path'] and os.path.isfile(document['file_path']):
+                    files.append({'member': f"files/{document['id']}/{os.path.basename(document['file_path'])}",
+                                  'path': document['file_path'], 'size': os.path.getsize(document['file_path']),
+                                  'sha256': file_sha256(document['file_path'])})
+                else:
+                    app.logger.warning(f"Archiving case {case_id}: upload of document {document['id']} is missing")
+            manifest = {'format': ARCHIVE_FORMAT, 'case_id': case_id, 'archived_at': datetime.utcnow().isoformat(),
+                        'tables': {name: len(data['rows']) for name, data in tables.items()}, 'files': files}
+            write_archive(path, manifest, tables)
+            read_archive(path)  # Nothing is deleted until the archive reads back intact
+
+            # Children first; the subqueries on incident and deadline ids still see their parents
+            for table, clause in reversed(case_tables(case_id)):
+                deleted = connection.execute(delete(table).where(clause)).rowcount
+                if deleted != manifest['tables'][table.name]:
+                    raise ArchiveError(f"{table.name} rows of case {case_id} changed while it was being archived")
+            connection.execute(update(Case.__table__).where(Case.id == case_id).values(
+                status='archived', archived_at=datetime.utcnow(), archive_file=os.path.basename(path)))
+            bump_case_versions(connection, case_id)
+    except BaseException:
+        _remove(path)
+        raise
+
+    for entry in files:
+        _remove(entry['path'])
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        for deadline in _decode_rows(Deadline.__table__, tables[Deadline.__tablename__]):
+            scheduler.discard(current_shard(), deadline['id'])
+    return {'case_id': case_id, 'path': path, 'rows': sum(manifest['tables'].values()), 'files': len(files),
+            'bytes': os.path.getsize(path), 'seconds': time.perf_counter() - started}
+
+
+def rehydrate_case(app, case_id):
+    """Restore an archived case's rows and uploads and mark it closed; returns a summary, or None if not archived"""
+    started = time.perf_counter()
+    with _rehydrate_lock, writer_slot(app), _case_engine().begin() as connection:
+        case = connection.execute(select(Case.status, Case.archive_file)
+                                  .where(Case.id == case_id).with_for_update()).first()
+        if case is None or case.status != 'archived':
+            return None  # Another request got there first
+        path = os.path.join(app.config['ARCHIVE_DIR'], case.archive_file)
+        manifest, tables = read_archive(path, restore_files=True)
+        restored = {}
+        for table, _ in case_tables(case_id):
+            rows = _decode_rows(table, tables[table.name]) if table.name in tables else []
+            if rows:
+                connection.execute(insert(table), rows)
+            restored[table.name] = rows
+        connection.execute(update(Case.__table__).where(Case.id == case_id).values(
+            status='closed', archived_at=None, archive_file=None, rehydrated_at=datetime.utcnow()))
+        bump_case_versions(connection, case_id)
+
+    _remove(path)
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        for reminder in restored[DeadlineReminder.__tablename__]:
+            if reminder['status'] == 'pending':
+                scheduler.push(current_shard(), reminder['deadline_id'], reminder['remind_at'])
+    app.logger.info(f"Rehydrated case {case_id} from {path}")
+    return {'case_id': case_id, 'rows': sum(manifest['tables'].values()), 'files': len(manifest['files']),
+            'seconds': time.perf_counter() - started}
+
+
+def close_case(case):
+    """Mark a case closed; it becomes due for archiving ARCHIVE_AFTER_DAYS later. Caller commits"""
+    case.status = 'closed'
+    case.closed_at = datetime.utcnow()
+    case.rehydrated_at = None
+
+
+def reopen_case(app, case):
+    """Bring a closed or archived case back to open; caller commits"""
+    if case.status == 'archived':
+        rehydrate_case(app, case.id)
+        db.session.refresh(case)
+    case.status = 'open'
+    case.closed_at = None
+    case.rehydrated_at = None
+
+
+def due_for_archive(archive_after_days, now=None):
+    """Ids of closed cases untouched since they were closed (or last rehydrated) archive_after_days ago"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=archive_after_days)
+    return [case_id for (case_id,) in db.session.query(Case.id).filter(
+        Case.status == 'closed', func.coalesce(Case.rehydrated_at, Case.closed_at) < cutoff).order_by(Case.id)]
+
+
+def maintain_database(app, engine=None):
+    """ANALYZE, and VACUUM where it pays off, after rows were deleted in bulk; returns the statements run"""
+    engine = engine or _case_engine()
+    statements = []
+    with writer_slot(app), engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'sqlite':
+            page_count = connection.exec_driver_sql('PRAGMA page_count').scalar()
+            free_pages = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+            if page_count and free_pages / page_count >= app.config['ARCHIVE_VACUUM_FREE_RATIO']:
+                statements.append('VACUUM')
+            statements.append('ANALYZE')
+        elif engine.dialect.name == 'postgresql':
+            preparer = connection.dialect.identifier_preparer
+            statements.extend(f"VACUUM (ANALYZE) {preparer.format_table(table)}" for table, _ in case_tables(0))
+        else:
+            statements.append('ANALYZE')
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+    return statements
+
+
+def archive_due_cases(app, now=None, maintain=True):
+    """Archive every case due for it, then tidy up the database; returns the archive summaries"""
+    archived = []
+    for case_id in due_for_archive(app.config['ARCHIVE_AFTER_DAYS'], now):
+        db.session.remove()  # Archiving runs on its own connection; do not hold a read transaction open meanwhile
+        try:
+            archived.append(archive_case(app, case_id))
+        except ArchiveError as e:
+            app.logger.warning(f"Case {case_id} not archived: {e}")
+    if archived and maintain:
+        maintain_database(app)
+    return archived
+
+
+_archiver_thread = None
+
+
+def start_case_archiver(app, interval=24 * 3600):
+    """Daemon thread that archives due cases every ``interval`` seconds"""
+    global _archiver_thread
+    if _archiver_thread is not None:
+        return _archiver_thread
+
+    def run():
+        stop = threading.Event()
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    from case_shards import each_case_database  # case_shards imports this module
+                    for _ in each_case_database(app):
+                        for summary in archive_due_cases(app):
+                            app.logger.info(f"Archived case {summary['case_id']}: {summary['rows']} rows, "
+                                            f"{summary['files']} files, {summary['bytes']} bytes")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Case archiving failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    _archiver_thread = threading.Thread(target=run, name='case-archiver', daemon=True)
+    _archiver_thread.start()
+    return _archiver_thread
+
+
+def init_case_archive(app):
+    """Rehydrate an archived case before any request that reads it"""
+
+    @app.before_request
+    def rehydrate_archived_case():
+        if request.endpoint is None or request.path.startswith(CASE_FREE_PREFIXES):
+            return None
+        case_id = (request.view_args or {}).get('case_id') or request.args.get('case_id', type=int)
+        query = db.session.query(Case.id, Case.status)
+        # Pages without a case_id show Case.query.first(), so the same row is checked here
+        row = query.filter(Case.id == case_id).first() if case_id else query.first()
+        if row is not None and row.status == 'archived':
+            db.session.rollback()  # End the read so the view sees the restored rows
+            rehydrate_case(app, row.id)
+        return None
+
+    return rehydrate_archived_case
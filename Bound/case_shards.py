@@ -0,0 +1,287 @@
+"""
+One SQLite file per case (CASE_SHARDING=sqlite)
+
+With every case in one database, writers to unrelated cases queue on one
+SQLite lock, and backing up or deleting one case means scanning every case
+table. In sharded mode each case lives in CASE_SHARD_DIR/case-<id>.db with
+its own copy of the case tables. The main database keeps what is shared by
+all cases: the case_shard catalog (which also hands out case ids, so they
+stay unique across shards), checklist catalog, rate-limit buckets and AI
+usage.
+
+The first request with an empty catalog copies any cases already in the
+main database into shards (``flask split-cases`` does the same up front).
+
+Each request picks its case from the case_id in the URL or query string,
+else the case last opened in the browser session, else the first case, and
+RoutingSession sends every statement on a case table to that shard's engine.
+Views are unchanged: Case.query.first() is simply the shard's one case.
+Background jobs and commands loop over the shards with each_case_database().
+``flask backup`` snapshots every shard through the SQLite backup API and
+lists them in the manifest; restores put them back in CASE_SHARD_DIR.
+
+Shard engines are opened on first use and kept in an LRU of
+CASE_SHARD_CACHE_SIZE per process. Opening a shard creates any missing
+tables and runs upgrade_schema, then stamps a fingerprint of the schema in
+PRAGMA user_version, so shards already on the current schema skip the
+migration check entirely.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import abort, current_app, g, redirect, request, session as browser_session, url_for
+from sqlalchemy import create_engine, delete, insert, select
+
+from app import db
+from case_archive import CASE_FREE_PREFIXES, case_tables
+from models import AIUsage, Case, CaseShard, ChecklistCatalog, Document, RateLimitBucket, TableVersion
+from schema_migrations import upgrade_schema
+from sqlite_tuning import install_sqlite_mode, sqlite_engine_options, writer_slot
+
+SHARED_MODELS = (CaseShard, ChecklistCatalog, RateLimitBucket, AIUsage)
+DEFAULT_CASE = {'case_title': 'My Family Law Case', 'case_type': 'Family Law'}
+
+
+class ShardNotFound(LookupError):
+    pass
+
+
+def shard_tables():
+    """Tables each shard holds: everything but the shared ones, parents before children"""
+    shared = {model.__tablename__ for model in SHARED_MODELS}
+    return [table for table in db.metadata.sorted_tables if table.name not in shared]
+
+
+def schema_fingerprint(tables):
+    """Positive 31-bit hash of the tables' columns and indexes, stored in a shard's PRAGMA user_version"""
+    description = [(table.name, [(column.name, repr(column.type)) for column in table.columns],
+                    sorted(index.name for index in table.indexes)) for table in tables]
+    return int.from_bytes(hashlib.sha256(repr(description).encode('utf-8')).digest()[:4], 'big') & 0x7fffffff
+
+
+def migrate_shard(engine, tables=None):
+    """Bring a shard up to the current schema unless its fingerprint says it is; True if it was checked"""
+    tables = tables or shard_tables()
+    fingerprint = schema_fingerprint(tables)
+    with engine.connect() as connection:
+        if connection.exec_driver_sql('PRAGMA user_version').scalar() == fingerprint:
+            return False
+    db.metadata.create_all(engine, tables=tables)
+    for change in upgrade_schema(engine):
+        current_app.logger.info(f"Schema upgrade of {engine.url.database}: {change}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f'PRAGMA user_version = {fingerprint}')
+    return True
+
+
+class CaseShards:
+    """Catalog of case shards and an LRU of their open engines"""
+
+    def __init__(self, directory, capacity=32, tuned=True):
+        self.directory = directory
+        self.capacity = capacity
+        self.tuned = tuned
+        self.shared_tables = frozenset(model.__tablename__ for model in SHARED_MODELS)
+        self._engines = OrderedDict()  # case id -> engine, least recently used first
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()  # Opening may migrate; one at a time, without blocking cache hits
+        self.stats = {'hits': 0, 'opens': 0, 'migrations': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, case_id):
+        return os.path.join(self.directory, f"case-{case_id}.db")
+
+    def _cached(self, case_id):
+        with self._lock:
+            engine = self._engines.get(case_id)
+            if engine is not None:
+                self._engines.move_to_end(case_id)
+                self.stats['hits'] += 1
+            return engine
+
+    def _open(self, path):
+        engine = create_engine(f"sqlite:///{path}", **sqlite_engine_options())
+        if self.tuned:
+            # Pragmas only: each shard has its own lock, so there is no cross-case writer queue to join
+            install_sqlite_mode(engine, serialize_writes=False)
+        if migrate_shard(engine):
+            self.stats['migrations'] += 1
+        return engine
+
+    def engine(self, case_id, create=False):
+        """The engine of a case's shard, opening (and with create, creating) it if needed"""
+        engine = self._cached(case_id)
+        if engine is not None:
+            return engine
+        with self._open_lock:
+            engine = self._cached(case_id)
+            if engine is not None:
+                return engine
+            path = self.path(case_id)
+            if not create and not os.path.exists(path):
+                raise ShardNotFound(f"No shard for case {case_id}")
+            engine = self._open(path)
+            with self._lock:
+                self._engines[case_id] = engine
+                self.stats['opens'] += 1
+                while len(self._engines) > self.capacity:
+                    # Connections still checked out by a request are closed when it returns them
+                    _, evicted = self._engines.popitem(last=False)
+                    evicted.dispose()
+                    self.stats['evictions'] += 1
+        return engine
+
+    def case_ids(self):
+        return list(db.session.execute(select(CaseShard.id).order_by(CaseShard.id)).scalars())
+
+    def default_case_id(self):
+        return db.session.execute(select(CaseShard.id).order_by(CaseShard.id).limit(1)).scalar()
+
+    def create_case(self, values):
+        """Create a case in a new shard; returns its id"""
+        with writer_slot(current_app), db.engine.begin() as connection:
+            case_id = connection.execute(insert(CaseShard.__table__).values(
+                case_title=values.get('case_title'), created_at=datetime.utcnow())).inserted_primary_key[0]
+        with self.engine(case_id, create=True).begin() as connection:
+            connection.execute(insert(Case.__table__).values(dict(values, id=case_id, status='open')))
+        return case_id
+
+    def close(self, case_id):
+        with self._lock:
+            engine = self._engines.pop(case_id, None)
+        if engine is not None:
+            engine.dispose()
+
+    def delete_case(self, case_id):
+        """Delete a case: its uploads, its shard file and its catalog entry; returns the files removed"""
+        engine = self.engine(case_id)
+        with engine.connect() as connection:
+            upload_paths = list(connection.execute(select(Document.file_path)).scalars())
+        self.close(case_id)
+        removed = 0
+        for path in upload_paths + [self.path(case_id) + suffix for suffix in ('', '-wal', '-shm')]:
+            if path and os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        with writer_slot(current_app), db.engine.begin() as connection:
+            connection.execute(delete(CaseShard.__table__).where(CaseShard.id == case_id))
+        return removed
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, open=list(self._engines), capacity=self.capacity)
+
+
+def split_into_shards(shards):
+    """Copy each case in the main database that has no shard yet into its own; returns {case_id: rows copied}
+
+    The main database is left as it was, so the copy can be checked before
+    the old rows are dropped.
+    """
+    copied = {}
+    with db.engine.connect() as source:
+        existing = set(source.execute(select(CaseShard.id)).scalars())
+        for case in source.execute(select(Case.__table__).order_by(Case.id)).mappings().all():
+            case_id = case['id']
+            if case_id in existing:
+                continue
+            shards.close(case_id)
+            for suffix in ('', '-wal', '-shm'):  # Left by an interrupted earlier run
+                if os.path.exists(shards.path(case_id) + suffix):
+                    os.remove(shards.path(case_id) + suffix)
+            tables = case_tables(case_id) + [(TableVersion.__table__, TableVersion.case_id == case_id)]
+            rows = 0
+            with shards.engine(case_id, create=True).begin() as target:
+                target.execute(insert(Case.__table__), [dict(case)])
+                for table, clause in tables:
+                    data = [dict(row) for row in source.execute(select(table).where(clause)).mappings()]
+                    if data:
+                        target.execute(insert(table), data)
+                        rows += len(data)
+            with writer_slot(current_app), db.engine.begin() as connection:
+                connection.execute(insert(CaseShard.__table__), {'id': case_id, 'case_title': case['case_title'],
+                                                                 'created_at': datetime.utcnow()})
+            copied[case_id] = rows + 1
+    return copied
+
+
+@contextmanager
+def shard_context(case_id):
+    """Send case-table statements to one case's shard inside the block; the session is closed on entry and exit"""
+    shards = current_app.extensions['case_shards']
+    previous = (g.get('db_shard'), g.get('db_shard_case'))
+    db.session.remove()
+    g.db_shard, g.db_shard_case = shards.engine(case_id), case_id
+    try:
+        yield g.db_shard
+    finally:
+        db.session.remove()
+        g.db_shard, g.db_shard_case = previous
+
+
+def each_case_database(app):
+    """Yield once per case shard with it selected, or once (None) for the main database when not sharding"""
+    shards = app.extensions.get('case_shards')
+    if shards is None:
+        yield None
+        return
+    for case_id in shards.case_ids():
+        with shard_context(case_id):
+            yield case_id
+
+
+def init_case_shards(app):
+    """Route each request to its case's shard when CASE_SHARDING is 'sqlite'; returns the shards, or None"""
+    mode = app.config['CASE_SHARDING']
+    if mode == 'off':
+        return None
+    if mode != 'sqlite':
+        raise ValueError(f"CASE_SHARDING must be 'sqlite' or 'off', not {mode!r}")
+    directory = app.config['CASE_SHARD_DIR']
+    if not os.path.isabs(directory):
+        directory = os.path.join(app.instance_path, directory)  # Beside the main SQLite database
+    shards = CaseShards(directory, app.config['CASE_SHARD_CACHE_SIZE'], app.config['SQLITE_TUNED'])
+    create_lock = threading.Lock()
+
+    def requested_case_id():
+        case_id = (request.view_args or {}).get('case_id') or request.args.get('case_id', type=int)
+        if case_id:
+            return case_id
+        remembered = browser_session.get('case_id')
+        if remembered and os.path.exists(shards.path(remembered)):
+            return remembered
+        case_id = shards.default_case_id()
+        if case_id is None:
+            with create_lock:
+                case_id = shards.default_case_id()
+                if case_id is None:
+                    # First request in sharded mode: bring over the cases already in the main database, if any
+                    for copied_id, rows in split_into_shards(shards).items():
+                        current_app.logger.info(f"Moved case {copied_id} into its own shard ({rows} rows)")
+                    case_id = shards.default_case_id() or shards.create_case(DEFAULT_CASE)
+        return case_id
+
+    @app.before_request
+    def select_case_shard():
+        if request.endpoint is None or request.path.startswith(CASE_FREE_PREFIXES):
+            return None
+        case_id = requested_case_id()
+        try:
+            g.db_shard, g.db_shard_case = shards.engine(case_id), case_id
+        except ShardNotFound:
+            abort(404)
+        return None
+
+    def open_case(case_id):
+        """Make a case the one this browser's pages show"""
+        browser_session['case_id'] = case_id
+        return redirect(url_for('dashboard'))
+
+    app.add_url_rule('/cases/<int:case_id>', 'open_case', open_case)
+    app.extensions['case_shards'] = shards
+    return shards
@@ -0,0 +1,65 @@
+"""
+Per-case table version counters used to validate caches
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Case, Child, Parent, Document, Incident, Deadline, CaseNote, DocumentFinding, TableVersion
+
+TRACKED_MODELS = (Child, Parent, Document, Incident, Deadline, CaseNote, DocumentFinding)
+
+
+def bump_version(case_id, table_name, session=None):
+    """Increment the version of one table for one case; committed with the caller's transaction"""
+    session = session or db.session
+    now = datetime.utcnow()
+    table = TableVersion.__table__
+    result = session.execute(update(table)
+                             .where(table.c.case_id == case_id, table.c.table_name == table_name)
+                             .values(version=table.c.version + 1, updated_at=now))
+    if result.rowcount == 0:
+        session.add(TableVersion(case_id=case_id, table_name=table_name, version=1, updated_at=now))
+
+
+def bump_case_versions(connection, case_id):
+    """Increment every tracked table's version for a case on a Core connection, after bulk writes"""
+    now = datetime.utcnow()
+    table = TableVersion.__table__
+    existing = set(connection.execute(select(table.c.table_name).where(table.c.case_id == case_id)).scalars())
+    connection.execute(update(table).where(table.c.case_id == case_id)
+                       .values(version=table.c.version + 1, updated_at=now))
+    missing = [name for name in (Case.__tablename__, *(model.__tablename__ for model in TRACKED_MODELS))
+               if name not in existing]
+    if missing:
+        connection.execute(insert(table), [{'case_id': case_id, 'table_name': name, 'version': 1, 'updated_at': now}
+                                           for name in missing])
+
+
+def get_version(case_id, table_name):
+    """(version, updated_at) for a table, or (0, None) if it has never been written"""
+    row = db.session.get(TableVersion, (case_id, table_name))
+    return (row.version, row.updated_at) if row else (0, None)
+
+
+def get_versions(case_id):
+    """{table_name: version} for every table written for a case, in one query"""
+    return dict(db.session.query(TableVersion.table_name, TableVersion.version)
+                .filter(TableVersion.case_id == case_id).all())
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_changed_tables(session, flush_context, instances):
+    changed = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if instance in session.dirty and not session.is_modified(instance):
+            continue
+        if isinstance(instance, TRACKED_MODELS) and instance.case_id is not None:
+            changed.add((instance.case_id, instance.__tablename__))
+        elif isinstance(instance, Case) and instance.id is not None:
+            changed.add((instance.id, Case.__tablename__))
+    for case_id, table_name in changed:
+        bump_version(case_id, table_name, session)
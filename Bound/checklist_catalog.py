@@ -0,0 +1,231 @@
+"""
+Shared preparation checklist catalog with a per-case overlay
+
+The AI checklist depends only on the case type and hearing type, so one copy
+of each combination is kept in checklist_catalog and served to every case.
+A background thread regenerates entries older than CHECKLIST_MAX_AGE_DAYS;
+stale entries keep being served until a refresh succeeds. Processes claim an
+entry before regenerating it, so each one is generated once, not once per
+worker.
+
+Case-specific items (upcoming deadlines, court filings, serious incidents,
+children's needs) come from a few indexed queries and are merged in at
+request time as an extra category.
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Case, ChecklistCatalog, Child, Deadline, Document, Incident
+from openai_service import generate_preparation_checklist
+from case_shards import each_case_database
+
+HEARING_TYPES = ['general', 'court_hearing', 'mediation', 'custody_evaluation', 'deposition', 'trial']
+DEFAULT_CASE_TYPE = 'Family Law'
+CLAIM_TIMEOUT = timedelta(minutes=10)
+RETRY_AFTER = timedelta(minutes=5)  # Between attempts at an entry whose last refresh failed
+
+# Deadline types worth calling out for each hearing type
+HEARING_DEADLINE_TYPES = {
+    'court_hearing': ['court_hearing', 'filing_deadline'],
+    'mediation': ['mediation'],
+    'custody_evaluation': ['evaluation'],
+    'deposition': ['court_hearing', 'filing_deadline'],
+    'trial': ['court_hearing', 'filing_deadline'],
+}
+
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+_refresh_wanted = threading.Event()
+_refresher_thread = None
+
+
+def normalize_hearing_type(hearing_type):
+    return hearing_type if hearing_type in HEARING_TYPES else 'general'
+
+
+def catalog_keys():
+    """Every (case type, hearing type) pair in use, plus the default case type"""
+    case_types = set()
+    for _ in each_case_database(current_app):
+        case_types.update(case_type for (case_type,) in db.session.query(Case.case_type).distinct() if case_type)
+    case_types.add(DEFAULT_CASE_TYPE)
+    return [(case_type, hearing_type) for case_type in sorted(case_types) for hearing_type in HEARING_TYPES]
+
+
+def _entry(case_type, hearing_type, create=False):
+    # populate_existing: another thread or process may have refreshed the row since this session loaded it
+    entry = ChecklistCatalog.query.filter_by(case_type=case_type, hearing_type=hearing_type) \
+        .execution_options(populate_existing=True).first()
+    if entry is None and create:
+        entry = ChecklistCatalog(case_type=case_type, hearing_type=hearing_type, status='pending')
+        db.session.add(entry)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Created by another process
+            entry = ChecklistCatalog.query.filter_by(case_type=case_type, hearing_type=hearing_type).first()
+    return entry
+
+
+def _claim(entry):
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ChecklistCatalog)
+        .where(ChecklistCatalog.id == entry.id,
+               or_(ChecklistCatalog.status != 'refreshing', ChecklistCatalog.claimed_at < now - CLAIM_TIMEOUT))
+        .values(status='refreshing', claimed_at=now)).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def refresh_entry(case_type, hearing_type):
+    """Regenerate one catalog entry unless another process is already doing it; returns True if stored"""
+    entry = _entry(case_type, hearing_type, create=True)
+    if not _claim(entry):
+        return False
+    checklist = generate_preparation_checklist(case_type, hearing_type)
+    db.session.refresh(entry)
+    if 'error' in checklist:
+        # Keep serving the previous checklist, if there is one
+        entry.status = 'ready' if entry.checklist else 'failed'
+        entry.error = checklist['error']
+    else:
+        entry.checklist = json.dumps(checklist)
+        entry.status = 'ready'
+        entry.error = None
+        entry.generated_at = datetime.utcnow()
+    db.session.commit()
+    return 'error' not in checklist
+
+
+def is_stale(entry, max_age):
+    return entry.generated_at is None or entry.generated_at < datetime.utcnow() - max_age
+
+
+def recently_attempted(entry):
+    return entry.claimed_at is not None and entry.claimed_at > datetime.utcnow() - RETRY_AFTER
+
+
+def refresh_catalog(max_age, force=False):
+    """Generate missing entries and regenerate stale ones; returns the number refreshed"""
+    refreshed = 0
+    for case_type, hearing_type in catalog_keys():
+        entry = _entry(case_type, hearing_type)
+        if force or entry is None or (is_stale(entry, max_age) and not recently_attempted(entry)):
+            refreshed += refresh_entry(case_type, hearing_type)
+    return refreshed
+
+
+def _key_lock(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def get_checklist(case_type, hearing_type, max_age):
+    """The shared checklist for a case type and hearing type
+
+    Served straight from the catalog. A stale entry is returned as is and
+    the refresher is woken; a missing one is generated once, with concurrent
+    requests in this process waiting for that result.
+    """
+    case_type = case_type or DEFAULT_CASE_TYPE
+    hearing_type = normalize_hearing_type(hearing_type)
+    entry = _entry(case_type, hearing_type)
+    if entry is None or not entry.checklist:
+        with _key_lock((case_type, hearing_type)):
+            entry = _entry(case_type, hearing_type)
+            if entry is None or (not entry.checklist and not recently_attempted(entry)):
+                refresh_entry(case_type, hearing_type)
+                entry = _entry(case_type, hearing_type)
+    if entry is None or not entry.checklist:
+        return {
+            'error': (entry.error if entry is not None and entry.error
+                      else "This checklist is being prepared. Please refresh in a moment."),
+            'checklist_title': 'Case Preparation Checklist',
+            'preparation_items': [],
+            'timeline_suggestions': [],
+            'common_mistakes': [],
+        }
+    if is_stale(entry, max_age):
+        _refresh_wanted.set()
+    return json.loads(entry.checklist)
+
+
+def case_overlay(case, hearing_type, today=None):
+    """Checklist category built from this case's own records, or None if there is nothing to add"""
+    today = today or datetime.now()
+    items = []
+
+    deadlines = Deadline.query.filter(Deadline.case_id == case.id, Deadline.is_completed.isnot(True),
+                                      Deadline.deadline_date >= today,
+                                      Deadline.deadline_date <= today + timedelta(days=60))
+    deadline_types = HEARING_DEADLINE_TYPES.get(hearing_type)
+    if deadline_types:
+        deadlines = deadlines.filter(Deadline.deadline_type.in_(deadline_types))
+    for deadline in deadlines.order_by(Deadline.deadline_date).limit(3):
+        items.append(f"Prepare for \"{deadline.title}\" on {deadline.deadline_date.strftime('%m/%d/%Y')}")
+
+    court_filings = Document.query.filter_by(case_id=case.id, is_court_filing=True).count()
+    if court_filings:
+        items.append(f"Bring copies of your {court_filings} court filing{'s' if court_filings != 1 else ''}")
+
+    serious = Incident.query.filter(Incident.case_id == case.id, Incident.severity.in_(['high', 'critical'])).count()
+    if serious:
+        items.append(f"Organize evidence for the {serious} high or critical incident{'s' if serious != 1 else ''} you logged")
+
+    follow_ups = Incident.query.filter_by(case_id=case.id, follow_up_needed=True).count()
+    if follow_ups:
+        items.append(f"Complete the follow-up on {follow_ups} incident{'s' if follow_ups != 1 else ''}")
+
+    children = Child.query.filter(Child.case_id == case.id,
+                                  or_(Child.special_needs.isnot(None), Child.medical_conditions.isnot(None))) \
+        .with_entities(Child.first_name, Child.special_needs, Child.medical_conditions).all()
+    for first_name, special_needs, medical_conditions in children:
+        if special_needs or medical_conditions:
+            items.append(f"Bring records of {first_name}'s medical and special needs care")
+
+    if not items:
+        return None
+    return {'category': 'Specific to Your Case', 'items': items, 'priority': 'high'}
+
+
+def merge_overlay(checklist, overlay):
+    """The shared checklist with the case's category first; the catalog copy is left untouched"""
+    if overlay is None:
+        return checklist
+    return dict(checklist, preparation_items=[overlay] + list(checklist.get('preparation_items') or []))
+
+
+def start_checklist_refresher(app, interval=3600, initial_delay=10):
+    """Daemon thread that refreshes the catalog every ``interval`` seconds, or sooner when a stale entry is served"""
+    global _refresher_thread
+    if _refresher_thread is not None:
+        return _refresher_thread
+    max_age = timedelta(days=app.config['CHECKLIST_MAX_AGE_DAYS'])
+
+    def run():
+        _refresh_wanted.wait(initial_delay)
+        while True:
+            _refresh_wanted.clear()
+            with app.app_context():
+                try:
+                    refreshed = refresh_catalog(max_age)
+                    if refreshed:
+                        app.logger.info(f"Refreshed {refreshed} preparation checklists")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Checklist catalog refresh failed: {str(e)}")
+                finally:
+                    db.session.remove()
+            _refresh_wanted.wait(interval)
+
+    _refresher_thread = threading.Thread(target=run, name='checklist-catalog', daemon=True)
+    _refresher_thread.start()
+    return _refresher_thread
@@ -0,0 +1,316 @@
+import os
+import subprocess
+import tempfile
+from contextlib import nullcontext
+from datetime import timedelta
+import click
+from app import app, db
+from models import Case, Document, Incident, CaseNote, DuplicateSignature
+from document_processor import extract_text_from_file
+from semantic_index import get_semantic_index, incident_text, case_note_text
+from duplicate_detector import record_signature, duplicate_report
+from bulk_import import import_records, detect_format, IMPORTERS
+from severity_queue import process_queue
+from reminder_scheduler import ReminderScheduler, build_sinks, backfill_reminders, get_scheduler
+from drafts import prune_expired_drafts
+from checklist_catalog import refresh_catalog
+from sqlite_tuning import run_benchmark
+from backup import BackupRepository, BackupError
+from serving import SERVING_MODES, StubUpstream, benchmark_mode
+from case_archive import ArchiveError, archive_case, archive_due_cases, maintain_database, rehydrate_case
+from case_shards import ShardNotFound, each_case_database, shard_context, split_into_shards
+
+@app.cli.command('rebuild-semantic-index')
+def rebuild_semantic_index():
+    """Re-embed every document, incident and case note"""
+    counts = {'document': 0, 'incident': 0, 'case_note': 0}
+    for _ in each_case_database(app):
+        index = get_semantic_index(app)
+
+        for document in Document.query.filter(Document.file_type.in_(['pdf', 'doc', 'docx', 'txt'])).all():
+            text_content = extract_text_from_file(document.file_path, document.file_type)
+            if text_content and not text_content.startswith('Error'):
+                index.index_text('document', document.id, text_content)
+                counts['document'] += 1
+
+        for incident in Incident.query.all():
+            index.index_text('incident', incident.id, incident_text(incident))
+            counts['incident'] += 1
+
+        for note in CaseNote.query.all():
+            index.index_text('case_note', note.id, case_note_text(note))
+            counts['case_note'] += 1
+
+    click.echo(f"Indexed {counts['document']} documents, {counts['incident']} incidents, {counts['case_note']} case notes")
+
+@app.cli.command('dedup-report')
+@click.option('--backfill/--no-backfill', default=True, help='Index items that have no signature yet')
+def dedup_report(backfill):
+    """Report likely duplicate incidents and documents for every case"""
+    for _ in each_case_database(app):
+        if backfill:
+            indexed = {(row.item_type, row.item_id) for row in DuplicateSignature.query.with_entities(
+                DuplicateSignature.item_type, DuplicateSignature.item_id)}
+            for incident in Incident.query.all():
+                if ('incident', incident.id) not in indexed:
+                    record_signature(incident.case_id, 'incident', incident.id, incident.description)
+            for document in Document.query.filter(Document.file_type.in_(['pdf', 'doc', 'docx', 'txt'])).all():
+                if ('document', document.id) not in indexed:
+                    text_content = extract_text_from_file(document.file_path, document.file_type)
+                    if text_content and not text_content.startswith('Error'):
+                        record_signature(document.case_id, 'document', document.id, text_content)
+            db.session.commit()
+
+        for case in Case.query.all():
+            for item_type in ['incident', 'document']:
+                for cluster in duplicate_report(case.id, item_type):
+                    ids = ', '.join(str(item_id) for item_id in cluster['item_ids'])
+                    click.echo(f"Case {case.id} {item_type}s {ids} ({int(cluster['max_similarity'] * 100)}% similar)")
+
+@app.cli.command('import-records')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension')
+@click.option('--case-id', type=int, help='Defaults to the first case')
+@click.option('--analyze-severity', is_flag=True, help='Queue imported incidents for batched AI severity assessment')
+def import_records_command(kind, path, file_format, case_id, analyze_severity):
+    """Bulk import incidents, deadlines or notes from CSV or JSON Lines"""
+    case = db.session.get(Case, case_id) if case_id else Case.query.first()
+    if not case:
+        raise click.ClickException('No case found')
+    with open(path, 'rb') as stream:
+        result = import_records(kind, stream, file_format or detect_format(path), case.id,
+                                analyze_severity=analyze_severity)
+    for error in result['errors']:
+        click.echo(f"Row {error['row']}: {error['error']}", err=True)
+    click.echo(f"Imported {result['imported']} {kind}, {result['failed']} failed"
+               + (f", {result['severity_queued']} queued for severity assessment" if analyze_severity else ''))
+
+@app.cli.command('assess-incidents')
+@click.option('--batch-size', default=20, show_default=True, help='Incidents per model request')
+def assess_incidents(batch_size):
+    """Run queued incident severity assessments (for deployments without the in-process worker)"""
+    processed = sum(process_queue(batch_size) for _ in each_case_database(app))
+    click.echo(f"Processed {processed} queued assessments")
+
+@app.cli.command('backfill-reminders')
+def backfill_reminders_command():
+    """Schedule reminders for open deadlines created before reminders existed"""
+    click.echo(f"Scheduled {sum(backfill_reminders() for _ in each_case_database(app))} reminders")
+
+@app.cli.command('run-reminder-scheduler')
+def run_reminder_scheduler():
+    """Run the deadline reminder scheduler in the foreground"""
+    click.echo(f"Sending reminders via {', '.join(app.config['REMINDER_SINKS'])}")
+    if get_scheduler() is not None:
+        get_scheduler().start().join()  # Already started in-process (REMINDER_SCHEDULER=thread)
+    else:
+        ReminderScheduler(app, build_sinks(app)).run_forever()
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint static files and write their gzip/brotli variants (run at deploy)"""
+    count = app.extensions['asset_manifest'].build(precompress=True)
+    click.echo(f"Built {count} static assets into {app.config['ASSET_BUILD_FOLDER']}")
+
+@app.cli.command('prune-drafts')
+def prune_drafts():
+    """Delete autosave drafts that have expired"""
+    click.echo(f"Pruned {sum(prune_expired_drafts() for _ in each_case_database(app))} expired drafts")
+
+@app.cli.command('refresh-checklists')
+@click.option('--force', is_flag=True, help='Regenerate every entry, not just missing and stale ones')
+def refresh_checklists(force):
+    """Generate missing and stale entries in the shared preparation checklist catalog"""
+    refreshed = refresh_catalog(timedelta(days=app.config['CHECKLIST_MAX_AGE_DAYS']), force=force)
+    click.echo(f"Refreshed {refreshed} preparation checklists")
+
+@app.cli.command('benchmark-sqlite')
+@click.option('--writers', default=4, show_default=True)
+@click.option('--readers', default=4, show_default=True)
+@click.option('--seconds', default=5.0, show_default=True)
+def benchmark_sqlite(writers, readers, seconds):
+    """Compare concurrent read/write throughput of default and tuned SQLite on a scratch file"""
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    click.echo(f"{writers} writers, {readers} readers, {seconds:g}s per mode")
+    for tuned in (False, True):
+        result = run_benchmark(path, tuned, writers, readers, seconds)
+        click.echo(f"{result['mode']:>8}: {result['writes_per_second']:>9} writes/s  "
+                   f"{result['reads_per_second']:>9} reads/s  {result['errors']} lock errors"
+                   + (f"  {result['writer_wait_seconds']}s queued" if tuned else ''))
+
+def backup_repository(workers=None):
+    return BackupRepository(app.config['BACKUP_DIR'], workers or app.config['BACKUP_WORKERS'])
+
+def shard_directory():
+    """Where case shards live when sharding, else None"""
+    shards = app.extensions.get('case_shards')
+    return shards.directory if shards is not None else None
+
+def format_timings(timings):
+    return ', '.join(f"{name.replace('_seconds', '')} {seconds:.2f}s" for name, seconds in timings.items())
+
+@app.cli.command('backup')
+@click.option('--workers', type=int, help='Parallel file copies (default BACKUP_WORKERS)')
+@click.option('--rehash', is_flag=True, help='Hash every upload instead of trusting unchanged size and mtime')
+@click.option('--keep', type=int, help='Snapshots to keep afterwards (default BACKUP_KEEP, 0 = all)')
+def backup_command(workers, rehash, keep):
+    """Snapshot the database and case shards online and copy new or changed uploads and case archives into BACKUP_DIR"""
+    repository = backup_repository(workers)
+    try:
+        manifest = repository.backup(db.engine.url.render_as_string(hide_password=False),
+                                     app.config['UPLOAD_FOLDER'], rehash=rehash,
+                                     archive_dir=app.config['ARCHIVE_DIR'], shard_dir=shard_directory())
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"pg_dump failed: {e.stderr.decode(errors='replace').strip()}")
+    stats = manifest['stats']
+    click.echo(f"Snapshot {manifest['id']}: {stats['files']} files and {stats['archives']} case archives, "
+               f"{stats['copied']} copied "
+               f"({stats['bytes_copied']} of {stats['bytes_total']} bytes), {stats['unchanged']} unchanged, "
+               f"{stats['deduplicated']} already stored; database {manifest['database']['size']} bytes"
+               + (f", {stats['shards']} case shards {stats['shard_bytes']} bytes" if stats.get('shards') else ''))
+    click.echo(f"Timings: {format_timings(manifest['timings'])}")
+    keep = app.config['BACKUP_KEEP'] if keep is None else keep
+    if keep:
+        snapshots, blobs = repository.prune(keep)
+        if snapshots:
+            click.echo(f"Pruned {snapshots} old snapshots and {blobs} unreferenced blobs")
+
+@app.cli.command('verify-backup')
+@click.argument('snapshot', required=False)
+@click.option('--workers', type=int, help='Parallel file copies (default BACKUP_WORKERS)')
+def verify_backup(snapshot, workers):
+    """Restore a snapshot (default: the latest) into a scratch directory, check it and report timings"""
+    try:
+        result = backup_repository(workers).verify(snapshot)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Snapshot {result['id']} verified: {result['files']} files and {result['archives']} case archives "
+               f"({result['bytes']} bytes), "
+               f"database {result['database_bytes']} bytes, {result['shards']} case shards")
+    click.echo(f"Timings: {format_timings(result['timings'])}")
+
+@app.cli.command('restore-backup')
+@click.argument('snapshot', required=False)
+@click.option('--workers', type=int, help='Parallel file copies (default BACKUP_WORKERS)')
+@click.confirmation_option(prompt='This replaces the database, uploads and case archives. Stop the app first. Continue?')
+def restore_backup(snapshot, workers):
+    """Restore a snapshot (default: the latest) over the configured database, case shards, uploads and case archives"""
+    db.session.remove()
+    db.engine.dispose()
+    try:
+        result = backup_repository(workers).restore(db.engine.url.render_as_string(hide_password=False),
+                                                    app.config['UPLOAD_FOLDER'], snapshot,
+                                                    archive_dir=app.config['ARCHIVE_DIR'], shard_dir=shard_directory())
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"pg_restore failed: {e.stderr.decode(errors='replace').strip()}")
+    click.echo(f"Restored snapshot {result['id']}: {result['files']} files and {result['archives']} case archives "
+               f"({result['bytes']} bytes), "
+               f"database {result['database_bytes']} bytes, {result['shards']} case shards")
+    click.echo(f"Timings: {format_timings(result['timings'])}")
+
+def case_database(case_id):
+    """The case's shard when sharding, else the main database"""
+    shards = app.extensions.get('case_shards')
+    if shards is None:
+        return nullcontext()
+    if not os.path.exists(shards.path(case_id)):
+        raise click.ClickException(f"No shard for case {case_id}")
+    return shard_context(case_id)
+
+def format_archive(summary):
+    return (f"Archived case {summary['case_id']}: {summary['rows']} rows and {summary['files']} files "
+            f"into {summary['path']} ({summary['bytes']} bytes, {summary['seconds']:.2f}s)")
+
+@app.cli.command('archive-cases')
+@click.option('--case-id', type=int, multiple=True, help='Archive these closed cases now instead of the ones due')
+@click.option('--maintain/--no-maintain', default=True, help='ANALYZE (and VACUUM if worthwhile) afterwards')
+def archive_cases(case_id, maintain):
+    """Move cases closed for ARCHIVE_AFTER_DAYS into compressed archives in ARCHIVE_DIR"""
+    summaries = []
+    if case_id:
+        for single_case_id in case_id:
+            try:
+                with case_database(single_case_id):
+                    summaries.append(archive_case(app, single_case_id))
+                    if maintain:
+                        maintain_database(app)
+            except ArchiveError as e:
+                raise click.ClickException(str(e))
+    else:
+        for _ in each_case_database(app):
+            summaries.extend(archive_due_cases(app, maintain=maintain))
+    for summary in summaries:
+        click.echo(format_archive(summary))
+    click.echo(f"Archived {len(summaries)} cases")
+
+@app.cli.command('rehydrate-case')
+@click.argument('case_id', type=int)
+def rehydrate_case_command(case_id):
+    """Restore an archived case into the database now rather than on its next access"""
+    try:
+        with case_database(case_id):
+            summary = rehydrate_case(app, case_id)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    if summary is None:
+        raise click.ClickException(f"Case {case_id} is not archived")
+    click.echo(f"Rehydrated case {case_id}: {summary['rows']} rows and {summary['files']} files "
+               f"({summary['seconds']:.2f}s)")
+
+def case_shards():
+    shards = app.extensions.get('case_shards')
+    if shards is None:
+        raise click.ClickException("CASE_SHARDING is off")
+    return shards
+
+@app.cli.command('case-shards')
+def list_case_shards():
+    """List the per-case SQLite files with their sizes"""
+    shards = case_shards()
+    for case_id in shards.case_ids():
+        path = shards.path(case_id)
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        click.echo(f"Case {case_id}: {path} ({'missing' if size is None else f'{size} bytes'})")
+
+@app.cli.command('split-cases')
+def split_cases():
+    """Copy cases from the main database into their own shards (the main database is left untouched)"""
+    copied = split_into_shards(case_shards())
+    for case_id, rows in copied.items():
+        click.echo(f"Case {case_id}: {rows} rows copied")
+    click.echo(f"Split {len(copied)} cases into shards")
+
+@app.cli.command('delete-case')
+@click.argument('case_id', type=int)
+@click.confirmation_option(prompt='This deletes the case, its uploads and its shard file. Continue?')
+def delete_case(case_id):
+    """Delete a sharded case by removing its file and uploads"""
+    try:
+        removed = case_shards().delete_case(case_id)
+    except ShardNotFound as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Deleted case {case_id} ({removed} files removed)")
+
+@app.cli.command('benchmark-serving')
+@click.option('--path', default='/case-summary', show_default=True, help='AI-backed route to load')
+@click.option('--concurrency', default=32, show_default=True, help='Simultaneous clients')
+@click.option('--seconds', default=15.0, show_default=True, help='Load duration per mode')
+@click.option('--latency', default=1.0, show_default=True, help='Seconds the stub OpenAI API takes per call')
+@click.option('--workers', default=2, show_default=True, help='Gunicorn worker processes in each mode')
+@click.option('--threads', default=32, show_default=True, help='Threads per worker in async mode')
+def benchmark_serving(path, concurrency, seconds, latency, workers, threads):
+    """Compare sync and async gunicorn serving of an AI route against a stub OpenAI API"""
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    click.echo(f"{path}: {concurrency} clients, {seconds:g}s per mode, {latency:g}s upstream latency, "
+               f"{workers} workers")
+    with StubUpstream(latency) as upstream:
+        for mode in SERVING_MODES:
+            result = benchmark_mode(mode, path, workers, threads, concurrency, seconds, upstream.base_url,
+                                    database_url)
+            memory = f"{result['rss_bytes'] / 1024 / 1024:.0f} MB" if result['rss_bytes'] else 'n/a'
+            click.echo(f"{mode:>6} ({result['workers']}x{result['threads']}): {result['requests_per_second']:>7} req/s  "
+                       f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  "
+                       f"{result['errors']} errors  {memory} RSS")
@@ -0,0 +1,66 @@
+"""
+Response compression negotiated from Accept-Encoding
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def choose_encoding(accept_encodings, encodings=None):
+    """Best encoding the client accepts, preferring brotli, or None"""
+    for encoding in encodings or available_encodings():
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, best=False):
+    """Compress bytes; ``best`` trades CPU for size when building files ahead of time"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def compress_response(response, request, min_size=MIN_COMPRESS_SIZE):
+    """Compress a buffered response in place if the client and the payload allow it"""
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, _ = response.get_etag()
+    if etag:
+        # The compressed bytes differ from the original, so only a weak match still holds
+        response.set_etag(etag, weak=True)
+    return response
+
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json', 'text/calendar'}
+
+
+def init_response_compression(app):
+    """Compress buffered HTML, JSON and calendar responses over COMPRESS_MIN_SIZE on the fly"""
+    from flask import request
+
+    @app.after_request
+    def compress_dynamic_response(response):
+        if response.mimetype in COMPRESSIBLE_MIMETYPES:
+            return compress_response(response, request, app.config['COMPRESS_MIN_SIZE'])
+        return response
@@ -0,0 +1,340 @@
+"""
+Connection pool settings, read-replica routing and pool saturation metrics
+
+Postgres pools are sized from DB_POOL_* settings. Checkouts are not
+pre-pinged, because that costs a round trip every time; TCP keepalives and
+pool_recycle drop dead connections instead. With DB_PGBOUNCER=true the
+application keeps no pool of its own and sends no startup options, which
+PgBouncer's transaction pooling rejects.
+
+Views decorated with @read_replica send their SELECTs to
+DATABASE_REPLICA_URL. They fall back to the primary:
+- after the session has written anything;
+- for a few seconds after the same browser session wrote (so users see their own changes);
+- while the replica is marked down after a connection error.
+
+With CASE_SHARDING, statements on case tables go to the SQLite file of the
+case the request (or shard_context) selected; see case_shards.py.
+
+release_connection() ends a read-only transaction before a slow upstream
+call (OpenAI), so requests waiting on the network do not each pin a pooled
+connection.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, session as browser_session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import Select
+
+from sqlite_tuning import is_sqlite, sqlite_engine_options
+
+REPLICA_BIND = 'replica'
+
+
+def _flag(environ, name, default):
+    return environ.get(name, default).lower() == 'true'
+
+
+def engine_options(uri, environ=os.environ):
+    """SQLAlchemy engine options for the database backend, from DB_POOL_* and DB_PGBOUNCER settings"""
+    if is_sqlite(uri):
+        return sqlite_engine_options(environ)
+
+    connect_args = {
+        'connect_timeout': int(environ.get('DB_CONNECT_TIMEOUT', '10')),
+        # Detect connections dropped by a load balancer or failover without a ping per checkout
+        'keepalives': 1,
+        'keepalives_idle': int(environ.get('DB_KEEPALIVES_IDLE', '30')),
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    }
+    options = {
+        'pool_pre_ping': _flag(environ, 'DB_POOL_PRE_PING', 'false'),
+        'connect_args': connect_args,
+    }
+    if _flag(environ, 'DB_PGBOUNCER', 'false'):
+        # PgBouncer owns the pool; a second pool here would just pin server connections
+        options['poolclass'] = NullPool
+        return options
+
+    statement_timeout = environ.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout:
+        connect_args['options'] = f"-c statement_timeout={int(statement_timeout)}"
+    options.update({
+        'pool_size': int(environ.get('DB_POOL_SIZE', '5')),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', '1800')),
+        # Reuse the most recent connection so idle ones beyond the core size can be recycled
+        'pool_use_lifo': True,
+    })
+    return options
+
+
+def replica_binds(replica_uri, environ=os.environ):
+    """SQLALCHEMY_BINDS entry for the read replica, or an empty dict without one"""
+    if not replica_uri:
+        return {}
+    return {REPLICA_BIND: dict(engine_options(replica_uri, environ), url=replica_uri)}
+
+
+class PoolMetrics:
+    """Checkout counters for one engine's pool, with its live size and saturation"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.counters = {'connects': 0, 'checkouts': 0, 'invalidated': 0, 'saturated_checkouts': 0,
+                         'peak_checked_out': 0}
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+
+    def _capacity(self):
+        pool = self.engine.pool
+        if not hasattr(pool, 'size') or not hasattr(pool, '_max_overflow'):
+            return None  # NullPool and SQLite's pools have no fixed limit
+        return pool.size() + max(pool._max_overflow, 0)
+
+    def _checked_out(self):
+        pool = self.engine.pool
+        return pool.checkedout() if hasattr(pool, 'checkedout') else None
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.counters['connects'] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        checked_out, capacity = self._checked_out(), self._capacity()
+        with self._lock:
+            self.counters['checkouts'] += 1
+            if checked_out is not None:
+                self.counters['peak_checked_out'] = max(self.counters['peak_checked_out'], checked_out)
+                if capacity and checked_out >= capacity:
+                    self.counters['saturated_checkouts'] += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.counters['invalidated'] += 1
+
+    def snapshot(self):
+        pool = self.engine.pool
+        checked_out, capacity = self._checked_out(), self._capacity()
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update({
+            'pool': type(pool).__name__,
+            'status': pool.status(),
+            'checked_out': checked_out,
+            'capacity': capacity,
+            'saturation': round(checked_out / capacity, 3) if capacity and checked_out is not None else None,
+        })
+        if hasattr(pool, 'overflow'):
+            stats.update({'size': pool.size(), 'idle': pool.checkedin(), 'overflow': pool.overflow()})
+        return stats
+
+
+class ReplicaRouter:
+    """Replica health and the metrics for every engine"""
+
+    def __init__(self, db, replica, down_seconds=30, sticky_seconds=5):
+        self.db = db
+        self.replica = replica
+        self.down_seconds = down_seconds
+        self.sticky_seconds = sticky_seconds
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self.stats = {'replica_requests': 0, 'primary_fallbacks': 0, 'replica_failures': 0, 'last_error': None}
+        self.metrics = {}
+
+    def available(self):
+        return self.replica is not None and time.monotonic() >= self._down_until
+
+    def mark_down(self, error):
+        with self._lock:
+            self._down_until = time.monotonic() + self.down_seconds
+            self.stats['replica_failures'] += 1
+            self.stats['last_error'] = str(error).splitlines()[0] if str(error) else type(error).__name__
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['replica_configured'] = self.replica is not None
+        stats['replica_available'] = self.available()
+        engines = {('primary' if key is None else key): metrics.snapshot() for key, metrics in self.metrics.items()}
+        return dict(stats, engines=engines)
+
+
+def _router():
+    return current_app.extensions.get('db_router')
+
+
+def _replica_allowed(session, clause):
+    if not has_request_context() or not g.get('db_read_replica'):
+        return False
+    if session._flushing or session.info.get('db_wrote'):
+        return False
+    if not isinstance(clause, Select) or clause._for_update_arg is not None:
+        return False
+    router = _router()
+    return router is not None and router.available()
+
+
+def _statement_tables(mapper, clause):
+    if mapper is not None:
+        return mapper.tables
+    table = getattr(clause, 'table', None)  # Core insert, update and delete
+    if table is not None:
+        return [table]
+    return clause.get_final_froms() if isinstance(clause, Select) else []
+
+
+def _shard_bind(mapper, clause):
+    # The case shard selected for this request or shard_context(), unless the statement is on a shared table
+    if not has_app_context():
+        return None
+    engine = g.get('db_shard')
+    if engine is None:
+        return None
+    shared_tables = current_app.extensions['case_shards'].shared_tables
+    if any(getattr(table, 'name', None) in shared_tables for table in _statement_tables(mapper, clause)):
+        return None
+    return engine
+
+
+class RoutingSession(FlaskSession):
+    """Flask-SQLAlchemy session that sends case tables to the selected case shard, if sharding,
+    and reads from @read_replica views to the replica engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shard = _shard_bind(mapper, clause)
+            if shard is not None:
+                return shard
+        if bind is None and _replica_allowed(self, clause):
+            return _router().replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _session_wrote(session):
+    session.info['db_wrote'] = True
+    session.info['transaction_wrote'] = True
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        _session_wrote(session)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _session_wrote(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _reset_transaction_write(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('transaction_wrote', None)
+
+
+def release_connection(session):
+    """Return the session's connection to the pool if its transaction has not written; True if released
+
+    Loaded objects stay usable (nothing is expired) and the next query checks
+    out a connection again. A transaction with pending or flushed writes is
+    left alone, so this never commits partial work.
+    """
+    if not session.in_transaction() or session.new or session.dirty or session.deleted \
+            or session.info.get('transaction_wrote'):
+        return False
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+    return True
+
+
+def _sticky_to_primary():
+    return browser_session.get('db_primary_until', 0) > time.time()
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside a @read_replica view, e.g. before deciding to insert"""
+    previous = g.get('db_read_replica', False)
+    g.db_read_replica = False
+    try:
+        yield
+    finally:
+        g.db_read_replica = previous
+
+
+def read_replica(view):
+    """Serve a read-only view from the replica, re-running it on the primary if the replica fails"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        router = _router()
+        if router is None or not router.available() or _sticky_to_primary():
+            return view(*args, **kwargs)
+        router.count('replica_requests')
+        failures = router.stats['replica_failures']
+        g.db_read_replica = True
+        try:
+            return view(*args, **kwargs)
+        except exc.DBAPIError:
+            if router.stats['replica_failures'] == failures:
+                raise  # Not a replica failure
+            router.db.session.rollback()
+            router.count('primary_fallbacks')
+            current_app.logger.warning(f"Read replica unavailable, serving {view.__name__} from the primary")
+            g.db_read_replica = False
+            return view(*args, **kwargs)
+        finally:
+            g.db_read_replica = False
+
+    return wrapper
+
+
+def init_database_routing(app, db):
+    """Attach pool metrics to every engine and replica failure handling; returns the router"""
+    replica = db.engines.get(REPLICA_BIND)
+    router = ReplicaRouter(db, replica, app.config['DB_REPLICA_DOWN_SECONDS'],
+                           app.config['DB_REPLICA_STICKY_SECONDS'])
+    for key, engine in db.engines.items():
+        router.metrics[key] = PoolMetrics(engine)
+
+    if replica is not None:
+        @event.listens_for(replica, 'handle_error')
+        def replica_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, (exc.OperationalError,
+                                                                                 exc.InterfaceError)):
+                router.mark_down(context.original_exception)
+
+        @app.after_request
+        def stick_to_primary_after_write(response):
+            # The replica may lag a write by a moment; keep this browser on the primary until it catches up
+            if g.get('db_wrote'):
+                browser_session['db_primary_until'] = time.time() + router.sticky_seconds
+            return response
+
+    app.extensions['db_router'] = router
+    return router
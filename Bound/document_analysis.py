@@ -0,0 +1,164 @@
+"""
+Structured AI document analysis stored as document_finding rows
+
+analyze_legal_document returns lists of key points, dates, obligations,
+restrictions, child-related points, action items and red flags. Each item is
+kept as one row, in the order the model listed it, so pages query the rows
+instead of re-parsing JSON. Important dates get a parsed finding_date and are
+offered on the dashboard as suggested deadlines until accepted or dismissed.
+
+Documents analysed before these rows existed only have ai_key_points, a JSON
+list; the backfill copies those into key_point rows.
+"""
+
+import json
+import re
+from datetime import date, datetime
+
+from sqlalchemy import exists, insert, select
+
+from app import db
+from models import Deadline, Document, DocumentFinding
+
+# analysis key -> finding kind
+FINDING_KINDS = {
+    'key_points': 'key_point',
+    'important_dates': 'important_date',
+    'obligations': 'obligation',
+    'restrictions': 'restriction',
+    'children_related': 'children_related',
+    'action_items': 'action_item',
+    'red_flags': 'red_flag',
+}
+
+MONTHS = {name: number for number, name in enumerate(
+    ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+     'august', 'september', 'october', 'november', 'december'], start=1)}
+
+ISO_DATE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+US_DATE = re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b')
+NAMED_DATE = re.compile(r'\b(' + '|'.join(name[:3] for name in MONTHS) + r')[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b',
+                        re.IGNORECASE)
+
+
+def _make_date(year, month, day):
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def extract_date(text):
+    """The first date in a piece of text (2025-03-14, 3/14/2025 or March 14, 2025), or None"""
+    if not text:
+        return None
+    match = ISO_DATE.search(text)
+    if match:
+        return _make_date(*match.groups())
+    match = US_DATE.search(text)
+    if match:
+        month, day, year = match.groups()
+        return _make_date(year, month, day)
+    match = NAMED_DATE.search(text)
+    if match:
+        month_name, day, year = match.groups()
+        month = next(number for name, number in MONTHS.items() if name.startswith(month_name.lower()))
+        return _make_date(year, month, day)
+    return None
+
+
+def _finding_text_and_date(item):
+    # Dates come back as {"date": "YYYY-MM-DD", "description": "..."}; older prompts returned plain strings
+    if isinstance(item, dict):
+        description = str(item.get('description') or item.get('text') or '').strip()
+        raw_date = str(item.get('date') or '').strip()
+        finding_date = extract_date(raw_date) or extract_date(description)
+        text = description or raw_date
+        if raw_date and description and finding_date is None:
+            text = f"{raw_date}: {description}"
+        return text, finding_date
+    text = str(item).strip()
+    return text, extract_date(text)
+
+
+def finding_rows(document_id, case_id, analysis):
+    """Row values for every item in an analysis result"""
+    rows = []
+    for key, kind in FINDING_KINDS.items():
+        items = analysis.get(key) or []
+        if not isinstance(items, list):
+            items = [items]
+        position = 0
+        for item in items:
+            text, finding_date = _finding_text_and_date(item)
+            if not text:
+                continue
+            dated = kind == 'important_date' and finding_date is not None
+            rows.append({
+                'document_id': document_id, 'case_id': case_id, 'kind': kind, 'position': position, 'text': text,
+                'finding_date': finding_date if kind == 'important_date' else None,
+                'suggestion_status': 'pending' if dated else None,
+            })
+            position += 1
+    return rows
+
+
+def store_analysis(document, analysis):
+    """Set a document's AI fields and findings from an analyze_legal_document result; caller commits"""
+    document.ai_summary = analysis.get('summary', '')
+    document.ai_category_suggestion = analysis.get('suggested_category', 'other')
+    # document_id is filled in from the relationship when the document is flushed
+    document.findings = [DocumentFinding(**row) for row in finding_rows(document.id, document.case_id, analysis)]
+    return document.findings
+
+
+def findings_by_kind(findings):
+    """{kind: [finding, ...]} in FINDING_KINDS order, leaving out kinds with no findings"""
+    grouped = {kind: [] for kind in FINDING_KINDS.values()}
+    for finding in findings:
+        grouped.setdefault(finding.kind, []).append(finding)
+    return {kind: items for kind, items in grouped.items() if items}
+
+
+def suggested_deadlines(case_id, today=None, limit=5):
+    """Pending dated findings from today on, soonest first, with their documents"""
+    today = today or date.today()
+    return DocumentFinding.query.filter(
+        DocumentFinding.case_id == case_id, DocumentFinding.suggestion_status == 'pending',
+        DocumentFinding.finding_date >= today
+    ).join(Document).add_entity(Document).order_by(DocumentFinding.finding_date).limit(limit).all()
+
+
+def accept_suggestion(finding, title=None, deadline_type='other'):
+    """Create a deadline from a dated finding; caller schedules its reminder and commits"""
+    document = finding.document
+    deadline = Deadline()
+    deadline.case_id = finding.case_id
+    deadline.title = (title or finding.text)[:200]
+    deadline.deadline_date = datetime.combine(finding.finding_date, datetime.min.time())
+    deadline.deadline_type = deadline_type
+    deadline.description = f"From {document.original_filename}: {finding.text}"
+    db.session.add(deadline)
+    db.session.flush()
+    finding.deadline_id = deadline.id
+    finding.suggestion_status = 'accepted'
+    return deadline
+
+
+def backfill_document_findings(connection):
+    """Copy ai_key_points of documents with no findings into key_point rows; returns the rows added"""
+    has_findings = exists().where(DocumentFinding.document_id == Document.id)
+    documents = connection.execute(
+        select(Document.id, Document.case_id, Document.ai_key_points)
+        .where(Document.ai_key_points.isnot(None), Document.ai_key_points != '', ~has_findings)).all()
+    rows = []
+    for document_id, case_id, ai_key_points in documents:
+        try:
+            key_points = json.loads(ai_key_points)
+        except ValueError:
+            key_points = [ai_key_points]
+        rows.extend(finding_rows(document_id, case_id, {'key_points': key_points}))
+    if rows:
+        now = datetime.utcnow()
+        connection.execute(insert(DocumentFinding.__table__), [dict(row, created_at=now, updated_at=now) for row in rows])
+    return len(rows)
@@ -0,0 +1,151 @@
+"""
+Server-side form drafts updated with field-level patches and version checks
+"""
+
+import json
+import re
+import threading
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Draft
+from case_shards import each_case_database
+
+FORM_KEY_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,99}$')
+MAX_FIELDS = 100
+MAX_VALUE_LENGTH = 100_000
+
+
+class DraftConflict(Exception):
+    """A patched field was changed by another client since the patch's base version"""
+
+    def __init__(self, draft, fields):
+        super().__init__(f"Draft changed elsewhere: {', '.join(sorted(fields))}")
+        self.draft = draft
+        self.fields = sorted(fields)
+
+
+def validate_form_key(form_key):
+    if not FORM_KEY_PATTERN.match(form_key or ''):
+        raise ValueError(f"Invalid draft key: {form_key!r}")
+    return form_key
+
+
+def _validate_changes(changes):
+    if not isinstance(changes, dict) or len(changes) > MAX_FIELDS:
+        raise ValueError(f"changes must be an object with at most {MAX_FIELDS} fields")
+    for name, value in changes.items():
+        values = value if isinstance(value, list) else [value]
+        if not all(item is None or isinstance(item, (str, int, float, bool)) for item in values):
+            raise ValueError(f"{name} must be a string, a list of strings or null")
+        if sum(len(str(item)) for item in values if item is not None) > MAX_VALUE_LENGTH:
+            raise ValueError(f"{name} is longer than {MAX_VALUE_LENGTH} characters")
+    return changes
+
+
+def serialize_draft(draft):
+    return {
+        'form_key': draft.form_key,
+        'version': draft.version,
+        'fields': json.loads(draft.fields),
+        'updated_at': draft.updated_at.isoformat() if draft.updated_at else None,
+    }
+
+
+def get_draft(case_id, form_key):
+    return Draft.query.filter_by(case_id=case_id, form_key=validate_form_key(form_key)).first()
+
+
+def patch_draft(case_id, form_key, base_version, changes, ttl):
+    """Merge changed fields into a draft and return it; a None value removes a field
+
+    A patch only conflicts if one of *its* fields was changed after
+    ``base_version``; edits to different fields from two devices merge. The
+    write is a compare-and-set on the version, so concurrent patches cannot
+    overwrite each other silently.
+    """
+    validate_form_key(form_key)
+    _validate_changes(changes)
+    now = datetime.utcnow()
+
+    draft = get_draft(case_id, form_key)
+    if draft is None:
+        draft = Draft(case_id=case_id, form_key=form_key, fields='{}', field_versions='{}', version=0,
+                      expires_at=now + ttl)
+        db.session.add(draft)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()  # Created concurrently by another request
+            draft = get_draft(case_id, form_key)
+
+    fields = json.loads(draft.fields)
+    field_versions = json.loads(draft.field_versions)
+    base_version = base_version or 0
+    conflicts = {name for name in changes if field_versions.get(name, 0) > base_version}
+    if conflicts:
+        db.session.rollback()
+        raise DraftConflict(draft, conflicts)
+
+    new_version = draft.version + 1
+    for name, value in changes.items():
+        if value is None:
+            fields.pop(name, None)
+        else:
+            fields[name] = value
+        field_versions[name] = new_version
+
+    table = Draft.__table__
+    result = db.session.execute(update(table).where(table.c.id == draft.id, table.c.version == draft.version).values(
+        fields=json.dumps(fields), field_versions=json.dumps(field_versions), version=new_version,
+        updated_at=now, expires_at=now + ttl))
+    if result.rowcount == 0:
+        db.session.rollback()
+        # Another patch landed between our read and write; re-check against it
+        return patch_draft(case_id, form_key, base_version, changes, ttl)
+    db.session.commit()
+    db.session.refresh(draft)
+    return draft
+
+
+def discard_draft(case_id, form_key):
+    """Delete a draft once its form has been submitted; caller commits"""
+    Draft.query.filter_by(case_id=case_id, form_key=validate_form_key(form_key)).delete()
+
+
+def prune_expired_drafts(now=None):
+    """Delete drafts past their expiry; returns the number removed"""
+    removed = Draft.query.filter(Draft.expires_at < (now or datetime.utcnow())).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+_cleanup_thread = None
+
+
+def start_draft_cleanup(app, interval=3600):
+    """Daemon thread that prunes expired drafts every ``interval`` seconds"""
+    global _cleanup_thread
+    if _cleanup_thread is not None:
+        return _cleanup_thread
+
+    def run():
+        stop = threading.Event()
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    removed = sum(prune_expired_drafts() for _ in each_case_database(app))
+                    if removed:
+                        app.logger.info(f"Pruned {removed} expired drafts")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Draft cleanup failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    _cleanup_thread = threading.Thread(target=run, name='draft-cleanup', daemon=True)
+    _cleanup_thread.start()
+    return _cleanup_thread
@@ -0,0 +1,163 @@
+"""
+Near-duplicate detection for incidents and documents using MinHash and LSH
+"""
+
+import hashlib
+import re
+
+import numpy as np
+
+from app import db
+from models import DuplicateSignature, DuplicateBucket
+
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+DUPLICATE_THRESHOLD = 0.6
+SHINGLE_SIZE = 2
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1544)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERMUTATIONS, dtype=np.int64).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERMUTATIONS, dtype=np.int64).astype(np.uint64)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text):
+    """Word shingles of normalized text, falling back to character shingles for short text"""
+    words = WORD_PATTERN.findall((text or '').lower())
+    if len(words) >= SHINGLE_SIZE:
+        return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    joined = ' '.join(words)
+    if len(joined) > 5:
+        return {joined[i:i + 5] for i in range(len(joined) - 4)}
+    return {joined} if joined else set()
+
+
+def _shingle_hashes(values):
+    return np.array([int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=4).digest(), 'little')
+                     for value in values], dtype=np.uint64)
+
+
+def minhash_signature(text):
+    """MinHash signature of the text's shingles, or None for empty text"""
+    values = shingles(text)
+    if not values:
+        return None
+    hashes = _shingle_hashes(values)
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+
+def estimate_similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity from two MinHash signatures"""
+    return float(np.mean(signature_a == signature_b))
+
+
+def band_keys(signature):
+    """One 63-bit bucket key per LSH band; items sharing any key are candidates"""
+    keys = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()
+        digest = hashlib.blake2b(bytes([band]) + rows, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little') >> 1)
+    return keys
+
+
+def find_duplicates(case_id, item_type, text, exclude_id=None, threshold=DUPLICATE_THRESHOLD):
+    """Existing items whose text is estimated to be at least ``threshold`` similar
+
+    Returns a list of (item_id, similarity) sorted by similarity, most similar first.
+    """
+    signature = minhash_signature(text)
+    if signature is None:
+        return []
+    return _candidates(case_id, item_type, signature, exclude_id, threshold)
+
+
+def _candidates(case_id, item_type, signature, exclude_id, threshold):
+    candidate_ids = {row.item_id for row in DuplicateBucket.query.filter(
+        DuplicateBucket.case_id == case_id,
+        DuplicateBucket.item_type == item_type,
+        DuplicateBucket.bucket_key.in_(band_keys(signature))
+    ).with_entities(DuplicateBucket.item_id).distinct()}
+    candidate_ids.discard(exclude_id)
+    if not candidate_ids:
+        return []
+
+    matches = []
+    for stored in DuplicateSignature.query.filter(
+            DuplicateSignature.item_type == item_type,
+            DuplicateSignature.item_id.in_(candidate_ids)).all():
+        similarity = estimate_similarity(signature, np.frombuffer(stored.signature, dtype=np.uint32))
+        if similarity >= threshold:
+            matches.append((stored.item_id, similarity))
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches
+
+
+def record_signature(case_id, item_type, item_id, text):
+    """Store (or replace) an item's signature and LSH buckets; caller commits"""
+    remove_signature(item_type, item_id)
+    signature = minhash_signature(text)
+    if signature is None:
+        return None
+    db.session.add(DuplicateSignature(case_id=case_id, item_type=item_type, item_id=item_id,
+                                      signature=signature.tobytes()))
+    for key in band_keys(signature):
+        db.session.add(DuplicateBucket(case_id=case_id, item_type=item_type, item_id=item_id, bucket_key=key))
+    return signature
+
+
+def remove_signature(item_type, item_id):
+    """Drop an item from the duplicate index; caller commits"""
+    DuplicateSignature.query.filter_by(item_type=item_type, item_id=item_id).delete()
+    DuplicateBucket.query.filter_by(item_type=item_type, item_id=item_id).delete()
+
+
+def duplicate_report(case_id, item_type, threshold=DUPLICATE_THRESHOLD):
+    """Group indexed items of one type into clusters of likely duplicates"""
+    signatures = {row.item_id: np.frombuffer(row.signature, dtype=np.uint32)
+                  for row in DuplicateSignature.query.filter_by(case_id=case_id, item_type=item_type).all()}
+
+    # Items sharing a bucket are candidate pairs; group them by bucket in one pass
+    buckets = {}
+    for row in DuplicateBucket.query.filter_by(case_id=case_id, item_type=item_type).all():
+        buckets.setdefault(row.bucket_key, []).append(row.item_id)
+
+    parent = {item_id: item_id for item_id in signatures}
+
+    def find(item_id):
+        while parent[item_id] != item_id:
+            parent[item_id] = parent[parent[item_id]]
+            item_id = parent[item_id]
+        return item_id
+
+    checked = set()
+    pair_scores = {}
+    for members in buckets.values():
+        for i, first in enumerate(members):
+            for second in members[i + 1:]:
+                pair = (min(first, second), max(first, second))
+                if pair in checked or first not in signatures or second not in signatures:
+                    continue
+                checked.add(pair)
+                similarity = estimate_similarity(signatures[first], signatures[second])
+                if similarity >= threshold:
+                    pair_scores[pair] = similarity
+                    parent[find(first)] = find(second)
+
+    clusters = {}
+    for item_id in signatures:
+        clusters.setdefault(find(item_id), []).append(item_id)
+    report = []
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        members.sort()
+        scores = [score for pair, score in pair_scores.items() if pair[0] in members]
+        report.append({'item_type': item_type, 'item_ids': members, 'max_similarity': max(scores)})
+    report.sort(key=lambda cluster: cluster['max_similarity'], reverse=True)
+    return report
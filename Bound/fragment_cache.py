@@ -0,0 +1,243 @@
+"""
+Template fragment caching keyed by case and per-table version counters
+
+Usage in a template:
+
+    {% cache 'dashboard-stats', case.id, 'document', 'deadline' %}
+        ... expensive markup ...
+    {% endcache %}
+
+The key combines the fragment name, the case and the current version of each
+listed table, so any write to those tables renders a fresh fragment and old
+entries simply age out of the backend. Extra key parts can be passed with
+``vary=`` (e.g. the current date for relative "in 3 days" text).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from change_tracking import get_versions
+
+
+class MemoryLRUBackend:
+    """In-process LRU of rendered fragments"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FilesystemBackend:
+    """Rendered fragments as files, shared by every worker process on the host"""
+
+    def __init__(self, directory, max_entries=5000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                html, render_time = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return html, render_time
+
+    def set(self, key, entry):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(list(entry), f)
+        os.replace(temp_path, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop the least recently written files beyond max_entries"""
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(paths) <= self.max_entries:
+            return 0
+        paths.sort(key=lambda path: os.path.getmtime(path))
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(paths) - self.max_entries
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+class FragmentCache:
+    """Fragment lookups plus hit, miss and render-time counters"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, name, hit, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'hits': 0, 'misses': 0, 'render_seconds': 0.0,
+                                                  'saved_seconds': 0.0})
+            if hit:
+                stats['hits'] += 1
+                stats['saved_seconds'] += seconds
+            else:
+                stats['misses'] += 1
+                stats['render_seconds'] += seconds
+
+    def fetch(self, name, key, render):
+        """Cached HTML for key, rendering and storing it on a miss"""
+        entry = self.backend.get(key)
+        if entry is not None:
+            html, render_time = entry
+            self._record(name, True, render_time)
+            return html
+        started = time.perf_counter()
+        html = str(render())
+        render_time = time.perf_counter() - started
+        self.backend.set(key, (html, render_time))
+        self._record(name, False, render_time)
+        return html
+
+    def cached_data(self, name, key, load, cacheable=None):
+        """JSON-serialisable value for key, loading and storing it on a miss"""
+        entry = self.backend.get(key)
+        if entry is not None:
+            payload, load_time = entry
+            self._record(name, True, load_time)
+            return json.loads(payload)
+        started = time.perf_counter()
+        value = load()
+        load_time = time.perf_counter() - started
+        if cacheable is None or cacheable(value):
+            self.backend.set(key, (json.dumps(value), load_time))
+        self._record(name, False, load_time)
+        return value
+
+    def stats(self):
+        """Per-fragment and total counters; saved time is the render time each hit avoided"""
+        with self._lock:
+            fragments = {name: dict(stats) for name, stats in self._stats.items()}
+        totals = {'hits': 0, 'misses': 0, 'render_seconds': 0.0, 'saved_seconds': 0.0}
+        for stats in fragments.values():
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+            for field in totals:
+                totals[field] += stats[field]
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = round(totals['hits'] / lookups, 3) if lookups else 0.0
+        return {'backend': type(self.backend).__name__, 'entries': len(self.backend),
+                'totals': totals, 'fragments': fragments}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+
+def _case_versions(case_id):
+    # One lookup of every table version per case per request
+    if not has_request_context():
+        return get_versions(case_id)
+    cache = g.setdefault('_case_versions', {})
+    if case_id not in cache:
+        cache[case_id] = get_versions(case_id)
+    return cache[case_id]
+
+
+def fragment_key(name, case_id, tables, vary=None):
+    versions = _case_versions(case_id)
+    parts = [name, str(case_id)] + [f"{table}={versions.get(table, 0)}" for table in tables]
+    if vary is not None:
+        parts.append(json.dumps(vary, sort_keys=True, default=str))
+    return '|'.join(parts)
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja ``{% cache name, case_id, table, ... [, vary=...] %}...{% endcache %}`` tag"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        vary = nodes.Const(None)
+        while parser.stream.skip_if('comma'):
+            if parser.stream.current.test('name:vary') and parser.stream.look().test('assign'):
+                parser.stream.skip(2)
+                vary = parser.parse_expression()
+            else:
+                args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render', [nodes.List(args), vary])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, args, vary, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or len(args) < 2 or args[1] is None:
+            return caller()
+        name, case_id, tables = args[0], args[1], args[2:]
+        return Markup(cache.fetch(name, fragment_key(name, case_id, tables, vary), caller))
+
+
+def build_backend(app):
+    """Backend named by FRAGMENT_CACHE_BACKEND, or None when caching is off"""
+    backend = app.config['FRAGMENT_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryLRUBackend(app.config['FRAGMENT_CACHE_SIZE'])
+    if backend == 'filesystem':
+        return FilesystemBackend(app.config['FRAGMENT_CACHE_DIR'], app.config['FRAGMENT_CACHE_SIZE'])
+    if backend == 'off':
+        return None
+    raise ValueError(f"Unknown fragment cache backend: {backend}")
+
+
+def init_fragment_cache(app):
+    """Register the {% cache %} tag; it renders uncached when the backend is 'off'"""
+    backend = build_backend(app)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(backend) if backend is not None else None
+    return app.jinja_env.fragment_cache
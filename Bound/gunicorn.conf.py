@@ -0,0 +1,4 @@
+# Loaded by gunicorn from the working directory; SERVING_MODE=async switches to threaded workers (see serving.py)
+from serving import gunicorn_settings
+
+globals().update(gunicorn_settings())
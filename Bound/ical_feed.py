@@ -0,0 +1,144 @@
+"""
+Per-case iCalendar feed of deadlines
+"""
+
+import hashlib
+import hmac
+import threading
+from datetime import datetime, timedelta
+
+from models import Deadline
+from change_tracking import get_version
+
+PRODID = '-//Legal Case Binder//Deadlines//EN'
+EVENT_DURATION = timedelta(hours=1)
+
+
+def feed_token(secret_key, case_id):
+    """Unguessable token for a case's feed URL; calendar apps cannot send session cookies"""
+    key = secret_key.encode('utf-8') if isinstance(secret_key, str) else secret_key
+    return hmac.new(key, f"calendar:{case_id}".encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def check_feed_token(secret_key, case_id, token):
+    return hmac.compare_digest(feed_token(secret_key, case_id), token or '')
+
+
+def escape_text(value):
+    """Escape a TEXT property value (RFC 5545 section 3.3.11)"""
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold_line(line):
+    """Fold a content line at 75 octets without splitting UTF-8 sequences"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74  # Continuation lines start with a space
+    return '\r\n '.join(parts)
+
+
+def _format_local(value):
+    # Deadlines are entered as local wall-clock time, so they are emitted as floating times
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def render_event(deadline, stamp):
+    """VEVENT block for one deadline"""
+    summary = deadline.title or 'Deadline'
+    if deadline.is_completed:
+        summary = f"[Completed] {summary}"
+    description = [line for line in [
+        f"Type: {deadline.deadline_type.replace('_', ' ').title()}" if deadline.deadline_type else None,
+        f"Priority: {deadline.priority.title()}" if deadline.priority else None,
+        deadline.description,
+        f"Completion notes: {deadline.completion_notes}" if deadline.completion_notes else None,
+    ] if line]
+
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:deadline-{deadline.id}-case-{deadline.case_id}@legal-case-binder",
+        f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{_format_local(deadline.deadline_date)}",
+        f"DTEND:{_format_local(deadline.deadline_date + EVENT_DURATION)}",
+        f"SUMMARY:{escape_text(summary)}",
+    ]
+    if description:
+        lines.append(f"DESCRIPTION:{escape_text(chr(10).join(description))}")
+    if deadline.location:
+        lines.append(f"LOCATION:{escape_text(deadline.location)}")
+    if deadline.deadline_type:
+        lines.append(f"CATEGORIES:{escape_text(deadline.deadline_type.replace('_', ' ').title())}")
+    if deadline.priority in ('critical', 'high'):
+        lines.append('PRIORITY:1' if deadline.priority == 'critical' else 'PRIORITY:3')
+    if deadline.reminder_days and not deadline.is_completed:
+        lines.extend(['BEGIN:VALARM', 'ACTION:DISPLAY', f"DESCRIPTION:{escape_text(summary)}",
+                      f"TRIGGER:-P{deadline.reminder_days}D", 'END:VALARM'])
+    lines.append('END:VEVENT')
+    return '\r\n'.join(fold_line(line) for line in lines) + '\r\n'
+
+
+def _event_key(deadline):
+    return (deadline.title, deadline.deadline_date, deadline.deadline_type, deadline.description,
+            deadline.location, deadline.priority, deadline.reminder_days, deadline.is_completed,
+            deadline.completion_notes)
+
+
+class CalendarFeedCache:
+    """Rendered feeds per case, revalidated against the deadline table version
+
+    A request only costs one primary-key lookup while the deadlines are
+    unchanged. When they change, the feed is rebuilt from cached VEVENT
+    blocks, re-rendering only the deadlines whose fields differ.
+    """
+
+    def __init__(self):
+        self._feeds = {}   # case_id -> (version, body, last_modified)
+        self._events = {}  # case_id -> {deadline_id: (event_key, text)}; deadline ids repeat across case shards
+        self._lock = threading.Lock()
+
+    def validators(self, case_id):
+        """(etag, last_modified) for the current version of a case's feed"""
+        version, updated_at = get_version(case_id, Deadline.__tablename__)
+        return f"deadlines-{case_id}-v{version}", updated_at, version
+
+    def feed(self, case, version, last_modified):
+        """Calendar body for a case at the given deadline version"""
+        with self._lock:
+            cached = self._feeds.get(case.id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        deadlines = Deadline.query.filter_by(case_id=case.id).order_by(Deadline.deadline_date).all()
+        stamp = last_modified or case.created_at or datetime.utcnow()
+        parts = ['BEGIN:VCALENDAR\r\n', 'VERSION:2.0\r\n', f"PRODID:{PRODID}\r\n", 'CALSCALE:GREGORIAN\r\n',
+                 'METHOD:PUBLISH\r\n', fold_line(f"X-WR-CALNAME:{escape_text(case.case_title)} - Deadlines") + '\r\n']
+        with self._lock:
+            previous = self._events.get(case.id, {})
+            events = {}  # Only the deadlines still present, so deleted ones are dropped
+            for deadline in deadlines:
+                if deadline.deadline_date is None:
+                    continue
+                key = _event_key(deadline)
+                cached_event = previous.get(deadline.id)
+                if cached_event is None or cached_event[0] != key:
+                    cached_event = (key, render_event(deadline, stamp))
+                events[deadline.id] = cached_event
+                parts.append(cached_event[1])
+            parts.append('END:VCALENDAR\r\n')
+            body = ''.join(parts).encode('utf-8')
+            self._events[case.id] = events
+            self._feeds[case.id] = (version, body, last_modified)
+        return body
+
+
+feed_cache = CalendarFeedCache()
@@ -0,0 +1,124 @@
+"""
+Which children were involved in each incident, as indexed incident_child rows
+
+Incident.children_involved used to be the only record: a Text column holding
+a JSON list of child IDs (or, from older forms, a single ID or a comma
+separated list). It is still written for display and the API, but lookups by
+child go through the incident_child association table.
+"""
+
+import json
+
+from sqlalchemy import case as sql_case, exists, func, insert, select
+
+from app import db
+from models import Child, Incident, incident_child
+
+SERIOUS_SEVERITIES = ('high', 'critical')
+
+
+def parse_child_ids(value):
+    """Child IDs from a children_involved value: a JSON list, a comma separated list or a single ID"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        value = str(value).strip()
+        if not value:
+            return []
+        try:
+            items = json.loads(value)
+        except ValueError:
+            items = value.split(',')
+        if not isinstance(items, list):
+            items = [items]
+    child_ids = []
+    for item in items:
+        try:
+            child_id = int(str(item).strip())
+        except ValueError:
+            continue
+        if child_id not in child_ids:
+            child_ids.append(child_id)
+    return child_ids
+
+
+def _case_child_ids(connection, case_ids):
+    rows = connection.execute(select(Child.id, Child.case_id).where(Child.case_id.in_(case_ids)))
+    return {(case_id, child_id) for child_id, case_id in rows}
+
+
+def _link_rows(connection, incidents):
+    # incidents: (incident_id, case_id, children_involved); links only to children of the same case
+    incidents = [(incident_id, case_id, parse_child_ids(value)) for incident_id, case_id, value in incidents]
+    incidents = [entry for entry in incidents if entry[2]]
+    if not incidents:
+        return []
+    valid = _case_child_ids(connection, {case_id for _, case_id, _ in incidents})
+    return [{'incident_id': incident_id, 'child_id': child_id}
+            for incident_id, case_id, child_ids in incidents
+            for child_id in child_ids if (case_id, child_id) in valid]
+
+
+def assign_children(incident, child_ids):
+    """Set an incident's children from submitted IDs, ignoring children of other cases; caller commits"""
+    child_ids = parse_child_ids(child_ids)
+    children = Child.query.filter(Child.case_id == incident.case_id, Child.id.in_(child_ids)).all() if child_ids else []
+    children.sort(key=lambda child: child_ids.index(child.id))
+    incident.children = children
+    incident.children_involved = json.dumps([child.id for child in children]) if children else None
+    return children
+
+
+def link_incident_children(case_id, rows):
+    """Insert links for bulk-inserted incidents from (incident_id, children_involved) pairs; caller commits"""
+    links = _link_rows(db.session.connection(), [(incident_id, case_id, value) for incident_id, value in rows])
+    if links:
+        db.session.execute(insert(incident_child), links)
+    return len(links)
+
+
+def backfill_incident_children(connection):
+    """Link incidents whose children_involved predates the association table; returns the links added"""
+    linked = exists().where(incident_child.c.incident_id == Incident.id)
+    incidents = connection.execute(
+        select(Incident.id, Incident.case_id, Incident.children_involved)
+        .where(Incident.children_involved.isnot(None), Incident.children_involved != '', ~linked)).all()
+    links = _link_rows(connection, incidents)
+    if links:
+        connection.execute(insert(incident_child), links)
+    return len(links)
+
+
+def child_incident_history(case_id, limit=5):
+    """Incident count, serious count, latest date and the most recent incidents for every child in a case
+
+    One query: window functions count and rank each child's incidents, and
+    only the top ``limit`` rows per child are returned.
+    """
+    by_child = {'partition_by': incident_child.c.child_id}
+    ranked = (
+        select(
+            incident_child.c.child_id,
+            Incident.id, Incident.title, Incident.incident_date, Incident.incident_type, Incident.severity,
+            func.row_number().over(order_by=(Incident.incident_date.desc(), Incident.id.desc()),
+                                   **by_child).label('position'),
+            func.count().over(**by_child).label('total'),
+            func.sum(sql_case((Incident.severity.in_(SERIOUS_SEVERITIES), 1), else_=0)).over(**by_child)
+                .label('serious'),
+        )
+        .join(Incident, Incident.id == incident_child.c.incident_id)
+        .where(Incident.case_id == case_id)
+        .subquery()
+    )
+    rows = db.session.execute(select(ranked).where(ranked.c.position <= limit)
+                              .order_by(ranked.c.child_id, ranked.c.position)).all()
+
+    history = {}
+    for row in rows:
+        entry = history.setdefault(row.child_id, {'total': row.total, 'serious': row.serious or 0,
+                                                  'last_incident_date': row.incident_date, 'recent': []})
+        entry['recent'].append({'id': row.id, 'title': row.title, 'incident_date': row.incident_date,
+                                'incident_type': row.incident_type, 'severity': row.severity})
+    return history
@@ -0,0 +1,257 @@
+"""
+Model tiers for OpenAI tasks, latency-based fallback and per-case token budgets
+
+Each task runs on a tier ('large' or 'small', models set by OPENAI_MODEL_LARGE
+and OPENAI_MODEL_SMALL) and has a latency SLO. A request drops to the next
+cheaper tier when:
+- the task's tier already has OPENAI_MAX_IN_FLIGHT requests running;
+- the tier's 90th percentile latency over the last OPENAI_LATENCY_WINDOW_SECONDS
+  is over the SLO (one request per OPENAI_LATENCY_PROBE_SECONDS still goes
+  to it as a probe, with the usual fallback, so the tier can recover);
+- a case has used AI_BUDGET_SOFT_RATIO of its monthly token budget.
+
+A call that times out on its SLO, or is rate limited, is retried once on the
+cheaper tier. Once a case's budget is spent, calls raise BudgetExceeded,
+which the openai_service functions turn into their usual fallback results.
+Token usage from each response is stored in ai_usage.
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import openai as openai_errors
+from flask import g, has_app_context
+from sqlalchemy import func, insert, select
+
+from app import app, db
+from database_pool import release_connection
+from models import AIUsage
+from sqlite_tuning import writer_slot
+
+TIER_ORDER = ['large', 'small']  # Most to least capable
+
+# task -> (default tier, latency SLO in seconds)
+TASKS = {
+    'document_analysis': ('large', 30.0),
+    'case_summary': ('large', 30.0),
+    'preparation_checklist': ('large', 20.0),
+    'incident_severity': ('large', 15.0),
+    'incident_severity_batch': ('large', 60.0),
+    'document_category': ('small', 5.0),
+}
+
+RETRYABLE_ERRORS = (openai_errors.APITimeoutError, openai_errors.APIConnectionError,
+                    openai_errors.RateLimitError, openai_errors.InternalServerError)
+
+
+class BudgetExceeded(Exception):
+    """The case has used its monthly AI token budget"""
+
+
+def month_start(now=None):
+    now = now or datetime.utcnow()
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+class LatencyTracker:
+    """Latencies from the last ``max_age`` seconds and in-flight requests for one model"""
+
+    def __init__(self, window=50, max_age=300.0, probe_interval=60.0):
+        self._latencies = deque(maxlen=window)  # (monotonic time, seconds)
+        self._lock = threading.Lock()
+        self.max_age = max_age
+        self.probe_interval = probe_interval
+        self._last_probe = time.monotonic()  # No probe is due until a slow tier has been skipped for a while
+        self.in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, latency=None):
+        with self._lock:
+            self.in_flight -= 1
+            if latency is not None:
+                self._latencies.append((time.monotonic(), latency))
+
+    def _recent(self, now):
+        while self._latencies and self._latencies[0][0] < now - self.max_age:
+            self._latencies.popleft()
+        return [latency for _, latency in self._latencies]
+
+    def p90(self, now=None):
+        with self._lock:
+            latencies = sorted(self._recent(now or time.monotonic()))
+        if len(latencies) < 5:
+            return None  # Too few recent requests to judge
+        return latencies[int(len(latencies) * 0.9) - 1]
+
+    def take_probe(self, now=None):
+        """True at most once per probe_interval: send this request despite the latency, to re-measure it"""
+        now = now or time.monotonic()
+        with self._lock:
+            if now - self._last_probe < self.probe_interval:
+                return False
+            self._last_probe = now
+            return True
+
+    def snapshot(self):
+        p90 = self.p90()
+        with self._lock:
+            samples = len(self._latencies)
+        return {'in_flight': self.in_flight, 'samples': samples,
+                'p90_seconds': round(p90, 3) if p90 is not None else None}
+
+
+def tokens_used(case_id, since=None):
+    """Tokens recorded for a case since the start of the month, including this request's unsaved usage"""
+    since = since or month_start()
+    used = db.session.execute(select(func.coalesce(func.sum(AIUsage.total_tokens), 0))
+                              .where(AIUsage.case_id == case_id, AIUsage.created_at >= since)).scalar()
+    pending = g.get('pending_ai_usage', []) if has_app_context() else []
+    return used + sum(row['total_tokens'] for row in pending if row['case_id'] == case_id)
+
+
+def usage_report(case_id, since=None):
+    """This month's tokens for a case by task and model"""
+    since = since or month_start()
+    rows = db.session.execute(
+        select(AIUsage.task, AIUsage.model, func.count(), func.sum(AIUsage.total_tokens),
+               func.avg(AIUsage.latency_ms))
+        .where(AIUsage.case_id == case_id, AIUsage.created_at >= since)
+        .group_by(AIUsage.task, AIUsage.model)).all()
+    return [{'task': task, 'model': model, 'requests': count, 'tokens': tokens or 0,
+             'avg_latency_ms': round(latency) if latency is not None else None}
+            for task, model, count, tokens, latency in rows]
+
+
+class ModelRouter:
+    def __init__(self, client, config):
+        self.client = client
+        self.models = {'large': config['OPENAI_MODEL_LARGE'], 'small': config['OPENAI_MODEL_SMALL']}
+        self.task_tiers = {task: tier for task, (tier, _) in TASKS.items()}
+        for task, tier in config['OPENAI_TASK_TIERS'].items():
+            if task not in TASKS or tier not in TIER_ORDER:
+                raise ValueError(f"Unknown OpenAI task or tier: {task}={tier}")
+            self.task_tiers[task] = tier
+        self.max_in_flight = config['OPENAI_MAX_IN_FLIGHT']
+        self.budget = config['AI_CASE_MONTHLY_TOKEN_BUDGET']
+        self.soft_ratio = config['AI_BUDGET_SOFT_RATIO']
+        self.latency = {tier: LatencyTracker(max_age=config['OPENAI_LATENCY_WINDOW_SECONDS'],
+                                             probe_interval=config['OPENAI_LATENCY_PROBE_SECONDS'])
+                        for tier in TIER_ORDER}
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'downgraded': 0, 'retried_on_cheaper_tier': 0, 'budget_blocked': 0,
+                      'latency_probes': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def budget_status(self, case_id):
+        """(tokens used this month, budget or None, 'ok'/'soft'/'exhausted')"""
+        if not self.budget or case_id is None:
+            return None, None, 'ok'
+        used = tokens_used(case_id)
+        if used >= self.budget:
+            return used, self.budget, 'exhausted'
+        return used, self.budget, 'soft' if used >= self.budget * self.soft_ratio else 'ok'
+
+    def plan(self, task, case_id=None):
+        """Tiers to try in order, and why the first is cheaper than the task's own tier (or None)"""
+        _, slo = TASKS[task]
+        tiers = TIER_ORDER[TIER_ORDER.index(self.task_tiers[task]):]
+        reason = None
+
+        _, _, budget = self.budget_status(case_id)
+        if budget == 'exhausted':
+            self._count('budget_blocked')
+            raise BudgetExceeded("This case has used its AI token budget for the month")
+        if budget == 'soft' and len(tiers) > 1:
+            tiers, reason = tiers[-1:], 'budget'
+
+        while len(tiers) > 1:
+            tracker = self.latency[tiers[0]]
+            p90 = tracker.p90()
+            if tracker.in_flight >= self.max_in_flight:
+                reason = 'load'
+            elif p90 is not None and p90 > slo:
+                if tracker.take_probe():
+                    self._count('latency_probes')
+                    break
+                reason = 'latency'
+            else:
+                break
+            tiers = tiers[1:]
+        return tiers, reason
+
+    def complete(self, task, case_id=None, **request):
+        """chat.completions.create on the routed model, recording the tokens used"""
+        tiers, reason = self.plan(task, case_id)
+        _, slo = TASKS[task]
+        self._count('requests')
+        if reason:
+            self._count('downgraded')
+        if has_app_context():
+            release_connection(db.session())  # Not held while waiting on the model
+        for position, tier in enumerate(tiers):
+            last = position == len(tiers) - 1
+            # Earlier tiers get the SLO as a hard timeout and no client retries, leaving time to fall back
+            client = self.client if last else self.client.with_options(timeout=slo, max_retries=0)
+            tracker = self.latency[tier]
+            tracker.begin()
+            started = time.perf_counter()
+            try:
+                response = client.chat.completions.create(model=self.models[tier], **request)
+            except RETRYABLE_ERRORS as e:
+                tracker.end(time.perf_counter() - started if isinstance(e, openai_errors.APITimeoutError) else None)
+                if last:
+                    raise
+                app.logger.warning(f"{task} on {self.models[tier]} failed ({type(e).__name__}), "
+                                   f"retrying on the {tiers[position + 1]} tier")
+                self._count('retried_on_cheaper_tier')
+                reason = type(e).__name__
+                continue
+            except Exception:
+                tracker.end()
+                raise
+            latency = time.perf_counter() - started
+            tracker.end(latency)
+            self._record(task, tier, case_id, response, latency, reason if tier != self.task_tiers[task] else None)
+            return response
+
+    def _record(self, task, tier, case_id, response, latency, reason):
+        usage = getattr(response, 'usage', None)
+        row = {
+            'case_id': case_id, 'task': task, 'tier': tier, 'model': getattr(response, 'model', None) or self.models[tier],
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+            'total_tokens': getattr(usage, 'total_tokens', 0) or 0,
+            'latency_ms': int(latency * 1000), 'downgrade_reason': reason, 'created_at': datetime.utcnow(),
+        }
+        if has_app_context():
+            g.setdefault('pending_ai_usage', []).append(row)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return dict(stats, models=self.models, task_tiers=self.task_tiers, budget=self.budget,
+                    latency={tier: tracker.snapshot() for tier, tracker in self.latency.items()})
+
+
+@app.teardown_appcontext
+def save_ai_usage(error=None):
+    # Written on its own connection so usage is kept even if the request's transaction rolls back
+    rows = g.pop('pending_ai_usage', None)
+    if not rows:
+        return
+    # This runs before Flask-SQLAlchemy's own teardown; end the session now so an unfinished
+    # transaction (error paths) does not hold the writer slot and SQLite's lock against this insert
+    db.session.remove()
+    try:
+        with writer_slot(app), db.engine.begin() as connection:
+            connection.execute(insert(AIUsage.__table__), rows)
+    except Exception as e:
+        app.logger.error(f"Failed to record AI usage: {str(e)}")
@@ -10,7 +10,16 @@ class Case(db.Model):
     court_name = db.Column(db.String(200))
     case_type = db.Column(db.String(100), default='Family Law')
     filing_date = db.Column(db.Date)
+    
+    # Lifecycle: closed cases are moved into a compressed archive file after a while (see case_archive.py)
+    status = db.Column(db.String(20), default='open')  # 'open', 'closed', 'archived'
+    closed_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime)
+    archive_file = db.Column(db.String(255))
+    rehydrated_at = db.Column(db.DateTime)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     children = relationship("Child", back_populates="case", cascade="all, delete-orphan")
@@ -57,6 +66,8 @@ class Child(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     case = relationship("Case", back_populates="children")
+    incidents = relationship("Incident", secondary="incident_child", back_populates="children",
+                             order_by="Incident.incident_date.desc()")
 
 class Parent(db.Model):
     """Parent/guardian information"""
@@ -126,8 +137,11 @@ class Document(db.Model):
     is_confidential = db.Column(db.Boolean, default=False)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     case = relationship("Case", back_populates="documents")
+    findings = relationship("DocumentFinding", back_populates="document", cascade="all, delete-orphan",
+                            order_by="DocumentFinding.position")
 
 class Incident(db.Model):
     """Incident logging and documentation"""
@@ -143,7 +157,7 @@ class Incident(db.Model):
     location = db.Column(db.String(200))
     
     # People involved
-    children_involved = db.Column(db.Text)  # JSON list of child IDs
+    children_involved = db.Column(db.Text)  # JSON list of child IDs, mirrored in incident_child
     other_party_involved = db.Column(db.Boolean, default=False)
     witnesses = db.Column(db.Text)
     
@@ -162,6 +176,16 @@ class Incident(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     case = relationship("Case", back_populates="incidents")
+    children = relationship("Child", secondary="incident_child", back_populates="incidents",
+                            order_by="Child.first_name")
+
+# Children involved in each incident; the primary key serves incident lookups, the index child lookups
+incident_child = db.Table(
+    'incident_child',
+    db.Column('incident_id', db.Integer, db.ForeignKey('incident.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('child_id', db.Integer, db.ForeignKey('child.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_incident_child_child', 'child_id', 'incident_id'),
+)
 
 class Deadline(db.Model):
     """Important dates and deadline tracking"""
@@ -184,6 +208,7 @@ class Deadline(db.Model):
     priority = db.Column(db.String(20), default='medium')  # 'low', 'medium', 'high', 'critical'
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     case = relationship("Case", back_populates="deadlines")
 
@@ -205,3 +230,170 @@ class CaseNote(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     case = relationship("Case", back_populates="case_notes")
+
+# Keyset indexes for incremental sync through the API: (case, updated_at, id)
+db.Index('ix_case_sync', Case.updated_at, Case.id)
+for _model in (Child, Parent, Document, Incident, Deadline, CaseNote):
+    db.Index(f'ix_{_model.__tablename__}_sync', _model.case_id, _model.updated_at, _model.id)
+
+class DuplicateSignature(db.Model):
+    """MinHash signature of an incident description or document text"""
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False, index=True)
+    
+    item_type = db.Column(db.String(20), nullable=False)  # 'incident', 'document'
+    item_id = db.Column(db.Integer, nullable=False)
+    signature = db.Column(db.LargeBinary, nullable=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('item_type', 'item_id'),)
+
+class DuplicateBucket(db.Model):
+    """LSH band bucket membership used to find near-duplicate candidates"""
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False)
+    
+    item_type = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    bucket_key = db.Column(db.BigInteger, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_duplicate_bucket_lookup', 'case_id', 'item_type', 'bucket_key'),
+        db.Index('ix_duplicate_bucket_item', 'item_type', 'item_id'),
+    )
+
+class SeverityAssessment(db.Model):
+    """Queued AI severity assessment of an incident and its audit trail"""
+    id = db.Column(db.Integer, primary_key=True)
+    incident_id = db.Column(db.Integer, db.ForeignKey('incident.id'), nullable=False, index=True)
+    
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'processing', 'assessed', 'failed'
+    claim_token = db.Column(db.String(32))
+    attempts = db.Column(db.Integer, default=0)
+    
+    # Audit of the user's choice versus the AI assessment
+    user_severity = db.Column(db.String(20))
+    ai_severity = db.Column(db.String(20))
+    legal_implications = db.Column(db.Text)
+    error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    assessed_at = db.Column(db.DateTime)
+    
+    incident = relationship("Incident")
+
+class DeadlineReminder(db.Model):
+    """Scheduled reminder for a deadline, due reminder_days before it"""
+    id = db.Column(db.Integer, primary_key=True)
+    deadline_id = db.Column(db.Integer, db.ForeignKey('deadline.id'), nullable=False, unique=True)
+    
+    remind_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'sending', 'sent', 'cancelled', 'failed'
+    sent_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    deadline = relationship("Deadline")
+    
+    __table_args__ = (db.Index('ix_deadline_reminder_due', 'status', 'remind_at'),
+                      db.Index('ix_deadline_reminder_updated_at', 'updated_at'))
+
+class TableVersion(db.Model):
+    """Per-case change counter for a table, bumped on every write"""
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), primary_key=True)
+    table_name = db.Column(db.String(50), primary_key=True)
+    
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class Draft(db.Model):
+    """Server-side autosave draft of a form, merged from field-level patches"""
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False)
+    form_key = db.Column(db.String(100), nullable=False)  # e.g. 'incident-new', 'case-note-new'
+    
+    fields = db.Column(db.Text, nullable=False, default='{}')  # JSON {field name: value}
+    field_versions = db.Column(db.Text, nullable=False, default='{}')  # JSON {field name: version last changed}
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    __table_args__ = (db.UniqueConstraint('case_id', 'form_key', name='uq_draft_form'),)
+
+class AIUsage(db.Model):
+    """Tokens used by one OpenAI request, for per-case budgets"""
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'))  # None when a request served several cases
+    
+    task = db.Column(db.String(50), nullable=False)  # e.g. 'document_analysis', 'document_category'
+    tier = db.Column(db.String(20), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    total_tokens = db.Column(db.Integer, default=0)
+    latency_ms = db.Column(db.Integer)
+    downgrade_reason = db.Column(db.String(50))  # Why a cheaper tier than the task's was used, if it was
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_ai_usage_case_created', 'case_id', 'created_at'),)
+
+class ChecklistCatalog(db.Model):
+    """AI preparation checklist for a case type and hearing type, shared by every case"""
+    id = db.Column(db.Integer, primary_key=True)
+    case_type = db.Column(db.String(100), nullable=False)
+    hearing_type = db.Column(db.String(50), nullable=False)
+    
+    checklist = db.Column(db.Text)  # JSON from generate_preparation_checklist; kept while a refresh fails
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'refreshing', 'ready', 'failed'
+    error = db.Column(db.Text)
+    
+    generated_at = db.Column(db.DateTime)
+    claimed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.UniqueConstraint('case_type', 'hearing_type', name='uq_checklist_catalog_key'),)
+
+class DocumentFinding(db.Model):
+    """One item from the AI analysis of a document: a key point, date, obligation, action item..."""
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), nullable=False)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False)
+    
+    kind = db.Column(db.String(30), nullable=False)  # 'key_point', 'important_date', 'obligation', 'restriction', 'children_related', 'action_item', 'red_flag'
+    position = db.Column(db.Integer, nullable=False, default=0)  # Order within the kind, as the model listed them
+    text = db.Column(db.Text, nullable=False)
+    
+    # Dated findings are offered as deadlines
+    finding_date = db.Column(db.Date)
+    suggestion_status = db.Column(db.String(20))  # 'pending', 'accepted', 'dismissed'; None for undated findings
+    deadline_id = db.Column(db.Integer, db.ForeignKey('deadline.id', ondelete='SET NULL'))
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    document = relationship("Document", back_populates="findings")
+    deadline = relationship("Deadline")
+    
+    __table_args__ = (
+        db.Index('ix_document_finding_document', 'document_id', 'kind', 'position'),
+        db.Index('ix_document_finding_case_date', 'case_id', 'finding_date'),
+    )
+
+class RateLimitBucket(db.Model):
+    """Token bucket shared by every process when RATE_LIMIT_BACKEND is 'database'"""
+    key = db.Column(db.String(200), primary_key=True)  # e.g. 'global', 'client:203.0.113.7'
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False, index=True)  # Unix time of the last refill
+
+class CaseShard(db.Model):
+    """Catalog of per-case SQLite files (case-<id>.db) when CASE_SHARDING is 'sqlite'; its id is the case id"""
+    id = db.Column(db.Integer, primary_key=True)
+    case_title = db.Column(db.String(200))
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
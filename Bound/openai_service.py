@@ -2,16 +2,19 @@ import json
 import os
 from openai import OpenAI
 
-# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-# do not change this unless explicitly requested by the user
+from app import app
+from model_router import ModelRouter
+
+# Models are chosen per task by model_router.py: "gpt-4o" for the large tier, "gpt-4o-mini" for the small one
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
 openai = OpenAI(api_key=OPENAI_API_KEY)
+router = ModelRouter(openai, app.config)
 
-def analyze_legal_document(text, document_type=None):
+def analyze_legal_document(text, document_type=None, case_id=None):
     """Analyze a legal document and extract key information"""
     try:
         system_prompt = """You are a legal document analysis expert specializing in family law and child custody cases. 
@@ -22,7 +25,7 @@ def analyze_legal_document(text, document_type=None):
         {
             "summary": "Brief summary of the document",
             "key_points": ["List of important points"],
-            "important_dates": ["List of dates and deadlines mentioned"],
+            "important_dates": [{"date": "YYYY-MM-DD, or null if no exact date is given", "description": "What happens on or by this date"}],
             "obligations": ["List of obligations or requirements"],
             "restrictions": ["List of restrictions or limitations"],
             "children_related": ["Points specifically related to children"],
@@ -38,8 +41,8 @@ Document Type: {document_type or 'Unknown'}
 Document Content:
 {text}"""
 
-        response = openai.chat.completions.create(
-            model="gpt-4o",
+        response = router.complete(
+            'document_analysis', case_id,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
@@ -67,7 +70,7 @@ Document Content:
             "red_flags": []
         }
 
-def generate_case_summary(case_data):
+def generate_case_summary(case_data, case_id=None):
     """Generate a comprehensive case summary focusing on children's best interests"""
     try:
         system_prompt = """You are a family law case analysis expert. Generate a comprehensive case summary 
@@ -84,8 +87,8 @@ def generate_case_summary(case_data):
             "legal_considerations": ["Important legal points to consider"]
         }"""
         
-        response = openai.chat.completions.create(
-            model="gpt-4o",
+        response = router.complete(
+            'case_summary', case_id,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Analyze this family law case: {json.dumps(case_data)}"}
@@ -111,7 +114,7 @@ def generate_case_summary(case_data):
             "legal_considerations": []
         }
 
-def suggest_document_category(filename, content_preview):
+def suggest_document_category(filename, content_preview, case_id=None):
     """Suggest the most appropriate category for a document"""
     try:
         categories = [
@@ -127,8 +130,8 @@ def suggest_document_category(filename, content_preview):
         
         Respond with just the category name."""
         
-        response = openai.chat.completions.create(
-            model="gpt-4o",
+        response = router.complete(
+            'document_category', case_id,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=50
         )
@@ -142,7 +145,7 @@ def suggest_document_category(filename, content_preview):
     except Exception:
         return "other"
 
-def generate_preparation_checklist(case_type, hearing_type=None):
+def generate_preparation_checklist(case_type, hearing_type=None, case_id=None):
     """Generate a case preparation checklist"""
     try:
         system_prompt = """You are a family law preparation expert. Create a detailed preparation checklist 
@@ -166,8 +169,8 @@ def generate_preparation_checklist(case_type, hearing_type=None):
         Case Type: {case_type}
         Hearing Type: {hearing_type or 'General case preparation'}"""
         
-        response = openai.chat.completions.create(
-            model="gpt-4o",
+        response = router.complete(
+            'preparation_checklist', case_id,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
@@ -190,7 +193,7 @@ def generate_preparation_checklist(case_type, hearing_type=None):
             "common_mistakes": []
         }
 
-def analyze_incident_severity(incident_description, incident_type):
+def analyze_incident_severity(incident_description, incident_type, case_id=None):
     """Analyze the severity and implications of an incident"""
     try:
         system_prompt = """You are a family law incident analysis expert. Analyze incidents in custody cases 
@@ -209,8 +212,8 @@ def analyze_incident_severity(incident_description, incident_type):
         Type: {incident_type}
         Description: {incident_description}"""
         
-        response = openai.chat.completions.create(
-            model="gpt-4o",
+        response = router.complete(
+            'incident_severity', case_id,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
@@ -232,4 +235,54 @@ def analyze_incident_severity(incident_description, incident_type):
             "recommended_actions": [],
             "documentation_needs": [],
             "follow_up_suggestions": []
-        }
\ No newline at end of file
+        }
+
+
+def analyze_incidents_severity_batch(incidents, case_id=None):
+    """Assess the severity of several incidents in a single request
+    
+    Each incident is a dict with 'id', 'incident_type' and 'description'.
+    """
+    try:
+        system_prompt = """You are a family law incident analysis expert. Assess the severity of each 
+        incident in a custody case independently.
+        
+        Respond in JSON format with one entry per incident, using the incident ids provided:
+        {
+            "assessments": [
+                {
+                    "id": 123,
+                    "severity_assessment": "low/medium/high/critical",
+                    "legal_implications": "Potential legal implications"
+                }
+            ]
+        }"""
+        
+        user_prompt = "Assess these incidents:\n" + json.dumps([
+            {
+                "id": incident["id"],
+                "type": incident.get("incident_type"),
+                "description": (incident.get("description") or "")[:1500]
+            } for incident in incidents
+        ])
+        
+        response = router.complete(
+            'incident_severity_batch', case_id,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"}
+        )
+        
+        content = response.choices[0].message.content
+        if content:
+            return json.loads(content)
+        else:
+            raise ValueError("Empty response from OpenAI")
+            
+    except Exception as e:
+        return {
+            "error": f"Failed to analyze incidents: {str(e)}",
+            "assessments": []
+        }
@@ -0,0 +1,321 @@
+"""
+On-demand request profiling: stack sampling and tracemalloc allocation reports
+
+Profiling is armed either for one request, by sending an ``X-Profile: cpu``,
+``memory`` or ``cpu,memory`` header together with the admin token, or for a
+time window on one endpoint through the admin routes:
+
+    POST   /admin/profiler/windows              {"endpoint": "case_summary", "seconds": 300, "modes": ["cpu"]}
+    DELETE /admin/profiler/windows/<endpoint>
+    GET    /admin/profiler/profiles             captured profiles, newest first
+    GET    /admin/profiler/profiles/<id>/stacks collapsed stacks (flamegraph.pl, speedscope)
+    GET    /admin/profiler/profiles/<id>/allocations
+    GET    /admin/profiler/endpoints/<endpoint>/stacks   stacks merged across the endpoint's profiles
+
+Every admin route and the header need PROFILER_TOKEN, sent as
+``X-Profiler-Token``. Without PROFILER_TOKEN nothing is registered, so there
+is no cost at all. With it, an unprofiled request costs one dict lookup and
+one header lookup. The sampler thread runs only while a profiled request is
+in flight, and tracemalloc is traced only while a memory profile is.
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import Response, abort, g, jsonify, request
+
+MODES = ('cpu', 'memory')
+MAX_WINDOW_SECONDS = 3600
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+
+
+def frame_label(frame, root):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(root):
+        filename = os.path.relpath(filename, root)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, root):
+    """Root-to-leaf ``a;b;c`` stack in the collapsed format flame graph tools read"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame, root))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """One daemon thread sampling the stacks of registered threads, alive only while any are registered"""
+
+    def __init__(self, interval=0.005, root=None):
+        self.interval = interval
+        self.root = root or os.path.dirname(os.path.abspath(__file__))
+        self._targets = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._targets.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                targets = dict(self._targets)
+            frames = sys._current_frames()
+            for thread_id, samples in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[collapse_stack(frame, self.root)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class AllocationTracer:
+    """Reference-counted tracemalloc so overlapping memory profiles share one trace"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._started_here = False
+
+    def start(self):
+        with self._lock:
+            if self._users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_here = True
+            self._users += 1
+            tracemalloc.reset_peak()
+            return tracemalloc.take_snapshot()
+
+    def stop(self, before):
+        """Top allocation growth since ``before`` and the traced peak, in bytes
+
+        tracemalloc is process-wide, so allocations by concurrent requests are included.
+        """
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        with self._lock:
+            self._users -= 1
+            if self._users == 0 and self._started_here:
+                tracemalloc.stop()
+                self._started_here = False
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        differences = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'traceback')
+        allocations = []
+        for difference in differences[:TOP_ALLOCATIONS]:
+            if difference.size_diff <= 0:
+                break
+            allocations.append({
+                'size_diff': difference.size_diff,
+                'count_diff': difference.count_diff,
+                'size': difference.size,
+                'traceback': [f"{entry.filename}:{entry.lineno}" for entry in difference.traceback],
+            })
+        return allocations, peak
+
+
+class Profile:
+    def __init__(self, endpoint, path, modes):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.path = path
+        self.modes = modes
+        self.started_at = datetime.utcnow()
+        self.duration = None
+        self.status_code = None
+        self.samples = Counter()
+        self.allocations = []
+        self.peak_bytes = None
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'path': self.path,
+            'modes': list(self.modes),
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 1) if self.duration is not None else None,
+            'status_code': self.status_code,
+            'samples': sum(self.samples.values()),
+            'peak_bytes': self.peak_bytes,
+        }
+
+
+def collapsed_text(samples):
+    return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+class RequestProfiler:
+    """Arms profiling per request or per endpoint window and keeps the most recent profiles"""
+
+    def __init__(self, token, interval=0.005, max_profiles=50):
+        self.token = token
+        self.sampler = StackSampler(interval)
+        self.tracer = AllocationTracer()
+        self.windows = {}  # endpoint -> (expires at, modes)
+        self.profiles = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def authorized(self):
+        supplied = request.headers.get('X-Profiler-Token', '')
+        return bool(supplied) and hmac.compare_digest(supplied, self.token)
+
+    def arm(self, endpoint, seconds, modes):
+        with self._lock:
+            self.windows[endpoint] = (time.monotonic() + seconds, tuple(modes))
+
+    def disarm(self, endpoint):
+        with self._lock:
+            return self.windows.pop(endpoint, None) is not None
+
+    def active_windows(self):
+        now = time.monotonic()
+        with self._lock:
+            for endpoint in [endpoint for endpoint, (expires, _) in self.windows.items() if expires <= now]:
+                del self.windows[endpoint]
+            return {endpoint: {'seconds_left': round(expires - now), 'modes': list(modes)}
+                    for endpoint, (expires, modes) in self.windows.items()}
+
+    def _requested_modes(self):
+        window = self.windows.get(request.endpoint) if self.windows else None
+        if window is not None:
+            expires, modes = window
+            if expires > time.monotonic():
+                return modes
+            self.disarm(request.endpoint)
+        header = request.headers.get('X-Profile')
+        if header and self.authorized():
+            return tuple(mode for mode in MODES if mode in header.lower())
+        return ()
+
+    def before_request(self):
+        modes = self._requested_modes()
+        if not modes:
+            return
+        profile = Profile(request.endpoint, request.path, modes)
+        if 'memory' in modes:
+            g.request_profile_snapshot = self.tracer.start()
+        if 'cpu' in modes:
+            self.sampler.start(threading.get_ident())
+        g.request_profile_started = time.perf_counter()
+        g.request_profile = profile
+
+    def after_request(self, response):
+        profile = g.get('request_profile')
+        if profile is not None:
+            profile.status_code = response.status_code
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    def teardown_request(self, error=None):
+        profile = g.pop('request_profile', None)
+        if profile is None:
+            return
+        profile.duration = time.perf_counter() - g.pop('request_profile_started')
+        if 'cpu' in profile.modes:
+            profile.samples = self.sampler.stop(threading.get_ident())
+        if 'memory' in profile.modes:
+            profile.allocations, profile.peak_bytes = self.tracer.stop(g.pop('request_profile_snapshot'))
+        self.profiles.appendleft(profile)
+
+    def find(self, profile_id):
+        for profile in list(self.profiles):
+            if profile.id == profile_id:
+                return profile
+        abort(404)
+
+    def endpoint_samples(self, endpoint):
+        merged = Counter()
+        for profile in list(self.profiles):
+            if profile.endpoint == endpoint:
+                merged.update(profile.samples)
+        return merged
+
+
+def init_profiler(app):
+    """Register the profiling hooks and admin routes when PROFILER_TOKEN is set; returns the profiler"""
+    if not app.config['PROFILER_TOKEN']:
+        return None
+    profiler = RequestProfiler(app.config['PROFILER_TOKEN'], app.config['PROFILER_INTERVAL_MS'] / 1000,
+                               app.config['PROFILER_MAX_PROFILES'])
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+
+    def require_admin():
+        if not profiler.authorized():
+            abort(403)
+
+    @app.route('/admin/profiler/windows', methods=['GET', 'POST'])
+    def profiler_windows():
+        require_admin()
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            endpoint = data.get('endpoint')
+            if endpoint not in app.view_functions:
+                return jsonify({'error': f"Unknown endpoint: {endpoint}"}), 400
+            modes = [mode for mode in data.get('modes', ['cpu']) if mode in MODES]
+            if not modes:
+                return jsonify({'error': f"modes must include one of {', '.join(MODES)}"}), 400
+            try:
+                seconds = min(float(data.get('seconds', 300)), MAX_WINDOW_SECONDS)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'seconds must be a number'}), 400
+            profiler.arm(endpoint, seconds, modes)
+        return jsonify({'windows': profiler.active_windows()})
+
+    @app.route('/admin/profiler/windows/<endpoint>', methods=['DELETE'])
+    def profiler_window(endpoint):
+        require_admin()
+        if not profiler.disarm(endpoint):
+            abort(404)
+        return jsonify({'windows': profiler.active_windows()})
+
+    @app.route('/admin/profiler/profiles')
+    def profiler_profiles():
+        require_admin()
+        return jsonify({'profiles': [profile.summary() for profile in list(profiler.profiles)]})
+
+    @app.route('/admin/profiler/profiles/<profile_id>/stacks')
+    def profiler_stacks(profile_id):
+        require_admin()
+        return Response(collapsed_text(profiler.find(profile_id).samples), mimetype='text/plain')
+
+    @app.route('/admin/profiler/profiles/<profile_id>/allocations')
+    def profiler_allocations(profile_id):
+        require_admin()
+        profile = profiler.find(profile_id)
+        return jsonify(dict(profile.summary(), allocations=profile.allocations))
+
+    @app.route('/admin/profiler/endpoints/<endpoint>/stacks')
+    def profiler_endpoint_stacks(endpoint):
+        require_admin()
+        return Response(collapsed_text(profiler.endpoint_samples(endpoint)), mimetype='text/plain')
+
+    app.extensions['profiler'] = profiler
+    return profiler
@@ -0,0 +1,262 @@
+"""
+Token-bucket rate limits and admission control for AI-backed routes
+
+Each AI route costs tokens from two buckets: one per client (the logged-in
+user, else the client address, read from X-Forwarded-For only through the
+PROXY_FIX_X_FOR trusted proxies) and one global. A bucket of ``burst`` tokens
+refills at ``per_minute`` tokens a minute. A request that would have to wait
+at most RATE_LIMIT_MAX_WAIT seconds for tokens is queued (up to
+RATE_LIMIT_MAX_QUEUE waiting per process); anything else is shed with 429
+and a Retry-After header. AI_MAX_CONCURRENT optionally caps how many AI
+requests one process runs at once, so the rest of its workers or threads
+stay free for cheap pages.
+
+Buckets live in process memory ('memory', limits are per process) or in the
+rate_limit_bucket table ('database', shared by every process). Database
+updates are single conditional UPDATEs, so concurrent processes cannot both
+spend the last token. If the store fails, requests are let through.
+"""
+
+import math
+import threading
+import time
+
+from flask import g, jsonify, render_template, request, session as browser_session
+from sqlalchemy import case as sql_case, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from models import RateLimitBucket
+from sqlite_tuning import writer_slot
+
+# endpoint -> (token cost, methods it applies to)
+AI_ENDPOINTS = {
+    'case_summary': (1, ('GET',)),
+    'preparation_checklist': (1, ('GET',)),
+    'upload_document': (2, ('POST',)),  # Document analysis plus a possible category call
+    'add_incident': (1, ('POST',)),  # Embedding for related-item search
+}
+
+IDLE_BUCKET_SECONDS = 24 * 3600  # Database buckets untouched this long are deleted
+MAX_MEMORY_BUCKETS = 10000
+
+
+class Limit:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+
+    def refill(self, tokens, updated_at, now):
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+
+    def wait(self, tokens, cost):
+        """Seconds until ``tokens`` grows to ``cost``"""
+        return max(0.0, (cost - tokens) / self.rate) if self.rate > 0 else math.inf
+
+
+class MemoryBuckets:
+    """Buckets in this process only"""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, cost, now):
+        """Spend ``cost`` tokens if available; returns seconds to wait (0.0 when taken)"""
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.burst, now))
+            tokens = limit.refill(tokens, updated_at, now)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return limit.wait(tokens, cost)
+            self._buckets[key] = (tokens - cost, now)
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._buckets = {bucket: state for bucket, state in self._buckets.items()
+                                 if state[1] > now - IDLE_BUCKET_SECONDS}
+            return 0.0
+
+    def refund(self, key, limit, cost):
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated_at = self._buckets[key]
+                self._buckets[key] = (min(limit.burst, tokens + cost), updated_at)
+
+
+class DatabaseBuckets:
+    """Buckets in the rate_limit_bucket table, on connections separate from the request's session
+
+    On tuned SQLite each update takes the writer slot like a session write would.
+    """
+
+    def __init__(self, db, app):
+        self.db = db
+        self.app = app
+
+    def take(self, key, limit, cost, now):
+        table = RateLimitBucket.__table__
+        refilled = table.c.tokens + (now - table.c.updated_at) * limit.rate
+        refilled = sql_case((refilled > limit.burst, limit.burst), else_=refilled)
+        with writer_slot(self.app), self.db.engine.begin() as connection:
+            taken = connection.execute(update(table)
+                                       .where(table.c.key == key, refilled >= cost)
+                                       .values(tokens=refilled - cost, updated_at=now)).rowcount
+            if taken:
+                return 0.0
+            row = connection.execute(select(table.c.tokens, table.c.updated_at).where(table.c.key == key)).first()
+        if row is None:
+            return self._create(key, limit, cost, now)
+        return limit.wait(limit.refill(row.tokens, row.updated_at, now), cost)
+
+    def _create(self, key, limit, cost, now):
+        if cost > limit.burst:
+            return math.inf
+        try:
+            with writer_slot(self.app), self.db.engine.begin() as connection:
+                connection.execute(insert(RateLimitBucket.__table__),
+                                   {'key': key, 'tokens': limit.burst - cost, 'updated_at': now})
+                # New keys are rare enough (new clients) to pay for clearing out idle ones
+                connection.execute(delete(RateLimitBucket.__table__)
+                                   .where(RateLimitBucket.updated_at < now - IDLE_BUCKET_SECONDS))
+            return 0.0
+        except IntegrityError:
+            return self.take(key, limit, cost, now)  # Created by another process meanwhile
+
+    def refund(self, key, limit, cost):
+        table = RateLimitBucket.__table__
+        refunded = sql_case((table.c.tokens + cost > limit.burst, limit.burst), else_=table.c.tokens + cost)
+        with writer_slot(self.app), self.db.engine.begin() as connection:
+            connection.execute(update(table).where(table.c.key == key).values(tokens=refunded))
+
+
+class RateLimiter:
+    def __init__(self, store, client_limit, global_limit, max_wait=2.0, max_queue=4, max_concurrent=0):
+        self.store = store
+        self.client_limit = client_limit
+        self.global_limit = global_limit
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.queued = 0
+        self._lock = threading.Lock()
+        self.stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'store_errors': 0}
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def try_take(self, client_key, cost, now=None):
+        """Take ``cost`` from the client's bucket and the global one; returns seconds to wait (0.0 when taken)"""
+        now = now or time.time()
+        client_wait = self.store.take(client_key, self.client_limit, cost, now)
+        if client_wait:
+            return client_wait
+        global_wait = self.store.take('global', self.global_limit, cost, now)
+        if global_wait:
+            self.store.refund(client_key, self.client_limit, cost)  # Neither bucket is spent for a shed request
+        return global_wait
+
+    def _take(self, client_key, cost):
+        try:
+            return self.try_take(client_key, cost)
+        except SQLAlchemyError:
+            self.count('store_errors')
+            return 0.0  # Fail open: a broken limiter store must not take the routes down
+
+    def _refund(self, client_key, cost):
+        try:
+            self.store.refund(client_key, self.client_limit, cost)
+            self.store.refund('global', self.global_limit, cost)
+        except SQLAlchemyError:
+            self.count('store_errors')
+
+    def _join_queue(self):
+        with self._lock:
+            if self.queued >= self.max_queue:
+                return False
+            self.queued += 1
+            return True
+
+    def _leave_queue(self):
+        with self._lock:
+            self.queued -= 1
+
+    def admit(self, client_key, cost):
+        """0 if the request may run now (after queueing, if needed), else seconds the client should wait"""
+        wait = self._take(client_key, cost)
+        if wait:
+            if wait > self.max_wait or not self._join_queue():
+                self.count('shed')
+                return wait
+            self.count('queued')
+            try:
+                deadline = time.monotonic() + self.max_wait
+                while wait:
+                    if time.monotonic() + wait > deadline:
+                        self.count('shed')
+                        return wait
+                    time.sleep(wait)
+                    wait = self._take(client_key, cost)
+            finally:
+                self._leave_queue()
+        if self.slots is not None:
+            if not self.slots.acquire(timeout=self.max_wait):
+                self._refund(client_key, cost)
+                self.count('shed')
+                return 1.0
+            g.rate_limit_slot = True
+        self.count('admitted')
+        return 0
+
+    def release(self, error=None):
+        if g.pop('rate_limit_slot', None):
+            self.slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, waiting=self.queued)
+        return dict(stats, client_limit={'per_minute': self.client_limit.rate * 60, 'burst': self.client_limit.burst},
+                    global_limit={'per_minute': self.global_limit.rate * 60, 'burst': self.global_limit.burst})
+
+
+def client_key():
+    user = browser_session.get('user')
+    if isinstance(user, dict) and user.get('id'):
+        return f"user:{user['id']}"
+    return f"client:{request.remote_addr}"
+
+
+def too_many_requests(wait):
+    retry_after = max(1, math.ceil(min(wait, 3600)))
+    if request.accept_mimetypes.best == 'application/json' or request.is_json:
+        response = jsonify({'error': 'Too many AI requests; please try again shortly.', 'retry_after': retry_after})
+    else:
+        response = render_template('errors/429.html', retry_after=retry_after)
+    return response, 429, {'Retry-After': str(retry_after)}
+
+
+def init_rate_limits(app, db):
+    """Limit the AI routes as RATE_LIMIT_* configures; returns the limiter, or None when RATE_LIMIT_BACKEND is 'off'"""
+    backend = app.config['RATE_LIMIT_BACKEND']
+    if backend == 'off':
+        return None
+    if backend not in ('memory', 'database'):
+        raise ValueError(f"RATE_LIMIT_BACKEND must be 'memory', 'database' or 'off', not {backend!r}")
+    limiter = RateLimiter(
+        MemoryBuckets() if backend == 'memory' else DatabaseBuckets(db, app),
+        Limit(app.config['RATE_LIMIT_CLIENT_PER_MINUTE'], app.config['RATE_LIMIT_CLIENT_BURST']),
+        Limit(app.config['RATE_LIMIT_GLOBAL_PER_MINUTE'], app.config['RATE_LIMIT_GLOBAL_BURST']),
+        max_wait=app.config['RATE_LIMIT_MAX_WAIT'], max_queue=app.config['RATE_LIMIT_MAX_QUEUE'],
+        max_concurrent=app.config['AI_MAX_CONCURRENT'])
+
+    @app.before_request
+    def limit_ai_requests():
+        cost, methods = AI_ENDPOINTS.get(request.endpoint, (0, ()))
+        if not cost or request.method not in methods:
+            return None
+        wait = limiter.admit(client_key(), cost)
+        if wait:
+            return too_many_requests(wait)
+        return None
+
+    app.teardown_request(limiter.release)
+    app.extensions['rate_limiter'] = limiter
+    return limiter
@@ -0,0 +1,384 @@
+"""
+Deadline reminder scheduling and delivery
+
+Reminders are keyed by (case shard, deadline id): with CASE_SHARDING each
+case numbers its deadlines in its own shard, so the scheduler loads every
+shard through each_case_database() and sends from inside the reminder's
+shard. Without sharding the shard is None and everything is in the main
+database.
+"""
+
+import heapq
+import json
+import smtplib
+import threading
+import urllib.request
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from flask import g, has_app_context
+from sqlalchemy import event, insert, or_
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Deadline, DeadlineReminder
+
+# Rows changed this long before the last reload are read again, for writers whose commit landed after it
+RELOAD_OVERLAP = timedelta(minutes=5)
+
+
+def current_shard():
+    """The case shard statements are sent to (see case_shards.py), or None for the main database"""
+    return g.get('db_shard_case') if has_app_context() else None
+
+
+def case_database(case_id):
+    """Select a case's shard inside the block, or stay on the main database for None"""
+    if case_id is None:
+        return nullcontext()
+    from case_shards import shard_context  # case_shards imports this module (through case_archive)
+    return shard_context(case_id)
+
+
+def reminder_time(deadline):
+    """When the reminder for a deadline is due"""
+    return deadline.deadline_date - timedelta(days=deadline.reminder_days or 0)
+
+
+def reminder_message(deadline):
+    """Subject and body for a deadline reminder"""
+    subject = f"Reminder: {deadline.title} on {deadline.deadline_date.strftime('%m/%d/%Y at %I:%M %p')}"
+    lines = [subject, '']
+    if deadline.deadline_type:
+        lines.append(f"Type: {deadline.deadline_type.replace('_', ' ').title()}")
+    if deadline.location:
+        lines.append(f"Location: {deadline.location}")
+    if deadline.priority:
+        lines.append(f"Priority: {deadline.priority.title()}")
+    if deadline.description:
+        lines.extend(['', deadline.description])
+    return subject, '\n'.join(lines)
+
+
+class LogSink:
+    """Writes reminders to the application log"""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def send(self, deadline, subject, body):
+        self.logger.info(f"Deadline reminder for deadline {deadline.id}: {subject}")
+
+
+class SMTPSink:
+    """Sends reminders by email; defaults to a local SMTP stand-in on localhost:1025"""
+
+    def __init__(self, host='localhost', port=1025, sender='reminders@localhost', recipient=None, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipient = recipient
+        self.timeout = timeout
+
+    def send(self, deadline, subject, body):
+        if not self.recipient:
+            raise ValueError("No reminder recipient configured")
+        message = EmailMessage()
+        message['Subject'] = subject
+        message['From'] = self.sender
+        message['To'] = self.recipient
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+
+class WebhookSink:
+    """POSTs reminders as JSON to a webhook URL"""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, deadline, subject, body):
+        payload = json.dumps({
+            'deadline_id': deadline.id,
+            'case_id': deadline.case_id,
+            'title': deadline.title,
+            'deadline_date': deadline.deadline_date.isoformat(),
+            'subject': subject,
+            'text': body,
+        }).encode('utf-8')
+        request = urllib.request.Request(self.url, data=payload, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def build_sinks(app):
+    """Notification sinks named in REMINDER_SINKS"""
+    sinks = []
+    for name in app.config['REMINDER_SINKS']:
+        if name == 'log':
+            sinks.append(LogSink(app.logger))
+        elif name == 'smtp':
+            sinks.append(SMTPSink(app.config['REMINDER_SMTP_HOST'], app.config['REMINDER_SMTP_PORT'],
+                                  app.config['REMINDER_EMAIL_FROM'], app.config['REMINDER_EMAIL_TO']))
+        elif name == 'webhook':
+            sinks.append(WebhookSink(app.config['REMINDER_WEBHOOK_URL']))
+        else:
+            raise ValueError(f"Unknown reminder sink: {name}")
+    return sinks
+
+
+class ReminderScheduler:
+    """Min-heap of pending reminder times, kept in step with deadline changes
+
+    The heap is loaded from the pending rows of deadline_reminder in the
+    main database or each case shard (an indexed lookup, not a scan of all
+    deadlines). Deadlines changed in this
+    process are pushed as they commit; on every wake the scheduler also reads
+    pending rows that are new or changed since its last load, and every row of
+    a shard it has not loaded yet, so it hears of deadlines and cases created
+    by other processes (e.g. the web workers when it runs
+    as ``flask run-reminder-scheduler``). Stale heap entries are skipped
+    lazily. Sending is claimed in the database first, so several processes
+    can run schedulers without sending the same reminder twice.
+    """
+
+    def __init__(self, app, sinks, max_sleep=300):
+        self.app = app
+        self.sinks = sinks
+        self.max_sleep = max_sleep
+        self._heap = []
+        self._scheduled = {}  # (case shard, deadline_id) -> remind_at currently in the heap
+        self._last_id = {}  # case shard -> highest deadline_reminder id loaded
+        self._loaded_at = {}  # case shard -> when its rows were last read
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def load(self):
+        """Fill the heap from pending reminders in the database, or in every case shard"""
+        with self._condition:
+            self._heap, self._scheduled = [], {}
+            self._condition.notify()
+        self._last_id, self._loaded_at = {}, {}
+        return self.load_changes()
+
+    def load_changes(self):
+        """Push pending reminders added or changed since the last load, by any process; returns the count pushed"""
+        from case_shards import each_case_database  # case_shards imports this module (through case_archive)
+        pushed = 0
+        for case_id in each_case_database(self.app):
+            loaded_at = datetime.utcnow()
+            query = DeadlineReminder.query.filter(DeadlineReminder.status == 'pending')
+            if case_id in self._loaded_at:
+                query = query.filter(or_(DeadlineReminder.id > self._last_id[case_id],
+                                         DeadlineReminder.updated_at >= self._loaded_at[case_id] - RELOAD_OVERLAP))
+            rows = query.with_entities(DeadlineReminder.id, DeadlineReminder.deadline_id,
+                                       DeadlineReminder.remind_at).all()
+            for row_id, deadline_id, remind_at in rows:
+                with self._condition:
+                    known = self._scheduled.get((case_id, deadline_id)) == remind_at
+                if not known:
+                    self.push(case_id, deadline_id, remind_at)
+                    pushed += 1
+            self._last_id[case_id] = max([self._last_id.get(case_id, 0)] + [row_id for row_id, _, _ in rows])
+            self._loaded_at[case_id] = loaded_at
+        return pushed
+
+    def push(self, case_id, deadline_id, remind_at):
+        with self._condition:
+            self._scheduled[(case_id, deadline_id)] = remind_at
+            heapq.heappush(self._heap, (remind_at, (case_id, deadline_id)))
+            self._condition.notify()
+
+    def discard(self, case_id, deadline_id):
+        with self._condition:
+            self._scheduled.pop((case_id, deadline_id), None)
+
+    def next_due(self):
+        """Earliest pending reminder time, or None"""
+        with self._condition:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now):
+        due = []
+        with self._condition:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                remind_at, key = heapq.heappop(self._heap)
+                if self._scheduled.get(key) == remind_at:
+                    del self._scheduled[key]
+                    due.append(key)
+                self._drop_stale()
+        return due
+
+    def fire_due(self, now=None):
+        """Send every reminder that is due; returns the number sent"""
+        now = now or datetime.now()
+        sent = 0
+        from case_shards import ShardNotFound
+        for case_id, deadline_id in self._pop_due(now):
+            try:
+                with case_database(case_id):
+                    sent += self._send(deadline_id)
+            except ShardNotFound:
+                pass  # The case was deleted
+        return sent
+
+    def _send(self, deadline_id):
+        claimed = DeadlineReminder.query.filter_by(deadline_id=deadline_id, status='pending').update(
+            {'status': 'sending'}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return 0  # Completed, rescheduled or taken by another process
+
+        reminder = DeadlineReminder.query.filter_by(deadline_id=deadline_id).first()
+        deadline = db.session.get(Deadline, deadline_id)
+        if deadline is None or deadline.is_completed:
+            reminder.status = 'cancelled'
+            db.session.commit()
+            return 0
+
+        subject, body = reminder_message(deadline)
+        errors = []
+        for sink in self.sinks:
+            try:
+                sink.send(deadline, subject, body)
+            except Exception as e:
+                errors.append(f"{type(sink).__name__}: {str(e)}")
+                self.app.logger.error(f"Reminder delivery failed for deadline {deadline_id}: {str(e)}")
+        reminder.status = 'failed' if errors and len(errors) == len(self.sinks) else 'sent'
+        reminder.error = '; '.join(errors) or None
+        reminder.sent_at = datetime.utcnow()
+        db.session.commit()
+        return 1 if reminder.status == 'sent' else 0
+
+    def run_forever(self):
+        """Sleep until the next reminder is due (or the heap changes) and send it"""
+        with self.app.app_context():
+            self.load()
+        while not self._stopped:
+            next_due = self.next_due()
+            timeout = self.max_sleep
+            if next_due is not None:
+                timeout = min(max((next_due - datetime.now()).total_seconds(), 0), self.max_sleep)
+            if timeout > 0:
+                with self._condition:
+                    self._condition.wait(timeout)
+            with self.app.app_context():
+                try:
+                    self.load_changes()
+                    self.fire_due()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Reminder scheduler failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name='deadline-reminders', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """The scheduler running in this process, if any"""
+    return _scheduler
+
+
+def start_reminder_scheduler(app):
+    """Create and start the in-process scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ReminderScheduler(app, build_sinks(app))
+        _scheduler.start()
+    return _scheduler
+
+
+def _push_after_commit(entries):
+    # The heap only learns about reminders once their rows are visible to the sender
+    if _scheduler is not None:
+        db.session().info.setdefault('pending_reminders', []).extend(entries)
+
+
+@event.listens_for(Session, 'after_commit')
+def _push_committed_reminders(session):
+    entries = session.info.pop('pending_reminders', None)
+    if entries and _scheduler is not None:
+        for case_id, deadline_id, remind_at in entries:
+            _scheduler.push(case_id, deadline_id, remind_at)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_reminders(session):
+    session.info.pop('pending_reminders', None)
+
+
+def schedule_deadline(deadline):
+    """Create or move the reminder for a deadline; caller commits"""
+    reminder = DeadlineReminder.query.filter_by(deadline_id=deadline.id).first()
+    if deadline.is_completed or deadline.deadline_date is None or deadline.deadline_date <= datetime.now():
+        if reminder and reminder.status == 'pending':
+            reminder.status = 'cancelled'
+        return None
+    remind_at = reminder_time(deadline)
+    if reminder is None:
+        reminder = DeadlineReminder(deadline_id=deadline.id)
+        db.session.add(reminder)
+    reminder.remind_at = remind_at
+    reminder.status = 'pending'
+    reminder.sent_at = None
+    reminder.error = None
+    _push_after_commit([(current_shard(), deadline.id, remind_at)])
+    return reminder
+
+
+def schedule_deadlines(rows):
+    """Schedule many new deadlines at once from (deadline_id, values) pairs; caller commits"""
+    now = datetime.now()
+    reminders = []
+    for deadline_id, values in rows:
+        if values.get('is_completed') or values['deadline_date'] <= now:
+            continue
+        remind_at = values['deadline_date'] - timedelta(days=values.get('reminder_days') or 0)
+        reminders.append({'deadline_id': deadline_id, 'remind_at': remind_at, 'status': 'pending'})
+    if reminders:
+        db.session.execute(insert(DeadlineReminder.__table__), reminders)
+        case_id = current_shard()
+        _push_after_commit([(case_id, reminder['deadline_id'], reminder['remind_at']) for reminder in reminders])
+    return len(reminders)
+
+
+def cancel_deadline(deadline_id):
+    """Cancel the pending reminder for a deadline; caller commits"""
+    DeadlineReminder.query.filter_by(deadline_id=deadline_id, status='pending').update(
+        {'status': 'cancelled'}, synchronize_session=False)
+    if _scheduler is not None:
+        _scheduler.discard(current_shard(), deadline_id)
+
+
+def backfill_reminders():
+    """Create reminder rows for open deadlines that predate the scheduler; returns the count"""
+    scheduled = db.session.query(DeadlineReminder.deadline_id)
+    deadlines = Deadline.query.filter(Deadline.is_completed.isnot(True), Deadline.deadline_date > datetime.now(),
+                                      Deadline.id.not_in(scheduled)).all()
+    for deadline in deadlines:
+        schedule_deadline(deadline)
+    db.session.commit()
+    return len(deadlines)
@@ -1,35 +1,54 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_from_directory
-from datetime import datetime, date
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response, stream_with_context
+from datetime import datetime, date, timedelta
+import hashlib
 import json
 import os
+from sqlalchemy.orm import selectinload
 from app import app, db
-from models import Case, Child, Parent, Document, Incident, Deadline, CaseNote
+from models import Case, Child, Parent, Document, Incident, Deadline, CaseNote, DocumentFinding
 from document_processor import save_uploaded_file, extract_text_from_file, get_file_type, format_file_size
-from openai_service import analyze_legal_document, generate_case_summary, suggest_document_category, generate_preparation_checklist, analyze_incident_severity
+from openai_service import analyze_legal_document, generate_case_summary, suggest_document_category, router as model_router
+from model_router import tokens_used, usage_report
+from semantic_index import get_semantic_index, describe_items, incident_text, case_note_text
+from duplicate_detector import find_duplicates, record_signature, duplicate_report
+from binder_export import stream_case_binder
+from validation import safe_date_parse, safe_datetime_parse
+from bulk_import import import_records, detect_format, IMPORTERS
+from severity_queue import enqueue_incident, wake_worker, severity_audit
+from reminder_scheduler import schedule_deadline, cancel_deadline
+from ical_feed import feed_cache, feed_token, check_feed_token
+from drafts import DraftConflict, get_draft, patch_draft, discard_draft, serialize_draft
+from database_pool import read_replica, use_primary
+from incident_children import assign_children, child_incident_history
+from checklist_catalog import get_checklist, case_overlay, merge_overlay, normalize_hearing_type
+from document_analysis import store_analysis, findings_by_kind, suggested_deadlines, accept_suggestion
+from case_archive import close_case, reopen_case
+from search_index import FIRST_PAGE_ROWS, build_search_index, incident_search_text, note_search_text, event_search_text
 
-def safe_date_parse(date_string):
-    """Safely parse a date string, returning None if invalid or empty"""
-    if not date_string or date_string.strip() == '':
-        return None
+def update_semantic_index(item_type, item_id, text):
+    """Index an item for related-item search without failing the request"""
     try:
-        return datetime.strptime(date_string.strip(), '%Y-%m-%d').date()
-    except (ValueError, TypeError):
-        return None
-
-def safe_datetime_parse(datetime_string, format_string='%Y-%m-%dT%H:%M'):
-    """Safely parse a datetime string, returning None if invalid or empty"""
-    if not datetime_string or datetime_string.strip() == '':
-        return None
+        get_semantic_index(app).index_text(item_type, item_id, text)
+    except Exception as e:
+        app.logger.error(f"Semantic indexing failed for {item_type} {item_id}: {str(e)}")
+
+def find_related_items(items, k=5):
+    """Related items for each (item_type, item_id), or empty lists if the index is unavailable"""
     try:
-        return datetime.strptime(datetime_string.strip(), format_string)
-    except (ValueError, TypeError):
-        return None
+        return [describe_items(hits) for hits in get_semantic_index(app).related(items, k=k)]
+    except Exception as e:
+        app.logger.error(f"Related item lookup failed: {str(e)}")
+        return [[] for _ in items]
 
 @app.route('/')
+@read_replica
 def dashboard():
     """Main dashboard view"""
     # Get or create default case
     case = Case.query.first()
+    if not case:
+        with use_primary():
+            case = Case.query.first()  # The replica may not have it yet
     if not case:
         case = Case()
         case.case_title = "My Family Law Case"
@@ -53,7 +72,7 @@ def dashboard():
     
     return render_template('dashboard.html', case=case, stats=stats, 
                          recent_documents=recent_documents, upcoming_deadlines=upcoming_deadlines,
-                         recent_incidents=recent_incidents)
+                         recent_incidents=recent_incidents, suggested_deadlines=suggested_deadlines(case.id))
 
 @app.route('/children')
 def children_profiles():
@@ -63,7 +82,9 @@ def children_profiles():
         return redirect(url_for('dashboard'))
     
     children = Child.query.filter_by(case_id=case.id).all()
-    return render_template('children_profiles.html', case=case, children=children)
+    incident_history = child_incident_history(case.id)
+    return render_template('children_profiles.html', case=case, children=children,
+                         incident_history=incident_history)
 
 @app.route('/children/add', methods=['GET', 'POST'])
 def add_child():
@@ -214,6 +235,7 @@ def edit_parent(parent_id):
     return render_template('forms/parent_form.html', case=parent.case, parent=parent)
 
 @app.route('/documents')
+@read_replica
 def documents():
     """Document management"""
     case = Case.query.first()
@@ -226,7 +248,7 @@ def documents():
     if category_filter != 'all':
         query = query.filter_by(category=category_filter)
     
-    documents = query.order_by(Document.created_at.desc()).all()
+    documents = query.options(selectinload(Document.findings)).order_by(Document.created_at.desc()).all()
     
     # Get document categories for filter
     categories = db.session.query(Document.category).filter_by(case_id=case.id).distinct().all()
@@ -272,23 +294,22 @@ def upload_document():
     document.is_confidential = bool(request.form.get('is_confidential'))
     
     # Extract text and analyze with AI if it's a text-based document
+    text_content = None
     if document.file_type in ['pdf', 'doc', 'docx', 'txt']:
         try:
             text_content = extract_text_from_file(result['file_path'], document.file_type)
             if text_content and not text_content.startswith('Error'):
                 # AI analysis
-                analysis = analyze_legal_document(text_content, document.file_type)
+                analysis = analyze_legal_document(text_content, document.file_type, case_id=case.id)
                 
                 if 'error' not in analysis:
-                    document.ai_summary = analysis.get('summary', '')
-                    document.ai_key_points = json.dumps(analysis.get('key_points', []))
-                    document.ai_category_suggestion = analysis.get('suggested_category', 'other')
+                    store_analysis(document, analysis)
                     document.category = document.ai_category_suggestion
                 else:
                     # Fallback category suggestion
-                    document.category = suggest_document_category(result['original_filename'], text_content[:500])
+                    document.category = suggest_document_category(result['original_filename'], text_content[:500], case_id=case.id)
             else:
-                document.category = suggest_document_category(result['original_filename'], '')
+                document.category = suggest_document_category(result['original_filename'], '', case_id=case.id)
         except Exception as e:
             app.logger.error(f"Document analysis failed: {str(e)}")
             document.category = 'other'
@@ -296,9 +317,21 @@ def upload_document():
         document.category = 'other'  # For images, audio files, etc.
     
     db.session.add(document)
+    duplicates = []
+    if text_content and not text_content.startswith('Error'):
+        db.session.flush()
+        duplicates = find_duplicates(case.id, 'document', text_content, exclude_id=document.id)
+        record_signature(case.id, 'document', document.id, text_content)
     db.session.commit()
     
+    if text_content and not text_content.startswith('Error'):
+        update_semantic_index('document', document.id, text_content)
+    
     flash('Document uploaded and analyzed successfully!', 'success')
+    if duplicates:
+        original = db.session.get(Document, duplicates[0][0])
+        flash(f'This document looks like a possible duplicate of "{original.original_filename}" '
+              f'({int(duplicates[0][1] * 100)}% similar).', 'warning')
     return redirect(url_for('documents'))
 
 @app.route('/documents/<int:document_id>')
@@ -306,24 +339,15 @@ def view_document(document_id):
     """View document details"""
     document = Document.query.get_or_404(document_id)
     
-    # Parse AI analysis
-    key_points = []
-    if document.ai_key_points:
-        try:
-            key_points = json.loads(document.ai_key_points)
-        except:
-            pass
+    findings = findings_by_kind(document.findings)
     
-    return render_template('document_detail.html', document=document, key_points=key_points, format_file_size=format_file_size)
-
-@app.route('/timeline')
-def timeline():
-    """Case timeline view"""
-    case = Case.query.first()
-    if not case:
-        return redirect(url_for('dashboard'))
+    related_items = find_related_items([('document', document.id)])[0]
     
-    # Collect all timeline events
+    return render_template('document_detail.html', document=document, findings=findings,
+                         related_items=related_items, format_file_size=format_file_size)
+
+def collect_timeline_events(case):
+    """Collect incidents, deadlines and dated documents as timeline events"""
     events = []
     
     # Add incidents
@@ -363,10 +387,54 @@ def timeline():
             'id': doc.id
         })
     
+    # Add dates found in documents, unless already accepted as deadlines (listed above)
+    findings = db.session.query(DocumentFinding, Document.original_filename).join(Document).filter(
+        DocumentFinding.case_id == case.id, DocumentFinding.finding_date.isnot(None),
+        DocumentFinding.suggestion_status != 'accepted').all()
+    for finding, original_filename in findings:
+        events.append({
+            'date': datetime.combine(finding.finding_date, datetime.min.time()),
+            'type': 'document_date',
+            'title': finding.text,
+            'description': f"Found in {original_filename}",
+            'document_id': finding.document_id,
+            'id': finding.id
+        })
+    
     # Sort events by date
     events.sort(key=lambda x: x['date'], reverse=True)
+    return events
+
+@app.route('/timeline')
+@read_replica
+def timeline():
+    """Case timeline view"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    
+    events = collect_timeline_events(case)
+    search_index = build_search_index(event_search_text(event) for event in events)
     
-    return render_template('timeline.html', case=case, events=events)
+    return render_template('timeline.html', case=case, events=events, search_index=search_index,
+                           first_page=FIRST_PAGE_ROWS)
+
+@app.route('/export/binder')
+def export_binder():
+    """Stream a ZIP court binder of all documents plus index, timeline and profile PDFs"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    
+    documents = Document.query.filter_by(case_id=case.id).order_by(Document.document_date, Document.created_at).all()
+    children = Child.query.filter_by(case_id=case.id).all()
+    parents = Parent.query.filter_by(case_id=case.id).all()
+    events = collect_timeline_events(case)
+    
+    filename = f"binder_{case.id}_{datetime.now().strftime('%Y%m%d')}.zip"
+    return Response(stream_with_context(stream_case_binder(case, documents, events, children, parents)),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/incidents')
 def incidents():
@@ -375,8 +443,24 @@ def incidents():
     if not case:
         return redirect(url_for('dashboard'))
     
-    incidents = Incident.query.filter_by(case_id=case.id).order_by(Incident.incident_date.desc()).all()
-    return render_template('incidents.html', case=case, incidents=incidents)
+    incidents = Incident.query.filter_by(case_id=case.id).options(selectinload(Incident.children)).order_by(Incident.incident_date.desc()).all()
+    # Only the first page is rendered up front; later rows fetch theirs from incident_related as they are mounted
+    first_page = incidents[:FIRST_PAGE_ROWS]
+    related = find_related_items([('incident', incident.id) for incident in first_page], k=3)
+    related_items = {incident.id: items for incident, items in zip(first_page, related)}
+    search_index = build_search_index(incident_search_text(incident) for incident in incidents)
+    month_ago = datetime.now() - timedelta(days=30)
+    recent_incidents = sum(1 for incident in incidents if incident.incident_date > month_ago)
+    return render_template('incidents.html', case=case, incidents=incidents, related_items=related_items,
+                           search_index=search_index, recent_incidents=recent_incidents,
+                           first_page=FIRST_PAGE_ROWS)
+
+@app.route('/incidents/<int:incident_id>/related')
+@read_replica
+def incident_related(incident_id):
+    """Related items for one incident, as JSON"""
+    incident = Incident.query.get_or_404(incident_id)
+    return jsonify(find_related_items([('incident', incident.id)], k=3)[0])
 
 @app.route('/incidents/add', methods=['GET', 'POST'])
 def add_incident():
@@ -394,7 +478,6 @@ def add_incident():
         incident.title = request.form.get('title')
         incident.description = request.form.get('description')
         incident.location = request.form.get('location')
-        incident.children_involved = request.form.get('children_involved')
         incident.other_party_involved = bool(request.form.get('other_party_involved'))
         incident.witnesses = request.form.get('witnesses')
         incident.police_report = bool(request.form.get('police_report'))
@@ -405,26 +488,50 @@ def add_incident():
         incident.follow_up_needed = bool(request.form.get('follow_up_needed'))
         incident.follow_up_date = safe_date_parse(request.form.get('follow_up_date'))
         
-        # AI analysis of incident
-        try:
-            analysis = analyze_incident_severity(incident.description, incident.incident_type)
-            if 'error' not in analysis:
-                # Update severity if AI suggests different level
-                ai_severity = analysis.get('severity_assessment', incident.severity)
-                if ai_severity in ['low', 'medium', 'high', 'critical']:
-                    incident.severity = ai_severity
-        except Exception as e:
-            app.logger.error(f"Incident analysis failed: {str(e)}")
+        assign_children(incident, request.form.getlist('children_involved'))
         
         db.session.add(incident)
+        db.session.flush()
+        discard_draft(case.id, 'incident-new')
+        duplicates = find_duplicates(case.id, 'incident', incident.description, exclude_id=incident.id)
+        record_signature(case.id, 'incident', incident.id, incident.description)
+        # AI severity assessment runs in the background, batched with other incidents
+        enqueue_incident(incident)
         db.session.commit()
+        wake_worker()
+        update_semantic_index('incident', incident.id, incident_text(incident))
         flash('Incident logged successfully!', 'success')
+        if duplicates:
+            original = db.session.get(Incident, duplicates[0][0])
+            flash(f'This incident looks like a possible duplicate of "{original.title}" logged for '
+                  f'{original.incident_date.strftime("%m/%d/%Y")} ({int(duplicates[0][1] * 100)}% similar).', 'warning')
         return redirect(url_for('incidents'))
     
     # Get children for selection
     children = Child.query.filter_by(case_id=case.id).all()
     return render_template('forms/incident_form.html', case=case, incident=None, children=children)
 
+@app.route('/incidents/severity-audit')
+def incident_severity_audit():
+    """Compare user-entered severity with the AI assessment for each incident"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    
+    return jsonify(severity_audit(case.id))
+
+@app.route('/duplicates')
+def duplicates():
+    """Report groups of likely duplicate incidents and documents"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    
+    return jsonify({
+        'incidents': duplicate_report(case.id, 'incident'),
+        'documents': duplicate_report(case.id, 'document')
+    })
+
 @app.route('/deadlines')
 def deadlines():
     """Deadline management"""
@@ -432,13 +539,41 @@ def deadlines():
     if not case:
         return redirect(url_for('dashboard'))
     
-    # Get upcoming and overdue deadlines
+    # Get upcoming and overdue deadlines with one query, split at the current time
     now = datetime.now()
-    upcoming = Deadline.query.filter_by(case_id=case.id, is_completed=False).filter(Deadline.deadline_date >= now).order_by(Deadline.deadline_date).all()
-    overdue = Deadline.query.filter_by(case_id=case.id, is_completed=False).filter(Deadline.deadline_date < now).order_by(Deadline.deadline_date).all()
+    open_deadlines = Deadline.query.filter_by(case_id=case.id, is_completed=False).order_by(Deadline.deadline_date).all()
+    split = next((i for i, deadline in enumerate(open_deadlines) if deadline.deadline_date >= now), len(open_deadlines))
+    overdue, upcoming = open_deadlines[:split], open_deadlines[split:]
     completed = Deadline.query.filter_by(case_id=case.id, is_completed=True).order_by(Deadline.deadline_date.desc()).limit(10).all()
     
-    return render_template('deadlines.html', case=case, upcoming=upcoming, overdue=overdue, completed=completed)
+    calendar_url = url_for('deadline_calendar', case_id=case.id, token=feed_token(app.secret_key, case.id), _external=True)
+    
+    return render_template('deadlines.html', case=case, upcoming=upcoming, overdue=overdue, completed=completed,
+                         calendar_url=calendar_url, today=now.date())
+
+@app.route('/calendar/<int:case_id>/<token>/deadlines.ics')
+def deadline_calendar(case_id, token):
+    """Subscribable iCalendar feed of a case's deadlines"""
+    if not check_feed_token(app.secret_key, case_id, token):
+        return jsonify({'error': 'Calendar feed not found'}), 404
+    case = Case.query.get_or_404(case_id)
+    
+    # Answer revalidation from the version counter alone, before any rendering
+    etag, last_modified, version = feed_cache.validators(case.id)
+    response = Response(mimetype='text/calendar')
+    response.set_etag(etag)
+    response.last_modified = last_modified or case.created_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if request.if_none_match.contains_weak(etag) or (
+            not request.if_none_match and request.if_modified_since and response.last_modified
+            and response.last_modified <= request.if_modified_since):
+        response.status_code = 304
+        return response
+    
+    response.set_data(feed_cache.feed(case, version, last_modified))
+    response.headers['Content-Disposition'] = f'inline; filename="case-{case.id}-deadlines.ics"'
+    return response
 
 @app.route('/deadlines/add', methods=['POST'])
 def add_deadline():
@@ -457,6 +592,8 @@ def add_deadline():
     deadline.priority = request.form.get('priority', 'medium')
     
     db.session.add(deadline)
+    db.session.flush()
+    schedule_deadline(deadline)
     db.session.commit()
     flash('Deadline added successfully!', 'success')
     return redirect(url_for('deadlines'))
@@ -467,10 +604,59 @@ def complete_deadline(deadline_id):
     deadline = Deadline.query.get_or_404(deadline_id)
     deadline.is_completed = True
     deadline.completion_notes = request.form.get('completion_notes', '')
+    cancel_deadline(deadline.id)
     db.session.commit()
     flash('Deadline marked as completed!', 'success')
     return redirect(url_for('deadlines'))
 
+@app.route('/document-dates/<int:finding_id>/accept', methods=['POST'])
+def accept_document_date(finding_id):
+    """Turn a date found in a document into a deadline"""
+    finding = DocumentFinding.query.get_or_404(finding_id)
+    if finding.suggestion_status != 'pending' or finding.finding_date is None:
+        flash('This date has already been handled.', 'info')
+        return redirect(url_for('dashboard'))
+    
+    deadline = accept_suggestion(finding, title=request.form.get('title'),
+                                 deadline_type=request.form.get('deadline_type', 'other'))
+    schedule_deadline(deadline)
+    db.session.commit()
+    flash('Deadline added from document!', 'success')
+    return redirect(url_for('dashboard'))
+
+@app.route('/document-dates/<int:finding_id>/dismiss', methods=['POST'])
+def dismiss_document_date(finding_id):
+    """Stop suggesting a date found in a document as a deadline"""
+    finding = DocumentFinding.query.get_or_404(finding_id)
+    if finding.suggestion_status == 'pending':
+        finding.suggestion_status = 'dismissed'
+        db.session.commit()
+    return redirect(url_for('dashboard'))
+
+@app.route('/case/close', methods=['POST'])
+def close_current_case():
+    """Close the case; it is archived once it has stayed closed for ARCHIVE_AFTER_DAYS"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    if case.status == 'open':
+        close_case(case)
+        db.session.commit()
+        flash(f"Case closed. It will be archived after {app.config['ARCHIVE_AFTER_DAYS']} days.", 'success')
+    return redirect(url_for('dashboard'))
+
+@app.route('/case/reopen', methods=['POST'])
+def reopen_current_case():
+    """Reopen a closed case so it is no longer archived"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    if case.status != 'open':
+        reopen_case(app, case)
+        db.session.commit()
+        flash('Case reopened.', 'success')
+    return redirect(url_for('dashboard'))
+
 @app.route('/case-notes')
 def case_notes():
     """Case notes management"""
@@ -485,8 +671,10 @@ def case_notes():
         query = query.filter_by(note_type=note_type)
     
     notes = query.order_by(CaseNote.created_at.desc()).all()
+    search_index = build_search_index(note_search_text(note) for note in notes)
     
-    return render_template('case_notes.html', case=case, notes=notes, current_type=note_type)
+    return render_template('case_notes.html', case=case, notes=notes, current_type=note_type,
+                           search_index=search_index, first_page=FIRST_PAGE_ROWS)
 
 @app.route('/case-notes/add', methods=['POST'])
 def add_case_note():
@@ -505,10 +693,61 @@ def add_case_note():
     note.is_confidential = bool(request.form.get('is_confidential'))
     
     db.session.add(note)
+    discard_draft(case.id, 'case-note-new')
     db.session.commit()
+    update_semantic_index('case_note', note.id, case_note_text(note))
     flash('Case note added successfully!', 'success')
     return redirect(url_for('case_notes'))
 
+@app.route('/drafts/<form_key>', methods=['GET', 'PATCH', 'DELETE'])
+def form_draft(form_key):
+    """Autosaved form draft: GET it, PATCH changed fields against a base version, or DELETE it"""
+    case = Case.query.first()
+    if not case:
+        return jsonify({'error': 'No case found'}), 404
+    
+    try:
+        if request.method == 'GET':
+            draft = get_draft(case.id, form_key)
+            if draft is None:
+                return jsonify({'error': 'No draft saved'}), 404
+            return jsonify(serialize_draft(draft))
+        
+        if request.method == 'DELETE':
+            discard_draft(case.id, form_key)
+            db.session.commit()
+            return '', 204
+        
+        payload = request.get_json(silent=True) or {}
+        draft = patch_draft(case.id, form_key, payload.get('base_version'), payload.get('changes'),
+                            timedelta(days=app.config['DRAFT_TTL_DAYS']))
+        return jsonify({'version': draft.version, 'updated_at': draft.updated_at.isoformat()})
+    except DraftConflict as e:
+        return jsonify({'error': str(e), 'conflicts': e.fields, 'draft': serialize_draft(e.draft)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/import/<kind>', methods=['POST'])
+def bulk_import(kind):
+    """Bulk import incidents, deadlines or notes from a CSV or JSON Lines upload"""
+    case = Case.query.first()
+    if not case:
+        return jsonify({'error': 'No case found'}), 404
+    if kind not in IMPORTERS:
+        return jsonify({'error': f'Unknown import type: {kind}'}), 404
+    
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    file_format = request.form.get('format') or detect_format(file.filename)
+    if file_format not in ('csv', 'jsonl'):
+        return jsonify({'error': f'Unsupported import format: {file_format}'}), 400
+    
+    result = import_records(kind, file.stream, file_format, case.id,
+                            analyze_severity=bool(request.form.get('analyze_severity')))
+    return jsonify(result), 200 if result['imported'] or not result['failed'] else 400
+
 @app.route('/case-summary')
 def case_summary():
     """Generate AI-powered case summary"""
@@ -551,7 +790,7 @@ def case_summary():
     }
     
     # Generate AI summary
-    summary = generate_case_summary(case_data)
+    summary = generate_case_summary(case_data, case_id=case.id)
     
     return render_template('case_summary.html', case=case, summary=summary)
 
@@ -562,10 +801,53 @@ def preparation_checklist():
     if not case:
         return redirect(url_for('dashboard'))
     
-    hearing_type = request.args.get('hearing_type', 'general')
-    checklist = generate_preparation_checklist(case.case_type, hearing_type)
+    hearing_type = normalize_hearing_type(request.args.get('hearing_type', 'general'))
+    # Shared catalog checklist plus a category built from this case's records
+    checklist = get_checklist(case.case_type, hearing_type, timedelta(days=app.config['CHECKLIST_MAX_AGE_DAYS']))
+    checklist = merge_overlay(checklist, case_overlay(case, hearing_type))
+    checklist_digest = hashlib.sha1(json.dumps(checklist, sort_keys=True).encode('utf-8')).hexdigest()
     
-    return render_template('preparation_checklist.html', case=case, checklist=checklist)
+    return render_template('preparation_checklist.html', case=case, checklist=checklist,
+                         hearing_type=hearing_type, checklist_digest=checklist_digest)
+
+@app.route('/ai/usage')
+def ai_usage():
+    """This month's AI token use for the case, its budget and the model router's state"""
+    case = Case.query.first()
+    if not case:
+        return redirect(url_for('dashboard'))
+    used, budget, status = model_router.budget_status(case.id)
+    return jsonify({'tokens_used': used if used is not None else tokens_used(case.id), 'budget': budget,
+                    'budget_status': status, 'usage': usage_report(case.id), 'router': model_router.snapshot()})
+
+@app.route('/cache/stats')
+def fragment_cache_stats():
+    """Fragment cache hit rates and the render time they saved"""
+    fragment_cache = app.jinja_env.fragment_cache
+    if fragment_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(fragment_cache.stats(), enabled=True))
+
+@app.route('/metrics/db-pool')
+def database_pool_metrics():
+    """Connection pool saturation per engine and read-replica routing counters"""
+    return jsonify(app.extensions['db_router'].snapshot())
+
+@app.route('/metrics/rate-limits')
+def rate_limit_metrics():
+    """Admitted, queued and shed AI requests and the configured limits"""
+    limiter = app.extensions.get('rate_limiter')
+    if limiter is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(limiter.snapshot(), enabled=True))
+
+@app.route('/metrics/case-shards')
+def case_shard_metrics():
+    """Open shard engines, LRU hits and evictions, and shard migrations"""
+    shards = app.extensions.get('case_shards')
+    if shards is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(shards.snapshot(), enabled=True))
 
 # File serving route for uploaded documents
 @app.route('/uploads/<filename>')
@@ -0,0 +1,66 @@
+"""
+Additive schema upgrades for databases created before a column or index existed
+
+db.create_all() only creates missing tables, so columns and indexes added to
+existing models are applied here on startup. Only additive, nullable changes
+are supported; each new column can name a backfill statement. Data backfills
+copy denormalized values into tables that replaced them; they are idempotent
+and run on every startup.
+"""
+
+from sqlalchemy import inspect, text
+
+from app import db
+from document_analysis import backfill_document_findings
+from incident_children import backfill_incident_children
+
+# (table, column) -> SQL run once after the column is added
+BACKFILLS = {
+    ('case', 'updated_at'): 'UPDATE "case" SET updated_at = created_at WHERE updated_at IS NULL',
+    ('case', 'status'): 'UPDATE "case" SET status = \'open\' WHERE status IS NULL',
+    ('document', 'updated_at'): 'UPDATE document SET updated_at = created_at WHERE updated_at IS NULL',
+    ('deadline', 'updated_at'): 'UPDATE deadline SET updated_at = created_at WHERE updated_at IS NULL',
+    ('deadline_reminder', 'updated_at'): 'UPDATE deadline_reminder SET updated_at = created_at WHERE updated_at IS NULL',
+}
+
+# (description, function(connection) -> rows written)
+DATA_BACKFILLS = [
+    ('incident_child links from incident.children_involved', backfill_incident_children),
+    ('document_finding key points from document.ai_key_points', backfill_document_findings),
+]
+
+
+def upgrade_schema(engine=None):
+    """Add missing columns and indexes to existing tables; returns a list of the changes made"""
+    engine = engine or db.engine
+    changes = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        preparer = connection.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} "
+                                        f"ADD COLUMN {preparer.format_column(column)} {column_type}"))
+                backfill = BACKFILLS.get((table.name, column.name))
+                if backfill:
+                    connection.execute(text(backfill))
+                changes.append(f"added column {table.name}.{column.name}")
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    changes.append(f"created index {index.name}")
+
+        for description, backfill in DATA_BACKFILLS:
+            count = backfill(connection)
+            if count:
+                changes.append(f"backfilled {count} {description}")
+    return changes
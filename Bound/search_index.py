@@ -0,0 +1,56 @@
+"""
+In-page search indexes for the long list pages (incidents, case notes, timeline)
+
+Each list page ships an inverted index of its rows as JSON beside the rows
+themselves. static/js/app.js searches it as the user types instead of
+scanning the text of every row: query words are matched as prefixes of the
+index's sorted tokens and the postings are intersected, so a keystroke
+costs a few binary searches however long the list is.
+
+Tokens are the lowercased runs of TOKEN_PATTERN, the same tokenization
+semantic_index uses; app.js splits queries with the same pattern.
+
+The pages render their first FIRST_PAGE_ROWS rows as ordinary markup, so
+they read (and print) without JavaScript, and only the rest go in the
+<template> that VirtualList mounts from as the user scrolls.
+"""
+
+from semantic_index import TOKEN_PATTERN
+
+FIRST_PAGE_ROWS = 20
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+def build_search_index(texts):
+    """Inverted index over row texts: sorted tokens and, for each, the positions of the rows containing it"""
+    postings = {}
+    size = 0
+    for row, text in enumerate(texts):
+        size += 1
+        for token in set(tokenize(text)):
+            postings.setdefault(token, []).append(row)
+    tokens = sorted(postings)
+    return {'size': size, 'tokens': tokens, 'postings': [postings[token] for token in tokens]}
+
+
+def _joined(*parts):
+    return ' '.join(part for part in parts if part)
+
+
+def incident_search_text(incident):
+    children = ' '.join(f"{child.first_name} {child.last_name}" for child in incident.children)
+    return _joined(incident.title, incident.description, incident.incident_type, incident.severity,
+                   incident.location, incident.witnesses, incident.action_taken,
+                   incident.documentation_notes, incident.police_report_number, children)
+
+
+def note_search_text(note):
+    return _joined(note.title, note.content, note.note_type, note.tags)
+
+
+def event_search_text(event):
+    return _joined(event['title'], event['description'], event['type'],
+                   event.get('severity'), event.get('priority'), event.get('category'))
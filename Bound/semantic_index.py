@@ -0,0 +1,408 @@
+"""
+Semantic similarity index over document chunks, incidents and case notes
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from flask import g, has_app_context
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: writers are serialized within a process only
+    fcntl = None
+
+DEFAULT_CHUNK_SIZE = 800
+DEFAULT_CHUNK_OVERLAP = 100
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def chunk_text(text, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_CHUNK_OVERLAP):
+    """Split text into overlapping chunks, preferring whitespace boundaries"""
+    text = (text or '').strip()
+    if not text:
+        return []
+    if len(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            boundary = text.rfind(' ', start + chunk_size // 2, end)
+            if boundary != -1:
+                end = boundary
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+
+class EmbeddingProvider:
+    """Base class for embedding providers"""
+    name = 'base'
+    dimension = 0
+
+    def embed(self, texts):
+        """Return a float32 array of shape (len(texts), dimension)"""
+        raise NotImplementedError
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Local deterministic provider using feature hashing of words and word pairs"""
+    name = 'hashing'
+
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        sign = 1.0 if value & 1 else -1.0
+        return (value >> 1) % self.dimension, sign
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall((text or '').lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                bucket, sign = self._bucket(feature)
+                vectors[row, bucket] += sign
+        return normalize_rows(vectors)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embedding provider backed by the OpenAI embeddings endpoint"""
+    name = 'openai'
+
+    def __init__(self, model='text-embedding-3-small', dimension=1536, batch_size=64):
+        self.model = model
+        self.dimension = dimension
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        from openai_service import openai
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [text or ' ' for text in texts[start:start + self.batch_size]]
+            response = openai.embeddings.create(model=self.model, input=batch)
+            vectors.extend(item.embedding for item in response.data)
+        return normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimension))
+
+
+EMBEDDING_PROVIDERS = {
+    'hashing': HashingEmbeddingProvider,
+    'openai': OpenAIEmbeddingProvider,
+}
+
+
+def get_embedding_provider(name=None):
+    """Build the embedding provider named by EMBEDDING_PROVIDER (defaults to openai)"""
+    name = name or os.environ.get('EMBEDDING_PROVIDER', 'openai')
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name}")
+    return EMBEDDING_PROVIDERS[name]()
+
+
+def normalize_rows(vectors):
+    """L2-normalize each row so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorStore:
+    """Append-only vector matrix in a memory-mapped file with tombstone deletes
+
+    Row keys and the deletion state live in a JSON sidecar next to the matrix.
+    Deleted rows are zeroed so they never score above live rows, and the file
+    is compacted once tombstones outnumber live rows. Worker processes share
+    the files, so writers hold an flock on a lock file beside them while they
+    reload, append and save the sidecar.
+    """
+
+    def __init__(self, path, dimension, initial_capacity=1024):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.lock_path = path + '.lock'
+        self.dimension = dimension
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._meta_mtime = None
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._locked():
+            self._load()
+
+    @contextmanager
+    def _locked(self, shared=False):
+        """This process's lock plus an flock on lock_path, exclusive for writers and shared for readers
+
+        Not to be nested: a second flock from this process would wait on the first.
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a+') as handle:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        if os.path.exists(self.meta_path) and os.path.exists(self.path):
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            if meta.get('dimension') != self.dimension:
+                raise ValueError(f"Index at {self.path} has dimension {meta.get('dimension')}, expected {self.dimension}")
+            self.capacity = meta['capacity']
+            self.keys = [tuple(key) if key else None for key in meta['keys']]
+            self.vectors = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(self.capacity, self.dimension))
+            self._meta_mtime = os.path.getmtime(self.meta_path)
+        else:
+            self.capacity = self.initial_capacity
+            self.keys = []
+            self.vectors = np.memmap(self.path, dtype=np.float32, mode='w+', shape=(self.capacity, self.dimension))
+            self._save_meta()
+        self._rebuild_positions()
+
+    def _rebuild_positions(self):
+        self.positions = {}
+        for row, key in enumerate(self.keys):
+            if key is not None:
+                self.positions.setdefault(key[:2], []).append(row)
+
+    def _refresh(self):
+        """Reload if another worker process rewrote the index"""
+        if os.path.exists(self.meta_path) and os.path.getmtime(self.meta_path) != self._meta_mtime:
+            self._load()
+
+    def _save_meta(self):
+        self.vectors.flush()
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as meta_file:
+            json.dump({'dimension': self.dimension, 'capacity': self.capacity,
+                       'keys': [list(key) if key else None for key in self.keys]}, meta_file)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = os.path.getmtime(self.meta_path)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.vectors.flush()
+        del self.vectors
+        with open(self.path, 'r+b') as matrix_file:
+            matrix_file.truncate(capacity * self.dimension * 4)
+        self.capacity = capacity
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(self.capacity, self.dimension))
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.positions.values())
+
+    def add(self, item_type, item_id, vectors):
+        """Replace the vectors stored for one item"""
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension))
+        with self._locked():
+            self._refresh()
+            self._delete_rows(item_type, item_id)
+            start = len(self.keys)
+            if start + len(vectors) > self.capacity:
+                self._grow(start + len(vectors))
+            self.vectors[start:start + len(vectors)] = vectors
+            for chunk in range(len(vectors)):
+                self.keys.append((item_type, item_id, chunk))
+            self.positions[(item_type, item_id)] = list(range(start, start + len(vectors)))
+            self._maybe_compact()
+            self._save_meta()
+
+    def delete(self, item_type, item_id):
+        """Remove all vectors stored for one item"""
+        with self._locked():
+            self._refresh()
+            if self._delete_rows(item_type, item_id):
+                self._maybe_compact()
+                self._save_meta()
+
+    def _delete_rows(self, item_type, item_id):
+        rows = self.positions.pop((item_type, item_id), [])
+        for row in rows:
+            self.keys[row] = None
+            self.vectors[row] = 0.0
+        return bool(rows)
+
+    def _maybe_compact(self):
+        live = [row for row, key in enumerate(self.keys) if key is not None]
+        if len(self.keys) - len(live) <= max(len(live), 64):
+            return
+        if live:
+            self.vectors[:len(live)] = np.asarray(self.vectors[live])
+        self.vectors[len(live):len(self.keys)] = 0.0
+        self.keys = [self.keys[row] for row in live]
+        self._rebuild_positions()
+
+    def item_vector(self, item_type, item_id):
+        """Mean of an item's chunk vectors, or None if the item is not indexed"""
+        return self.item_vectors([(item_type, item_id)])[0]
+
+    def item_vectors(self, items):
+        """item_vector for each (item_type, item_id), under one lock"""
+        with self._locked(shared=True):
+            self._refresh()
+            vectors = []
+            for item in items:
+                rows = self.positions.get(tuple(item))
+                vectors.append(normalize_rows(np.asarray(self.vectors[rows]).mean(axis=0, keepdims=True))[0]
+                               if rows else None)
+            return vectors
+
+    def query(self, queries, k=5, exclude=None):
+        """Batched top-k search returning, per query, [(item_type, item_id, score)]
+
+        Chunks are collapsed to their best-scoring item. ``exclude`` is an
+        optional list (one entry per query) of (item_type, item_id) to skip.
+        """
+        queries = normalize_rows(np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension))
+        with self._locked(shared=True):
+            self._refresh()
+            count = len(self.keys)
+            if count == 0:
+                return [[] for _ in range(len(queries))]
+            scores = queries @ np.asarray(self.vectors[:count]).T
+            keys = list(self.keys)
+
+        # Over-fetch so that several chunks of the same item do not crowd out others
+        fetch = min(count, max(k * 4, k + 8))
+        results = []
+        for row_index, row_scores in enumerate(scores):
+            skip = exclude[row_index] if exclude else None
+            candidates = np.argpartition(-row_scores, fetch - 1)[:fetch]
+            candidates = candidates[np.argsort(-row_scores[candidates])]
+            seen = set()
+            hits = []
+            for row in candidates:
+                key = keys[row]
+                if key is None or key[:2] == skip or key[:2] in seen:
+                    continue
+                seen.add(key[:2])
+                hits.append((key[0], key[1], float(row_scores[row])))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+
+class SemanticIndex:
+    """Embeds case items and answers related-item queries"""
+
+    def __init__(self, folder, provider=None):
+        self.provider = provider or get_embedding_provider()
+        self.store = VectorStore(os.path.join(folder, f"{self.provider.name}.vec"), self.provider.dimension)
+
+    def index_text(self, item_type, item_id, text):
+        """Chunk, embed and store text for an item, replacing any previous entry"""
+        chunks = chunk_text(text)
+        if not chunks:
+            self.store.delete(item_type, item_id)
+            return 0
+        self.store.add(item_type, item_id, self.provider.embed(chunks))
+        return len(chunks)
+
+    def remove(self, item_type, item_id):
+        """Drop an item from the index"""
+        self.store.delete(item_type, item_id)
+
+    def related(self, items, k=5, min_score=0.2):
+        """Top-k related items for each (item_type, item_id), in one batched query"""
+        queries, positions = [], []
+        for position, vector in enumerate(self.store.item_vectors(items)):
+            if vector is not None:
+                queries.append(vector)
+                positions.append(position)
+
+        results = [[] for _ in items]
+        if not queries:
+            return results
+        hits = self.store.query(np.vstack(queries), k=k, exclude=[items[p] for p in positions])
+        for position, item_hits in zip(positions, hits):
+            results[position] = [hit for hit in item_hits if hit[2] >= min_score]
+        return results
+
+    def search(self, text, k=10):
+        """Top-k items similar to free text"""
+        return self.store.query(self.provider.embed([text]), k=k)[0]
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_semantic_index(app):
+    """Return the process-wide index, creating it on first use
+
+    Item ids are only unique within a database, so with CASE_SHARDING each
+    case shard gets its own index in a case-<id> subfolder.
+    """
+    folder = app.config['SEMANTIC_INDEX_FOLDER']
+    case_id = g.get('db_shard_case') if has_app_context() else None
+    if case_id is not None:
+        folder = os.path.join(folder, f"case-{case_id}")
+    index = _indexes.get(folder)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(folder)
+            if index is None:
+                index = _indexes[folder] = SemanticIndex(folder, get_embedding_provider(app.config.get('EMBEDDING_PROVIDER')))
+    return index
+
+
+def incident_text(incident):
+    """Text used to embed an incident"""
+    return "\n".join(part for part in [incident.title, incident.incident_type, incident.description,
+                                       incident.action_taken] if part)
+
+
+def case_note_text(note):
+    """Text used to embed a case note"""
+    return "\n".join(part for part in [note.title, note.tags, note.content] if part)
+
+
+def describe_items(hits):
+    """Resolve (item_type, item_id, score) hits into display dicts for templates"""
+    from flask import url_for
+    from models import Document, Incident, CaseNote
+
+    loaders = {'document': Document, 'incident': Incident, 'case_note': CaseNote}
+    ids = {}
+    for item_type, item_id, _ in hits:
+        ids.setdefault(item_type, set()).add(item_id)
+    rows = {}
+    for item_type, item_ids in ids.items():
+        model = loaders[item_type]
+        for row in model.query.filter(model.id.in_(item_ids)).all():
+            rows[(item_type, row.id)] = row
+
+    described = []
+    for item_type, item_id, score in hits:
+        row = rows.get((item_type, item_id))
+        if row is None:
+            continue
+        if item_type == 'document':
+            title, url = row.original_filename, url_for('view_document', document_id=row.id)
+        elif item_type == 'incident':
+            title, url = row.title, url_for('incidents') + f"#incident-{row.id}"
+        else:
+            title, url = row.title, url_for('case_notes') + f"#note-{row.id}"
+        described.append({'type': item_type, 'id': item_id, 'title': title, 'url': url, 'score': score})
+    return described
@@ -0,0 +1,211 @@
+"""
+Serving modes and a load test comparing them
+
+The AI-backed routes (case_summary, preparation_checklist, upload_document,
+add_incident) spend almost all their time waiting on OpenAI. With gunicorn's
+default sync workers each of those waits occupies a whole process, so
+concurrency costs one worker, and its memory, per in-flight call.
+
+SERVING_MODE=async runs gthread workers instead: GUNICORN_THREADS requests
+per process share one copy of the app, and a thread waiting on the network
+releases the GIL. Database connections are released before each model call
+(see database_pool.release_connection), so the threads do not also queue on
+the connection pool. SERVING_MODE=sync (the default) leaves gunicorn's
+settings unchanged.
+
+``flask benchmark-serving`` starts each mode against a local stub of the
+OpenAI API with a fixed latency and reports throughput, latency percentiles
+and memory under the same load.
+"""
+
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+SERVING_MODES = ('sync', 'async')
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def gunicorn_settings(environ=os.environ):
+    """Settings for gunicorn.conf.py from SERVING_MODE, WEB_CONCURRENCY and GUNICORN_THREADS"""
+    mode = environ.get('SERVING_MODE', 'sync')
+    if mode not in SERVING_MODES:
+        raise ValueError(f"SERVING_MODE must be one of {', '.join(SERVING_MODES)}, not {mode!r}")
+    if mode == 'sync':
+        return {}
+    return {
+        'worker_class': 'gthread',
+        'workers': int(environ.get('WEB_CONCURRENCY', '2')),
+        'threads': int(environ.get('GUNICORN_THREADS', '32')),
+        # gthread heartbeats independently of requests, so a slow model call does not get the worker killed
+        'timeout': int(environ.get('GUNICORN_TIMEOUT', '120')),
+        'keepalive': 5,
+    }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        time.sleep(self.server.latency)
+        content = json.dumps({'summary': 'Stub response', 'executive_summary': 'Stub response',
+                              'key_points': [], 'preparation_items': []})
+        payload = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': 150},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubUpstream:
+    """Chat completions endpoint that answers every request after ``latency`` seconds"""
+
+    def __init__(self, latency):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, name='stub-upstream', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_load(url, concurrency, seconds):
+    """GET ``url`` from ``concurrency`` keep-alive clients for ``seconds``; throughput and latency percentiles"""
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else '')
+    deadline = time.monotonic() + seconds
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000) if latencies else None
+
+    return {'requests': len(latencies), 'errors': errors[0],
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': percentile(0.5), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99)}
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        parts = urlsplit(url)
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+            connection.request('GET', parts.path or '/')
+            status = connection.getresponse().status
+            connection.close()
+            if status < 500:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and its children (Linux /proc), or None elsewhere"""
+    if not os.path.isdir('/proc'):
+        return None
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stream:
+                    parents[int(entry)] = int(stream.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [child for child, ppid in parents.items() if ppid == parent and child not in tree]
+        tree.update(children)
+        frontier.extend(children)
+    total = 0
+    for member in tree:
+        try:
+            with open(f'/proc/{member}/statm') as stream:
+                total += int(stream.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def benchmark_mode(mode, path, workers, threads, concurrency, seconds, upstream_url, database_url):
+    """Start gunicorn in one serving mode, load ``path`` and stop it; returns the load results"""
+    port = _free_port()
+    env = dict(os.environ, SERVING_MODE=mode, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               OPENAI_BASE_URL=upstream_url, OPENAI_API_KEY='benchmark', DATABASE_URL=database_url,
+               SEVERITY_WORKER='off', REMINDER_SCHEDULER='off', DRAFT_CLEANUP='off', CHECKLIST_REFRESH='off')
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+               '--log-level', 'warning', 'main:app']  # Sync workers are sized by WEB_CONCURRENCY too
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        _wait_until_up(base + '/')  # The dashboard also creates the case the AI routes need
+        _wait_until_up(base + path)
+        result = run_load(base + path, concurrency, seconds)
+        result['rss_bytes'] = process_tree_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return dict(result, mode=mode, workers=workers, threads=threads if mode == 'async' else 1)
@@ -0,0 +1,160 @@
+"""
+Queue of incidents awaiting AI severity assessment, processed in batches
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import db
+from models import Incident, SeverityAssessment
+from openai_service import analyze_incidents_severity_batch
+from case_shards import each_case_database
+
+SEVERITIES = ['low', 'medium', 'high', 'critical']
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 3
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_incident(incident):
+    """Queue an incident for assessment, keeping the user's severity for the audit; caller commits"""
+    db.session.add(SeverityAssessment(incident_id=incident.id, user_severity=incident.severity, status='pending'))
+
+
+def enqueue_incidents(rows):
+    """Queue many incidents at once from (incident_id, user_severity) pairs; caller commits"""
+    if rows:
+        db.session.execute(insert(SeverityAssessment.__table__), [
+            {'incident_id': incident_id, 'user_severity': severity, 'status': 'pending', 'attempts': 0}
+            for incident_id, severity in rows
+        ])
+
+
+def _claim_batch(batch_size):
+    """Atomically mark up to batch_size pending assessments as ours so other workers skip them"""
+    stale = datetime.utcnow() - CLAIM_TIMEOUT
+    SeverityAssessment.query.filter(SeverityAssessment.status == 'processing',
+                                    SeverityAssessment.claimed_at < stale).update(
+        {'status': 'pending', 'claim_token': None}, synchronize_session=False)
+
+    ids = [row.id for row in SeverityAssessment.query.filter_by(status='pending')
+           .order_by(SeverityAssessment.id).limit(batch_size).with_entities(SeverityAssessment.id)]
+    if not ids:
+        db.session.commit()
+        return []
+    token = uuid.uuid4().hex
+    SeverityAssessment.query.filter(SeverityAssessment.id.in_(ids), SeverityAssessment.status == 'pending').update(
+        {'status': 'processing', 'claim_token': token, 'claimed_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return SeverityAssessment.query.filter_by(claim_token=token).all()
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """Assess one batch of queued incidents with a single model request; returns the number processed"""
+    claimed = _claim_batch(batch_size)
+    if not claimed:
+        return 0
+
+    incidents = {incident.id: incident for incident in
+                 Incident.query.filter(Incident.id.in_([row.incident_id for row in claimed])).all()}
+    case_ids = {incident.case_id for incident in incidents.values()}
+    analysis = analyze_incidents_severity_batch([
+        {'id': incident.id, 'incident_type': incident.incident_type, 'description': incident.description}
+        for incident in incidents.values()
+    ], case_id=case_ids.pop() if len(case_ids) == 1 else None)
+    assessments = {}
+    for assessment in analysis.get('assessments', []):
+        assessments[assessment.get('id')] = assessment
+
+    now = datetime.utcnow()
+    for row in claimed:
+        incident = incidents.get(row.incident_id)
+        assessment = assessments.get(row.incident_id, {})
+        severity = str(assessment.get('severity_assessment', '')).lower()
+        row.attempts = (row.attempts or 0) + 1
+        row.claim_token = None
+        if incident is not None and severity in SEVERITIES:
+            row.status = 'assessed'
+            row.ai_severity = severity
+            row.legal_implications = assessment.get('legal_implications')
+            row.assessed_at = now
+            row.error = None
+            incident.severity = severity
+        else:
+            row.error = analysis.get('error') or 'No usable assessment returned'
+            row.status = 'failed' if row.attempts >= MAX_ATTEMPTS or incident is None else 'pending'
+    db.session.commit()
+    # A failed request leaves the batch queued; stop draining until the next wake-up
+    return 0 if 'error' in analysis else len(claimed)
+
+
+def process_queue(batch_size=BATCH_SIZE, max_batches=None):
+    """Drain the queue batch by batch; returns the number of assessments processed"""
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = process_batch(batch_size)
+        if not count:
+            break
+        processed += count
+        batches += 1
+    return processed
+
+
+def severity_audit(case_id):
+    """Assessed incidents with the user's and the AI's severity side by side"""
+    rows = (SeverityAssessment.query.join(Incident)
+            .filter(Incident.case_id == case_id, SeverityAssessment.status == 'assessed')
+            .order_by(SeverityAssessment.assessed_at.desc()).all())
+    return [{
+        'incident_id': row.incident_id,
+        'title': row.incident.title,
+        'user_severity': row.user_severity,
+        'ai_severity': row.ai_severity,
+        'changed': row.user_severity != row.ai_severity,
+        'legal_implications': row.legal_implications,
+        'assessed_at': row.assessed_at.isoformat() if row.assessed_at else None,
+    } for row in rows]
+
+
+_wake_event = threading.Event()
+_worker = None
+
+
+def wake_worker():
+    """Nudge the in-process worker that new work is queued"""
+    _wake_event.set()
+
+
+def start_severity_worker(app, max_wait=5.0, batch_size=BATCH_SIZE):
+    """Start a daemon thread that batches queued assessments
+
+    The worker waits up to ``max_wait`` seconds after being woken so that
+    incidents logged close together share one model request.
+    """
+    global _worker
+    if _worker is not None:
+        return _worker
+
+    def run():
+        while True:
+            _wake_event.wait(timeout=60)
+            _wake_event.clear()
+            time.sleep(max_wait)
+            with app.app_context():
+                try:
+                    for _ in each_case_database(app):
+                        process_queue(batch_size)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Severity assessment worker failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    _worker = threading.Thread(target=run, name='severity-assessment', daemon=True)
+    _worker.start()
+    return _worker
@@ -0,0 +1,265 @@
+"""
+SQLite production mode: WAL and connection pragmas plus a single-writer queue
+
+SQLite allows one writer at a time. Under several gunicorn workers,
+overlapping uploads and incident writes raced for that lock and failed with
+"database is locked". In WAL mode readers no longer block the writer, and the
+writer queue makes sessions wait their turn (in arrival order, across threads
+and processes) before their first write instead of failing. Core writes on
+their own connections (rate-limit buckets, AI usage, archiving) take the same
+slot through writer_slot().
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: writes are serialized within a process only
+    fcntl = None
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # Durable across application crashes; WAL makes FULL unnecessary
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # Negative values are KiB, so 64 MB
+    'temp_store': 'MEMORY',
+}
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def sqlite_path(uri):
+    """Database file path, or None for in-memory databases"""
+    database = make_url(uri).database
+    return None if database in (None, '', ':memory:') else database
+
+
+def sqlite_engine_options(environ=os.environ):
+    """Engine options for a SQLite file: a lock timeout rather than pool recycling or pings,
+    which only guard against server-side connection timeouts on networked databases"""
+    return {'connect_args': {'timeout': int(environ.get('SQLITE_BUSY_TIMEOUT', '5000')) / 1000,
+                             'check_same_thread': False}}
+
+
+def pragmas_from_env(environ=os.environ):
+    pragmas = dict(DEFAULT_PRAGMAS)
+    for name in ('busy_timeout', 'mmap_size', 'cache_size'):
+        value = environ.get(f'SQLITE_{name.upper()}')
+        if value is not None:
+            pragmas[name] = int(value)
+    if environ.get('SQLITE_SYNCHRONOUS'):
+        pragmas['synchronous'] = environ['SQLITE_SYNCHRONOUS'].upper()
+    return pragmas
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+class WriterQueue:
+    """One writer at a time: a thread lock for this process plus an flock shared by all processes"""
+
+    def __init__(self, lock_path=None):
+        self.lock_path = lock_path
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._owner = None  # Thread holding the slot
+        self.stats = {'writes': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'hold_seconds': 0.0}
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        handle = None
+        if fcntl is not None and self.lock_path:
+            try:
+                handle = open(self.lock_path, 'a+')
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            except OSError:
+                if handle is not None:
+                    handle.close()
+                self._thread_lock.release()
+                raise
+        self._owner = threading.get_ident()
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.stats['writes'] += 1
+            self.stats['wait_seconds'] += waited
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+        return handle, time.perf_counter()
+
+    def release(self, token):
+        handle, acquired_at = token
+        self._owner = None
+        try:
+            if handle is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+                handle.close()
+        finally:
+            self._thread_lock.release()
+            with self._stats_lock:
+                self.stats['hold_seconds'] += time.perf_counter() - acquired_at
+
+    @contextmanager
+    def writing(self):
+        if self._owner == threading.get_ident():
+            yield  # Already held by this thread; waiting on ourselves would never end
+            return
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+
+def writer_slot(app):
+    """Context manager holding the main database's writer slot, for writes outside the request session
+
+    A no-op unless tuned SQLite queues writes. The thread must not also have
+    an uncommitted session write open, or the two connections deadlock on
+    SQLite's own lock until busy_timeout.
+    """
+    writer = app.extensions.get('sqlite_writer')
+    return writer.writing() if writer is not None else nullcontext()
+
+
+def _session_writes(session, queue):
+    if 'sqlite_writer' not in session.info:
+        session.info['sqlite_writer'] = queue.acquire()
+
+
+def install_sqlite_mode(engine, pragmas=None, serialize_writes=True):
+    """Apply pragmas to every new connection and queue sessions before their first write"""
+    pragmas = pragmas if pragmas is not None else pragmas_from_env()
+    path = engine.url.database
+    if path in (None, '', ':memory:'):
+        pragmas = {name: value for name, value in pragmas.items() if name not in ('journal_mode', 'mmap_size')}
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    if not serialize_writes:
+        return None
+
+    queue = WriterQueue(f"{path}.writer.lock" if path not in (None, '', ':memory:') else None)
+
+    # pysqlite only opens a transaction at the first INSERT/UPDATE/DELETE, so taking
+    # the writer slot there means a session never holds a stale read snapshot when it writes
+    @event.listens_for(Session, 'before_flush')
+    def queue_flush(session, flush_context, instances):
+        if session.get_bind() is engine:
+            _session_writes(session, queue)
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def queue_bulk_write(orm_execute_state):
+        if (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete) \
+                and orm_execute_state.session.get_bind() is engine:
+            _session_writes(orm_execute_state.session, queue)
+
+    @event.listens_for(Session, 'after_transaction_end')
+    def release_writer(session, transaction):
+        if transaction.parent is None and 'sqlite_writer' in session.info:
+            queue.release(session.info.pop('sqlite_writer'))
+
+    return queue
+
+
+def run_benchmark(path, tuned, writers=4, readers=4, seconds=5.0):
+    """Concurrent read/write throughput against a scratch SQLite file
+
+    Each writer commits small single-row transactions and each reader runs an
+    aggregate query, all on their own connections. With ``tuned`` the
+    production pragmas and writer queue are used; otherwise SQLite defaults
+    (rollback journal, synchronous=FULL) with the driver's 5 second timeout.
+    """
+    for suffix in ('', '-wal', '-shm', '.writer.lock'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    setup = sqlite3.connect(path)
+    if tuned:
+        apply_pragmas(setup, DEFAULT_PRAGMAS)
+    setup.execute('CREATE TABLE entry (id INTEGER PRIMARY KEY, case_id INTEGER, body TEXT, created_at REAL)')
+    setup.executemany('INSERT INTO entry (case_id, body, created_at) VALUES (?, ?, ?)',
+                      [(i % 5, 'x' * 200, time.time()) for i in range(5000)])
+    setup.commit()
+    setup.close()
+
+    queue = WriterQueue(path + '.writer.lock') if tuned else None
+    deadline = time.perf_counter() + seconds
+    counts = {'writes': 0, 'reads': 0, 'errors': 0}
+    counts_lock = threading.Lock()
+
+    def connect():
+        connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        if tuned:
+            apply_pragmas(connection, DEFAULT_PRAGMAS)
+        return connection
+
+    def count(name):
+        with counts_lock:
+            counts[name] += 1
+
+    def writer(worker_id):
+        connection = connect()
+        while time.perf_counter() < deadline:
+            try:
+                if queue is not None:
+                    with queue.writing():
+                        connection.execute('INSERT INTO entry (case_id, body, created_at) VALUES (?, ?, ?)',
+                                           (worker_id % 5, 'y' * 200, time.time()))
+                        connection.commit()
+                else:
+                    connection.execute('INSERT INTO entry (case_id, body, created_at) VALUES (?, ?, ?)',
+                                       (worker_id % 5, 'y' * 200, time.time()))
+                    connection.commit()
+                count('writes')
+            except sqlite3.OperationalError:
+                connection.rollback()
+                count('errors')
+        connection.close()
+
+    def reader(worker_id):
+        connection = connect()
+        while time.perf_counter() < deadline:
+            try:
+                connection.execute('SELECT case_id, COUNT(*), MAX(created_at) FROM entry GROUP BY case_id').fetchall()
+                count('reads')
+            except sqlite3.OperationalError:
+                count('errors')
+        connection.close()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    for suffix in ('', '-wal', '-shm', '.writer.lock'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return {
+        'mode': 'tuned' if tuned else 'default',
+        'writes_per_second': round(counts['writes'] / elapsed, 1),
+        'reads_per_second': round(counts['reads'] / elapsed, 1),
+        'errors': counts['errors'],
+        'writer_wait_seconds': round(queue.stats['wait_seconds'], 3) if queue else None,
+    }
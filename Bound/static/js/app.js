@@ -12,6 +12,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize file upload handlers
     initializeFileUpload();
     
+    // Initialize virtualized lists (before search and filters, which drive them)
+    initializeVirtualLists();
+    
     // Initialize timeline filtering
     initializeTimelineFilters();
     
@@ -193,6 +196,282 @@ function formatFileSize(bytes) {
     return parseFloat((bytes / Math.pow(k, i)).toFixed(1)) + ' ' + sizes[i];
 }
 
+/**
+ * Virtualized long lists
+ *
+ * A [data-virtual-list] element renders its first page of rows and keeps the
+ * rest in a <template>; only the rows in or near the viewport are kept in the
+ * element, and padding stands in for the height of the rest. Row heights are measured once a row has been
+ * mounted and estimated from the average until then. Rows scroll with the
+ * element itself when it scrolls (the timeline), else with the page.
+ */
+const VIRTUAL_LIST_OVERSCAN = 800;  // Pixels of rows kept mounted above and below the viewport
+const VIRTUAL_ROW_ESTIMATE = 240;  // Height assumed for rows before any has been measured
+const virtualLists = new Map();  // list element -> VirtualList
+
+class VirtualList {
+    constructor(element) {
+        const template = element.querySelector(':scope > template');
+        if (template) {
+            template.remove();
+        }
+        // The first page is rendered as ordinary rows (readable without scripts); the rest wait in the template
+        const rendered = Array.from(element.children);
+        this.element = element;
+        this.rows = rendered.concat(template ? Array.from(template.content.children) : []);
+        this.heights = new Array(this.rows.length).fill(0);  // 0 until measured, margins included
+        this.margins = new Array(this.rows.length);
+        this.measuredTotal = 0;
+        this.measuredCount = 0;
+        this.filters = new Map();  // name -> predicate(row, index)
+        this.visible = this.rows.map((row, index) => index);
+        this.offsets = null;  // Top of each visible row, plus the total height; rebuilt when stale
+        this.mounted = rendered.map((row, index) => index);
+        this.mountListeners = [];
+        this.scheduled = false;
+
+        const style = getComputedStyle(element);
+        this.padding = [parseFloat(style.paddingTop) || 0, parseFloat(style.paddingBottom) || 0];
+        this.scroller = ['auto', 'scroll'].includes(style.overflowY) ? element : null;
+        (this.scroller || window).addEventListener('scroll', () => this.schedule(), { passive: true });
+        window.addEventListener('resize', () => this.schedule());
+    }
+
+    schedule() {
+        if (!this.scheduled) {
+            this.scheduled = true;
+            requestAnimationFrame(() => this.render());
+        }
+    }
+
+    estimate() {
+        return this.measuredCount ? this.measuredTotal / this.measuredCount : VIRTUAL_ROW_ESTIMATE;
+    }
+
+    layout() {
+        if (!this.offsets) {
+            const estimate = this.estimate();
+            this.offsets = [0];
+            this.visible.forEach((index, position) => {
+                this.offsets.push(this.offsets[position] + (this.heights[index] || estimate));
+            });
+        }
+        return this.offsets;
+    }
+
+    // Top and bottom of the viewport, relative to the top of the first row
+    viewport() {
+        if (this.scroller) {
+            const top = this.scroller.scrollTop - this.padding[0];
+            return [top, top + this.scroller.clientHeight];
+        }
+        const top = -(this.element.getBoundingClientRect().top + this.padding[0]);
+        return [top, top + window.innerHeight];
+    }
+
+    render() {
+        this.scheduled = false;
+        const offsets = this.layout();
+        const [top, bottom] = this.viewport();
+        const count = this.visible.length;
+
+        let low = 0;
+        let high = count;
+        while (low < high) {  // First row ending below the top of the overscan
+            const middle = (low + high) >> 1;
+            if (offsets[middle + 1] <= top - VIRTUAL_LIST_OVERSCAN) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        let end = low;
+        while (end < count && offsets[end] < bottom + VIRTUAL_LIST_OVERSCAN) {
+            end++;
+        }
+
+        this.mount(this.visible.slice(low, end));
+        this.element.style.paddingTop = `${this.padding[0] + offsets[low]}px`;
+        this.element.style.paddingBottom = `${this.padding[1] + offsets[count] - offsets[end]}px`;
+        if (this.measure()) {
+            this.schedule();  // Measured heights differ from the estimates: lay out again
+        }
+    }
+
+    mount(indexes) {
+        const wanted = new Set(indexes);
+        const previous = new Set(this.mounted);
+        this.mounted.forEach(index => {
+            if (!wanted.has(index)) {
+                this.rows[index].remove();
+            }
+        });
+
+        // Rows are moved rather than copied, so anything done to a row survives it scrolling out of view
+        let next = this.element.firstElementChild;
+        indexes.forEach(index => {
+            const row = this.rows[index];
+            if (row === next) {
+                next = next.nextElementSibling;
+            } else {
+                this.element.insertBefore(row, next);
+            }
+        });
+        this.mounted = indexes;
+
+        const added = indexes.filter(index => !previous.has(index)).map(index => this.rows[index]);
+        if (added.length) {
+            this.mountListeners.forEach(listener => listener(added));
+        }
+    }
+
+    measure() {
+        let changed = false;
+        this.mounted.forEach(index => {
+            const row = this.rows[index];
+            if (this.margins[index] === undefined) {
+                const style = getComputedStyle(row);
+                this.margins[index] = (parseFloat(style.marginTop) || 0) + (parseFloat(style.marginBottom) || 0);
+            }
+            const height = row.offsetHeight + this.margins[index];
+            if (height !== this.heights[index]) {
+                if (this.heights[index]) {
+                    this.measuredTotal -= this.heights[index];
+                } else {
+                    this.measuredCount++;
+                }
+                this.measuredTotal += height;
+                this.heights[index] = height;
+                changed = true;
+            }
+        });
+        if (changed) {
+            this.offsets = null;
+        }
+        return changed;
+    }
+
+    mountedRows() {
+        return this.mounted.map(index => this.rows[index]);
+    }
+
+    /**
+     * Show only rows every filter accepts; a null predicate removes the named filter.
+     * Returns the number of rows shown.
+     */
+    setFilter(name, predicate) {
+        if (predicate) {
+            this.filters.set(name, predicate);
+        } else {
+            this.filters.delete(name);
+        }
+        const filters = Array.from(this.filters.values());
+        this.visible = this.rows.map((row, index) => index)
+            .filter(index => filters.every(filter => filter(this.rows[index], index)));
+        this.offsets = null;
+        this.render();
+        return this.visible.length;
+    }
+
+    scrollToRow(index) {
+        const position = this.visible.indexOf(index);
+        if (position < 0) {
+            return false;
+        }
+        const top = this.layout()[position] + this.padding[0];
+        if (this.scroller) {
+            this.scroller.scrollTop = top;
+        } else {
+            window.scrollTo(0, window.scrollY + this.element.getBoundingClientRect().top + top);
+        }
+        this.render();
+        this.rows[index].scrollIntoView();  // Exact now that the rows around it are mounted and measured
+        return true;
+    }
+}
+
+/**
+ * Fetch the related items of rows past the first page once they are mounted
+ */
+function loadRelatedItems(list, rows) {
+    rows.forEach(row => {
+        const container = row.querySelector('[data-related-url]');
+        if (!container) {
+            return;
+        }
+        const url = container.getAttribute('data-related-url');
+        container.removeAttribute('data-related-url');  // Fetched once, however often the row is remounted
+        fetch(url)
+            .then(response => (response.status === 200 ? response.json() : []))
+            .then(items => {
+                if (!items.length) {
+                    return;
+                }
+                const heading = document.createElement('h6');
+                heading.className = 'text-secondary';
+                heading.innerHTML = '<i data-feather="link" class="me-1" style="width: 1rem; height: 1rem;"></i>';
+                heading.append('Related Items');
+                const listElement = document.createElement('ul');
+                listElement.className = 'list-inline small mb-0';
+                items.forEach(item => {
+                    const entry = document.createElement('li');
+                    entry.className = 'list-inline-item';
+                    const link = document.createElement('a');
+                    link.href = item.url;
+                    link.textContent = item.title;
+                    const badge = document.createElement('span');
+                    badge.className = 'badge bg-light text-dark';
+                    badge.textContent = item.type.replace(/_/g, ' ').replace(/\b\w/g, letter => letter.toUpperCase());
+                    entry.append(link, ' ', badge);
+                    listElement.append(entry);
+                });
+                container.append(heading, listElement);
+                container.hidden = false;
+                if (typeof feather !== 'undefined') {
+                    feather.replace();
+                }
+                list.schedule();  // The row grew: measure it again
+            })
+            .catch(() => {});
+    });
+}
+
+/**
+ * Initialize virtualized lists
+ */
+function initializeVirtualLists() {
+    document.querySelectorAll('[data-virtual-list]').forEach(element => {
+        const list = new VirtualList(element);
+        list.mountListeners.push(() => {
+            // Re-initialize feather icons for the mounted rows
+            if (typeof feather !== 'undefined') {
+                feather.replace();
+            }
+        });
+        list.mountListeners.push(rows => loadRelatedItems(list, rows));
+        virtualLists.set(element, list);
+        list.render();
+    });
+
+    // Links to a row (e.g. #incident-12 from related items) need it mounted first
+    const showLinkedRow = () => {
+        const id = decodeURIComponent(window.location.hash.slice(1));
+        if (!id) {
+            return;
+        }
+        virtualLists.forEach(list => {
+            const index = list.rows.findIndex(row => row.id === id);
+            if (index >= 0) {
+                list.scrollToRow(index);
+            }
+        });
+    };
+    if (virtualLists.size) {
+        window.addEventListener('hashchange', showLinkedRow);
+        showLinkedRow();
+    }
+}
+
 /**
  * Initialize timeline filtering
  */
@@ -213,7 +492,6 @@ function initializeTimelineFilters() {
  * Filter timeline events by type
  */
 function filterTimeline(type) {
-    const timelineItems = document.querySelectorAll('.timeline-item');
     const filterButtons = document.querySelectorAll('[onclick^="filterTimeline"]');
     
     // Update button states
@@ -229,8 +507,15 @@ function filterTimeline(type) {
         activeButton.classList.add('btn-primary');
     }
     
+    // Virtualized timeline: filter the rows it mounts
+    const list = virtualLists.get(document.querySelector('.timeline-container[data-virtual-list]'));
+    if (list) {
+        list.setFilter('type', type === 'all' ? null : row => row.getAttribute('data-event-type') === type);
+        return;
+    }
+    
     // Filter timeline items
-    timelineItems.forEach(item => {
+    document.querySelectorAll('.timeline-item').forEach(item => {
         const itemType = item.getAttribute('data-event-type');
         
         if (type === 'all' || itemType === type) {
@@ -243,134 +528,385 @@ function filterTimeline(type) {
     });
 }
 
+/**
+ * Search indexes
+ *
+ * An inverted index of a list's rows: sorted tokens, each with the positions
+ * of the rows containing it. List pages ship one as JSON (search_index.py);
+ * for other [data-search] targets it is built once from their text. Every
+ * query word must match the start of a token in the row.
+ */
+const SEARCH_TOKEN_PATTERN = /[a-z0-9']+/g;  // Same tokens as search_index.py
+const SEARCH_DELAY = 150;
+
+function searchTokens(text) {
+    return text.toLowerCase().match(SEARCH_TOKEN_PATTERN) || [];
+}
+
+class SearchIndex {
+    constructor(data) {
+        this.size = data.size;
+        this.tokens = data.tokens;
+        this.postings = data.postings;
+    }
+
+    static fromTexts(texts) {
+        const postings = new Map();
+        texts.forEach((text, row) => {
+            new Set(searchTokens(text)).forEach(token => {
+                if (!postings.has(token)) {
+                    postings.set(token, []);
+                }
+                postings.get(token).push(row);
+            });
+        });
+        const tokens = Array.from(postings.keys()).sort();
+        return new SearchIndex({ size: texts.length, tokens, postings: tokens.map(token => postings.get(token)) });
+    }
+
+    // Rows with a token starting with prefix
+    prefixMatches(prefix) {
+        let low = 0;
+        let high = this.tokens.length;
+        while (low < high) {
+            const middle = (low + high) >> 1;
+            if (this.tokens[middle] < prefix) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        const rows = new Set();
+        for (let i = low; i < this.tokens.length && this.tokens[i].startsWith(prefix); i++) {
+            this.postings[i].forEach(row => rows.add(row));
+        }
+        return rows;
+    }
+
+    // Rows matching every word of the query, or null when it has none
+    search(query) {
+        const words = new Set(searchTokens(query));
+        if (!words.size) {
+            return null;
+        }
+        let rows = null;
+        for (const word of words) {
+            const matches = this.prefixMatches(word);
+            rows = rows ? new Set(Array.from(rows).filter(row => matches.has(row))) : matches;
+            if (!rows.size) {
+                break;
+            }
+        }
+        return rows;
+    }
+}
+
 /**
  * Initialize search functionality
+ *
+ * data-search names the list (or elements) an input searches, and the
+ * optional data-search-status an element showing the number of matches.
  */
 function initializeSearch() {
     const searchInputs = document.querySelectorAll('[data-search]');
     
     searchInputs.forEach(input => {
         const targetSelector = input.getAttribute('data-search');
+        const list = virtualLists.get(document.querySelector(targetSelector));
+        const search = list ? searchVirtualList(list) : searchElements(document.querySelectorAll(targetSelector));
+        const statusSelector = input.getAttribute('data-search-status');
+        const status = statusSelector ? document.querySelector(statusSelector) : null;
         
-        input.addEventListener('input', function() {
-            const searchTerm = this.value.toLowerCase();
-            const targets = document.querySelectorAll(targetSelector);
-            
-            targets.forEach(target => {
-                const text = target.textContent.toLowerCase();
-                const matches = text.includes(searchTerm);
-                
-                target.style.display = matches || searchTerm === '' ? 'block' : 'none';
-                
-                if (matches && searchTerm !== '') {
-                    highlightSearchTerm(target, searchTerm);
-                } else {
-                    removeHighlight(target);
-                }
-            });
-        });
+        input.addEventListener('input', debounce(function() {
+            const shown = search(input.value);
+            if (status) {
+                status.textContent = shown === null ? '' : `${shown} match${shown === 1 ? '' : 'es'}`;
+            }
+        }, SEARCH_DELAY));
     });
 }
 
+/**
+ * Search a virtualized list; only its mounted rows are highlighted
+ */
+function searchVirtualList(list) {
+    const source = list.element.getAttribute('data-search-index');
+    const script = source ? document.querySelector(source) : null;
+    const index = script ? new SearchIndex(JSON.parse(script.textContent))
+                         : SearchIndex.fromTexts(list.rows.map(row => row.textContent));
+    const highlighted = new Set();
+    let words = [];
+    
+    const highlight = rows => rows.forEach(row => {
+        if (words.length && !highlighted.has(row)) {
+            highlightSearchTerm(row, words);
+            highlighted.add(row);
+        }
+    });
+    list.mountListeners.push(highlight);
+    
+    return query => {
+        const matches = index.search(query);
+        words = matches ? searchTokens(query) : [];
+        highlighted.forEach(row => removeHighlight(row));
+        highlighted.clear();
+        const shown = list.setFilter('search', matches && ((row, index) => matches.has(index)));
+        highlight(list.mountedRows());
+        return matches ? shown : null;
+    };
+}
+
+/**
+ * Search plain elements, indexed once from their text
+ */
+function searchElements(targets) {
+    targets = Array.from(targets);
+    const index = SearchIndex.fromTexts(targets.map(target => target.textContent));
+    
+    return query => {
+        const matches = index.search(query);
+        const words = searchTokens(query);
+        targets.forEach((target, position) => {
+            removeHighlight(target);
+            const shown = !matches || matches.has(position);
+            target.style.display = shown ? '' : 'none';
+            if (matches && shown) {
+                highlightSearchTerm(target, words);
+            }
+        });
+        return matches ? matches.size : null;
+    };
+}
+
+function escapeRegExp(text) {
+    return text.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+}
+
 /**
  * Highlight search terms
+ *
+ * Matches are wrapped in <mark> elements text node by text node, so the
+ * element's markup (links, forms, icons) is left as it was.
  */
-function highlightSearchTerm(element, term) {
-    const originalText = element.textContent;
-    const regex = new RegExp(`(${term})`, 'gi');
-    const highlightedText = originalText.replace(regex, '<mark>$1</mark>');
-    
-    // Store original text if not already stored
-    if (!element.hasAttribute('data-original-text')) {
-        element.setAttribute('data-original-text', originalText);
+function highlightSearchTerm(element, terms) {
+    terms = [].concat(terms).filter(Boolean);
+    if (!terms.length) {
+        return;
+    }
+    const pattern = new RegExp(terms.map(escapeRegExp).sort((a, b) => b.length - a.length).join('|'), 'gi');
+    const walker = document.createTreeWalker(element, NodeFilter.SHOW_TEXT, {
+        acceptNode: node => node.parentElement.closest('script, style, textarea, mark[data-search-mark]')
+            ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT
+    });
+    const textNodes = [];
+    while (walker.nextNode()) {
+        textNodes.push(walker.currentNode);
     }
     
-    element.innerHTML = highlightedText;
+    textNodes.forEach(node => {
+        const text = node.nodeValue;
+        const fragment = document.createDocumentFragment();
+        let last = 0;
+        let match;
+        pattern.lastIndex = 0;
+        while ((match = pattern.exec(text)) !== null) {
+            fragment.append(text.slice(last, match.index));
+            const mark = document.createElement('mark');
+            mark.setAttribute('data-search-mark', '');
+            mark.textContent = match[0];
+            fragment.append(mark);
+            last = match.index + match[0].length;
+        }
+        if (last) {
+            fragment.append(text.slice(last));
+            node.replaceWith(fragment);
+        }
+    });
 }
 
 /**
  * Remove search highlighting
  */
 function removeHighlight(element) {
-    const originalText = element.getAttribute('data-original-text');
-    if (originalText) {
-        element.textContent = originalText;
-        element.removeAttribute('data-original-text');
-    }
+    element.querySelectorAll('mark[data-search-mark]').forEach(mark => {
+        const parent = mark.parentNode;
+        mark.replaceWith(mark.textContent);
+        parent.normalize();
+    });
 }
 
 /**
  * Initialize auto-save functionality for forms
+ *
+ * Drafts are stored on the server so they follow the case across devices.
+ * Edits are debounced and only the fields that changed since the last save
+ * are PATCHed, together with the draft version they were based on.
  */
+const AUTOSAVE_DELAY = 1000;
+
 function initializeAutoSave() {
     const forms = document.querySelectorAll('[data-autosave]');
     
     forms.forEach(form => {
-        const inputs = form.querySelectorAll('input, textarea, select');
+        const url = form.getAttribute('data-autosave-url');
+        if (!url) {
+            return;
+        }
         
-        inputs.forEach(input => {
-            input.addEventListener('change', function() {
-                saveFormData(form);
-            });
-        });
+        const state = { url: url, version: 0, saved: {}, saving: false, pending: false };
+        const save = debounce(() => saveFormDraft(form, state), AUTOSAVE_DELAY);
+        
+        form.addEventListener('input', save);
+        form.addEventListener('change', save);
         
         // Load saved data on page load
-        loadFormData(form);
+        loadFormDraft(form, state);
     });
 }
 
 /**
- * Save form data to localStorage
+ * Current form values; repeated names (checkbox groups) become arrays
  */
-function saveFormData(form) {
-    const formData = new FormData(form);
-    const data = {};
+function collectFormValues(form) {
+    const values = {};
     
-    for (let [key, value] of formData.entries()) {
-        data[key] = value;
+    for (let [key, value] of new FormData(form).entries()) {
+        if (value instanceof File) {
+            continue;
+        }
+        if (key in values) {
+            values[key] = [].concat(values[key], value);
+        } else {
+            values[key] = value;
+        }
     }
     
-    const formId = form.id || form.getAttribute('data-autosave');
-    localStorage.setItem(`form-${formId}`, JSON.stringify(data));
+    return values;
+}
+
+/**
+ * Fields whose value differs from the last saved draft; removed fields map to null
+ */
+function diffFormValues(saved, current) {
+    const changes = {};
     
-    // Show save indicator
-    showSaveIndicator();
+    Object.keys(current).forEach(key => {
+        if (JSON.stringify(saved[key]) !== JSON.stringify(current[key])) {
+            changes[key] = current[key];
+        }
+    });
+    Object.keys(saved).forEach(key => {
+        if (!(key in current)) {
+            changes[key] = null;
+        }
+    });
+    
+    return changes;
 }
 
 /**
- * Load form data from localStorage
+ * PATCH changed fields to the server draft
  */
-function loadFormData(form) {
-    const formId = form.id || form.getAttribute('data-autosave');
-    const savedData = localStorage.getItem(`form-${formId}`);
+function saveFormDraft(form, state) {
+    if (state.saving) {
+        state.pending = true;
+        return;
+    }
     
-    if (savedData) {
-        const data = JSON.parse(savedData);
+    const current = collectFormValues(form);
+    const changes = diffFormValues(state.saved, current);
+    if (Object.keys(changes).length === 0) {
+        return;
+    }
+    
+    state.saving = true;
+    fetch(state.url, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ base_version: state.version, changes: changes })
+    })
+        .then(response => response.json().then(body => ({ status: response.status, body: body })))
+        .then(({ status, body }) => {
+            if (status === 200) {
+                state.version = body.version;
+                state.saved = current;
+                showSaveIndicator();
+            } else if (status === 409) {
+                // Edited on another device: adopt its version; local edits are re-sent on the next save
+                state.version = body.draft.version;
+                state.saved = body.draft.fields;
+                showSaveIndicator('This draft was also edited elsewhere. Your latest changes will be kept.', 'warning');
+                state.pending = true;
+            }
+        })
+        .catch(() => {
+            // Offline or server error; the next edit retries with the same base version
+        })
+        .finally(() => {
+            state.saving = false;
+            if (state.pending) {
+                state.pending = false;
+                saveFormDraft(form, state);
+            }
+        });
+}
+
+/**
+ * Fill empty fields from the server draft, migrating any older browser-only draft
+ */
+function loadFormDraft(form, state) {
+    const legacyKey = `form-${form.id || form.getAttribute('data-autosave')}`;
+    
+    fetch(state.url)
+        .then(response => (response.status === 200 ? response.json() : null))
+        .then(draft => {
+            if (draft) {
+                state.version = draft.version;
+                state.saved = draft.fields;
+                applyFormValues(form, draft.fields);
+            } else if (localStorage.getItem(legacyKey)) {
+                applyFormValues(form, JSON.parse(localStorage.getItem(legacyKey)));
+                saveFormDraft(form, state);
+            }
+            localStorage.removeItem(legacyKey);
+        })
+        .catch(() => {});
+}
+
+/**
+ * Set form fields from saved values without overwriting anything already typed
+ */
+function applyFormValues(form, values) {
+    Object.entries(values).forEach(([key, value]) => {
+        const fields = form.querySelectorAll(`[name="${CSS.escape(key)}"]`);
+        const list = [].concat(value);
         
-        Object.entries(data).forEach(([key, value]) => {
-            const field = form.querySelector(`[name="${key}"]`);
-            if (field && !field.value) { // Only set if field is empty
-                field.value = value;
+        fields.forEach(field => {
+            if (field.type === 'checkbox' || field.type === 'radio') {
+                field.checked = list.includes(field.value);
+            } else if (field.type !== 'file' && !field.value) { // Only set if field is empty
+                field.value = list[0];
             }
         });
-    }
+    });
 }
 
 /**
  * Show save indicator
  */
-function showSaveIndicator() {
+function showSaveIndicator(message = 'Changes saved automatically', type = 'success') {
     let indicator = document.querySelector('.save-indicator');
     
     if (!indicator) {
         indicator = document.createElement('div');
-        indicator.className = 'save-indicator position-fixed top-0 end-0 m-3 alert alert-success alert-dismissible fade';
-        indicator.innerHTML = `
-            <i data-feather="check-circle" class="me-2"></i>
-            Changes saved automatically
-        `;
         document.body.appendChild(indicator);
     }
+    indicator.className = `save-indicator position-fixed top-0 end-0 m-3 alert alert-${type} alert-dismissible fade`;
+    indicator.innerHTML = `
+        <i data-feather="${type === 'success' ? 'check-circle' : 'alert-triangle'}" class="me-2"></i>
+        <span></span>
+    `;
+    indicator.querySelector('span').textContent = message;
     
     indicator.classList.add('show');
     
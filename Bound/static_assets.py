@@ -0,0 +1,129 @@
+"""
+Fingerprinted static assets with precompressed gzip/brotli variants
+
+asset_url('css/legal_styles.css') returns /assets/css/legal_styles.<hash>.css.
+Because the URL changes whenever the content does, responses can be cached
+as immutable for a year. Compressed variants are written once per content
+hash to ASSET_BUILD_FOLDER, at startup or ahead of time with
+``flask build-assets``.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import request, send_file, url_for, abort
+
+from compression import available_encodings, choose_encoding, compress
+
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Text formats worth precompressing; images and fonts are already compressed
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ico'}
+
+
+def fingerprint_name(filename, digest):
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{digest[:HASH_LENGTH]}{extension}"
+
+
+class AssetManifest:
+    """Maps static files to their fingerprinted names and precompressed variants"""
+
+    def __init__(self, static_folder, build_folder):
+        self.static_folder = static_folder
+        self.build_folder = build_folder
+        self.assets = {}       # 'css/app.css' -> 'css/app.<hash>.css'
+        self._sources = {}     # fingerprinted name -> (source path, digest)
+        self._lock = threading.Lock()
+
+    def build(self, precompress=True):
+        """Hash every static file and write any missing compressed variants; returns the asset count"""
+        assets, sources = {}, {}
+        for directory, _, filenames in os.walk(self.static_folder):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                hashed = fingerprint_name(relative, digest)
+                assets[relative] = hashed
+                sources[hashed] = (path, digest)
+                if precompress and os.path.splitext(filename)[1].lower() in PRECOMPRESS_EXTENSIONS:
+                    self._precompress(hashed, data)
+        with self._lock:
+            self.assets, self._sources = assets, sources
+        self._write_manifest()
+        return len(assets)
+
+    def _variant_path(self, hashed, encoding):
+        return os.path.join(self.build_folder, hashed + ('.br' if encoding == 'br' else '.gz'))
+
+    def _precompress(self, hashed, data):
+        for encoding in available_encodings():
+            path = self._variant_path(hashed, encoding)
+            if os.path.exists(path):
+                continue  # Named by content hash, so an existing file is already current
+            compressed = compress(data, encoding, best=True)
+            if len(compressed) >= len(data):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, path)
+
+    def _write_manifest(self):
+        os.makedirs(self.build_folder, exist_ok=True)
+        temp_path = os.path.join(self.build_folder, f"manifest.json.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.assets, f, indent=2, sort_keys=True)
+        os.replace(temp_path, os.path.join(self.build_folder, 'manifest.json'))
+
+    def url(self, filename):
+        hashed = self.assets.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('static_asset', filename=hashed)
+
+    def response(self, hashed):
+        """Immutable response for a fingerprinted asset, preferring a precompressed variant"""
+        source = self._sources.get(hashed)
+        if source is None:
+            abort(404)
+        path, digest = source
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        encodings = [encoding for encoding in available_encodings()
+                     if os.path.exists(self._variant_path(hashed, encoding))]
+        encoding = choose_encoding(request.accept_encodings, encodings) if encodings else None
+        if encoding:
+            response = send_file(self._variant_path(hashed, encoding), mimetype=mimetype,
+                                 etag=f"{digest[:HASH_LENGTH]}-{encoding}", conditional=True,
+                                 max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_file(path, mimetype=mimetype, etag=digest[:HASH_LENGTH], conditional=True,
+                                 max_age=IMMUTABLE_MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def init_static_assets(app):
+    """Build the manifest, register the /assets route and the asset_url template helper"""
+    manifest = AssetManifest(app.static_folder, app.config['ASSET_BUILD_FOLDER'])
+    manifest.build(precompress=app.config['ASSET_PRECOMPRESS'])
+
+    @app.route('/assets/<path:filename>')
+    def static_asset(filename):
+        return manifest.response(filename)
+
+    app.jinja_env.globals['asset_url'] = manifest.url
+    app.extensions['asset_manifest'] = manifest
+    return manifest
@@ -0,0 +1,71 @@
+"""
+Test settings: a throwaway working directory and SQLite database, no background threads
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='binder-tests-')
+
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}",
+    'OPENAI_API_KEY': 'test',
+    'EMBEDDING_PROVIDER': 'hashing',
+    'SEVERITY_WORKER': 'off',
+    'REMINDER_SCHEDULER': 'off',
+    'DRAFT_CLEANUP': 'off',
+    'CHECKLIST_REFRESH': 'off',
+    'CASE_ARCHIVER': 'off',
+    'RATE_LIMIT_BACKEND': 'off',
+})
+os.chdir(WORK_DIR)  # uploads, indexes and archives are relative to the working directory
+sys.path.insert(0, APP_DIR)
+
+# The app module imports routes and everything they use, so it must be imported before any of them
+from app import app as flask_app, db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    from models import Case
+
+    with flask_app.app_context():
+        if Case.query.first() is None:
+            db.session.add(Case(case_title='Test case', case_type='Family Law'))
+            db.session.commit()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def case(app):
+    from models import Case
+
+    return Case.query.first()
+
+
+@pytest.fixture
+def sharded(app, tmp_path):
+    """CASE_SHARDING for one test: shards in a scratch directory, removed from the catalog afterwards"""
+    from case_shards import CaseShards
+    from models import CaseShard
+
+    shards = CaseShards(str(tmp_path / 'shards'))
+    app.extensions['case_shards'] = shards
+    try:
+        yield shards
+    finally:
+        del app.extensions['case_shards']
+        for case_id in shards.case_ids():
+            shards.close(case_id)
+        CaseShard.query.delete()
+        db.session.commit()
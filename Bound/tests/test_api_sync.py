@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from app import db
+from models import Case, CaseNote
+
+
+def add_note(case, title, updated_at):
+    note = CaseNote(case_id=case.id, title=title, content='text', created_at=updated_at)
+    db.session.add(note)
+    db.session.flush()
+    CaseNote.query.filter_by(id=note.id).update({'updated_at': updated_at}, synchronize_session=False)
+    db.session.commit()
+    return note
+
+
+def sync(client, since):
+    return client.get('/api/v1/case_notes', query_string={'since': since}).get_json()
+
+
+def test_sync_token_overlaps_so_late_commits_are_not_skipped(client, case):
+    now = datetime.utcnow()
+    add_note(case, 'later stamp, committed first', now)
+    token = sync(client, (now - timedelta(hours=1)).isoformat())['sync_token']
+    assert datetime.fromisoformat(token) < now
+
+    late = add_note(case, 'earlier stamp, committed later', now - timedelta(seconds=30))
+    assert late.id in [row['id'] for row in sync(client, token)['data']]
+
+
+def test_sync_lists_cases_archived_since_the_token(client, case):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    assert sync(client, since.isoformat())['archived_cases'] == []
+
+    archived = Case(case_title='Old case', status='archived', archived_at=datetime.utcnow())
+    db.session.add(archived)
+    db.session.commit()
+    assert sync(client, since.isoformat())['archived_cases'] == [archived.id]
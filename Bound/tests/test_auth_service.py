@@ -0,0 +1,50 @@
+import time
+
+import httpx
+import jwt
+from supabase_auth.errors import AuthApiError
+
+from auth_service import AuthService, SessionVerifier, StaticKeyProvider
+
+
+class FailingAuth:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def get_user(self, access_token):
+        self.calls += 1
+        raise self.error
+
+
+class FailingClient:
+    def __init__(self, error):
+        self.auth = FailingAuth(error)
+
+
+def token():
+    return jwt.encode({'sub': 'user-1', 'aud': 'authenticated', 'exp': int(time.time()) + 600},
+                      'a-test-secret-of-at-least-32-bytes', algorithm='HS256')
+
+
+def service(error):
+    # No local keys, so every token falls through to the (failing) Supabase client
+    return AuthService(client=FailingClient(error), verifier=SessionVerifier(StaticKeyProvider({})))
+
+
+def test_unreachable_supabase_is_not_cached_as_a_rejection():
+    auth = service(httpx.ConnectError('Connection refused'))
+    access_token = token()
+
+    assert auth.verify_session(access_token) is None
+    assert auth.verify_session(access_token) is None
+    assert auth.supabase.auth.calls == 2  # Asked again: the outage was not remembered
+
+
+def test_rejected_token_is_cached():
+    auth = service(AuthApiError('Invalid JWT', 401, 'bad_jwt'))
+    access_token = token()
+
+    assert auth.verify_session(access_token) is None
+    assert auth.verify_session(access_token) is None
+    assert auth.supabase.auth.calls == 1
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+
+import pytest
+
+from backup import BackupError, BackupRepository
+
+
+def make_database(path):
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE note (id INTEGER PRIMARY KEY, content TEXT)')
+    connection.execute("INSERT INTO note (content) VALUES ('kept')")
+    connection.commit()
+    connection.close()
+
+
+def test_case_archives_are_backed_up_verified_and_restored(tmp_path):
+    make_database(tmp_path / 'live.db')
+    uploads, archives = tmp_path / 'uploads', tmp_path / 'archives'
+    uploads.mkdir()
+    archives.mkdir()
+    (uploads / 'letter.txt').write_bytes(b'upload')
+    (archives / 'case-7.tar.xz').write_bytes(b'only copy of case 7')
+    repository = BackupRepository(str(tmp_path / 'backups'))
+
+    manifest = repository.backup(f"sqlite:///{tmp_path / 'live.db'}", str(uploads), archive_dir=str(archives))
+    assert set(manifest['archives']) == {'case-7.tar.xz'}
+    assert repository.verify()['archives'] == 1
+
+    restored = tmp_path / 'restored'
+    repository.restore(f"sqlite:///{restored / 'database.sqlite'}", str(restored / 'uploads'),
+                       archive_dir=str(restored / 'archives'))
+    assert (restored / 'archives' / 'case-7.tar.xz').read_bytes() == b'only copy of case 7'
+
+    # A second snapshot without the archive must not let pruning drop the blob the first still needs
+    (archives / 'case-7.tar.xz').unlink()
+    repository.backup(f"sqlite:///{tmp_path / 'live.db'}", str(uploads), archive_dir=str(archives))
+    repository.prune(2)
+    assert os.path.exists(repository.blob_path(manifest['archives']['case-7.tar.xz']['sha256']))
+
+    os.unlink(repository.blob_path(manifest['archives']['case-7.tar.xz']['sha256']))
+    with pytest.raises(BackupError):
+        repository.verify(manifest['id'])
+
+
+def test_every_case_shard_is_snapshotted_and_restored(tmp_path):
+    make_database(tmp_path / 'live.db')
+    shard_dir = tmp_path / 'shards'
+    shard_dir.mkdir()
+    for case_id in (1, 2):
+        make_database(shard_dir / f'case-{case_id}.db')
+    repository = BackupRepository(str(tmp_path / 'backups'))
+
+    manifest = repository.backup(f"sqlite:///{tmp_path / 'live.db'}", str(tmp_path / 'uploads'),
+                                 shard_dir=str(shard_dir))
+    assert set(manifest['shards']) == {'case-1.db', 'case-2.db'}
+    assert repository.verify()['shards'] == 2
+
+    restored = tmp_path / 'restored'
+    repository.restore(f"sqlite:///{restored / 'database.sqlite'}", str(restored / 'uploads'),
+                       shard_dir=str(restored / 'shards'))
+    connection = sqlite3.connect(restored / 'shards' / 'case-2.db')
+    assert connection.execute('SELECT content FROM note').fetchone() == ('kept',)
+    connection.close()
+
+    with pytest.raises(BackupError):
+        repository.restore(None, str(restored / 'uploads'))
@@ -0,0 +1,16 @@
+import io
+
+from bulk_import import import_records
+from models import CaseNote
+
+
+def test_notes_with_and_without_created_at_import_in_one_batch(case):
+    csv_data = b"title,content,created_at\nA,aa,2024-01-01\nB,bb,\nC,cc,2024-02-01 10:00\n"
+
+    result = import_records('notes', io.BytesIO(csv_data), 'csv', case.id)
+
+    assert (result['imported'], result['failed']) == (3, 0)
+    notes = {note.title: note for note in CaseNote.query.filter(CaseNote.title.in_(['A', 'B', 'C']))}
+    assert notes['A'].created_at.isoformat() == '2024-01-01T00:00:00'
+    assert notes['B'].created_at is not None
+    assert notes['C'].updated_at.isoformat() == '2024-02-01T10:00:00'
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from app import db
+from case_shards import shard_context
+from ical_feed import CalendarFeedCache
+from models import Case, Deadline
+
+HEARING = {'title': 'Hearing', 'deadline_date': datetime(2030, 5, 1, 9, 30)}
+
+
+def test_cached_events_are_kept_per_case(app, sharded):
+    cache = CalendarFeedCache()
+    bodies = []
+    for title in ('First case', 'Second case'):
+        case_id = sharded.create_case({'case_title': title, 'case_type': 'Family Law'})
+        with shard_context(case_id):
+            db.session.add(Deadline(case_id=case_id, **HEARING))  # Same id and fields in both shards
+            db.session.commit()
+            bodies.append((case_id, cache.feed(db.session.get(Case, case_id), 1, None).decode()))
+
+    for case_id, body in bodies:
+        assert f"UID:deadline-1-case-{case_id}@" in body
+
+
+def test_deleted_deadlines_leave_the_cache(app, case):
+    cache = CalendarFeedCache()
+    deadline = Deadline(case_id=case.id, title='Filing', deadline_date=datetime.now() + timedelta(days=9))
+    db.session.add(deadline)
+    db.session.commit()
+    cache.feed(case, 1, None)
+    assert deadline.id in cache._events[case.id]
+
+    db.session.delete(deadline)
+    db.session.commit()
+    assert f"deadline-{deadline.id}-" not in cache.feed(case, 2, None).decode()
+    assert deadline.id not in cache._events[case.id]
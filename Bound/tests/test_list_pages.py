@@ -0,0 +1,70 @@
+import re
+from datetime import datetime, timedelta
+
+from app import db
+from models import CaseNote, Incident
+from search_index import FIRST_PAGE_ROWS
+
+
+def add_incidents(case, days_ago):
+    for days in days_ago:
+        db.session.add(Incident(case_id=case.id, title=f'Incident {days} days ago', description='Missed pickup',
+                                incident_date=datetime.now() - timedelta(days=days), incident_type='missed_visitation',
+                                severity='high'))
+    db.session.commit()
+
+
+def rows_before_template(html, prefix):
+    rendered = html.split('<template>')[0]
+    return len(re.findall(rf'id="{prefix}-\d+"', rendered))
+
+
+def test_incidents_page_renders_with_incidents(client, case):
+    add_incidents(case, list(range(0, 20, 2)) + list(range(40, 55)))
+    recent = Incident.query.filter(Incident.case_id == case.id,
+                                   Incident.incident_date > datetime.now() - timedelta(days=30)).count()
+
+    response = client.get('/incidents')
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert re.search(rf'<h4 class="card-title mb-0">{recent}</h4>\s*<small class="text-muted">This Month',
+                     html)
+    # The first page is ordinary markup; only the rest waits in the template
+    assert rows_before_template(html, 'incident') == FIRST_PAGE_ROWS
+    assert html.count('<template>') == 1
+
+
+def test_short_lists_render_every_row_without_a_template(client, case):
+    CaseNote.query.filter_by(case_id=case.id).delete()
+    for number in range(3):
+        db.session.add(CaseNote(case_id=case.id, title=f'Note {number}', content='Call the school',
+                                 note_type='general'))
+    db.session.commit()
+
+    response = client.get('/case-notes')
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '<template>' not in html
+    assert len(re.findall(r'id="note-\d+"', html)) == 3
+
+
+def test_timeline_renders_with_events(client, case):
+    add_incidents(case, range(60, 60 + FIRST_PAGE_ROWS + 5))
+
+    response = client.get('/timeline')
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert html.count('<template>') == 1
+    assert html.split('<template>')[0].count('class="timeline-item"') == FIRST_PAGE_ROWS
+
+
+def test_related_items_past_the_first_page_are_fetched_per_row(client, case):
+    add_incidents(case, range(100, 100 + FIRST_PAGE_ROWS + 2))
+    html = client.get('/incidents').get_data(as_text=True)
+    before, after = html.split('<template>')
+    assert 'data-related-url' not in before
+    url = re.search(r'data-related-url="([^"]+)"', after).group(1)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), list)
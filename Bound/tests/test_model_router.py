@@ -0,0 +1,34 @@
+import time
+
+from model_router import LatencyTracker, ModelRouter
+
+
+def router(probe_seconds=60.0, window_seconds=300.0):
+    return ModelRouter(client=None, config={
+        'OPENAI_MODEL_LARGE': 'large-model', 'OPENAI_MODEL_SMALL': 'small-model', 'OPENAI_TASK_TIERS': {},
+        'OPENAI_MAX_IN_FLIGHT': 8, 'AI_CASE_MONTHLY_TOKEN_BUDGET': 0, 'AI_BUDGET_SOFT_RATIO': 0.8,
+        'OPENAI_LATENCY_WINDOW_SECONDS': window_seconds, 'OPENAI_LATENCY_PROBE_SECONDS': probe_seconds})
+
+
+def record_slow(tracker, count=10, seconds=45.0):
+    for _ in range(count):
+        tracker.begin()
+        tracker.end(seconds)
+
+
+def test_slow_samples_age_out():
+    tracker = LatencyTracker(max_age=300)
+    record_slow(tracker)
+    assert tracker.p90() == 45.0
+    assert tracker.p90(now=time.monotonic() + 301) is None
+
+
+def test_skipped_tier_gets_one_probe_per_interval():
+    model_router = router(probe_seconds=60)
+    record_slow(model_router.latency['large'])
+    assert model_router.plan('case_summary') == (['small'], 'latency')
+
+    model_router.latency['large']._last_probe -= 61
+    assert model_router.plan('case_summary') == (['large', 'small'], None)
+    assert model_router.plan('case_summary') == (['small'], 'latency')
+    assert model_router.stats['latency_probes'] == 1
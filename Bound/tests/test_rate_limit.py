@@ -0,0 +1,28 @@
+from werkzeug.test import EnvironBuilder
+
+
+def remote_addr_seen_by_app(app, forwarded_for):
+    """REMOTE_ADDR after the app's proxy middleware, for a request carrying X-Forwarded-For"""
+    seen = {}
+
+    def capture(environ, start_response):
+        seen['remote_addr'] = environ['REMOTE_ADDR']
+        start_response('204 No Content', [])
+        return []
+
+    proxy_fix = app.wsgi_app
+    environ = EnvironBuilder(headers={'X-Forwarded-For': forwarded_for},
+                             environ_base={'REMOTE_ADDR': '198.51.100.7'}).get_environ()
+    inner, proxy_fix.app = proxy_fix.app, capture
+    try:
+        proxy_fix(environ, lambda status, headers: None)
+    finally:
+        proxy_fix.app = inner
+    return seen['remote_addr']
+
+
+def test_forwarded_for_is_trusted_through_one_proxy_by_default(app):
+    assert app.config['PROXY_FIX_X_FOR'] == 1
+    # Only the hop the proxy appended counts; an address the client prepended is ignored
+    assert remote_addr_seen_by_app(app, '203.0.113.1') == '203.0.113.1'
+    assert remote_addr_seen_by_app(app, '192.0.2.99, 203.0.113.1') == '203.0.113.1'
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from app import db
+from case_shards import shard_context
+from models import Case, Deadline
+from reminder_scheduler import ReminderScheduler, schedule_deadline
+
+
+class RecordingSink:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, deadline, subject, body):
+        self.sent.append(deadline.id)
+
+
+def add_deadline(case, days_ahead, reminder_days=1):
+    deadline = Deadline(case_id=case.id, title='Hearing', reminder_days=reminder_days,
+                        deadline_date=datetime.now() + timedelta(days=days_ahead))
+    db.session.add(deadline)
+    db.session.flush()
+    schedule_deadline(deadline)
+    db.session.commit()
+    return deadline
+
+
+def test_scheduler_picks_up_reminders_written_after_it_loaded(app, case):
+    sink = RecordingSink()
+    scheduler = ReminderScheduler(app, [sink])  # Standalone: not the in-process scheduler, so nothing is pushed
+    scheduler.load()
+
+    deadline = add_deadline(case, days_ahead=3)
+    assert scheduler.fire_due(now=datetime.now() + timedelta(days=2, hours=1)) == 0
+
+    assert scheduler.load_changes() >= 1
+    assert scheduler.fire_due(now=datetime.now() + timedelta(days=2, hours=1)) == 1
+    assert sink.sent == [deadline.id]
+
+
+def test_scheduler_follows_a_moved_reminder(app, case):
+    sink = RecordingSink()
+    scheduler = ReminderScheduler(app, [sink])
+    deadline = add_deadline(case, days_ahead=10)
+    scheduler.load()
+
+    deadline.deadline_date = datetime.now() + timedelta(days=2)
+    schedule_deadline(deadline)
+    db.session.commit()
+    scheduler.load_changes()
+
+    assert scheduler.fire_due(now=datetime.now() + timedelta(days=1, hours=1)) == 1
+    assert deadline.id in sink.sent
+
+
+def test_scheduler_sends_reminders_from_every_shard(app, sharded):
+    sink = RecordingSink()
+    scheduler = ReminderScheduler(app, [sink])
+    deadline_ids = []
+    for title in ('First case', 'Second case'):
+        case_id = sharded.create_case({'case_title': title, 'case_type': 'Family Law'})
+        with shard_context(case_id):
+            deadline_ids.append(add_deadline(db.session.get(Case, case_id), days_ahead=3).id)
+    assert deadline_ids[0] == deadline_ids[1]  # Each shard numbers its own deadlines
+
+    scheduler.load()
+    assert scheduler.fire_due(now=datetime.now() + timedelta(days=2, hours=1)) == 2
+
+    # A case created after the load is picked up on the next wake
+    case_id = sharded.create_case({'case_title': 'Third case', 'case_type': 'Family Law'})
+    with shard_context(case_id):
+        add_deadline(db.session.get(Case, case_id), days_ahead=3)
+    assert scheduler.load_changes() == 1
+    assert scheduler.fire_due(now=datetime.now() + timedelta(days=2, hours=1)) == 1
+    assert len(sink.sent) == 3
@@ -0,0 +1,14 @@
+import numpy as np
+
+from semantic_index import VectorStore
+
+
+def test_item_vectors_match_item_vector(tmp_path):
+    store = VectorStore(str(tmp_path / 'index.vec'), dimension=4)
+    store.add('incident', 1, [[1, 0, 0, 0], [0, 1, 0, 0]])
+    store.add('incident', 2, [[0, 0, 3, 0]])
+
+    vectors = store.item_vectors([('incident', 1), ('incident', 3), ('incident', 2)])
+    assert vectors[1] is None
+    assert np.allclose(vectors[0], store.item_vector('incident', 1))
+    assert np.allclose(vectors[2], [0, 0, 1, 0])
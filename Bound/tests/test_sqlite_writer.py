@@ -0,0 +1,35 @@
+import time
+from datetime import datetime
+
+from flask import g
+
+from app import app as flask_app, db
+from models import AIUsage, CaseNote
+from rate_limit import DatabaseBuckets, Limit
+
+
+def usage_row(task):
+    return {'case_id': None, 'task': task, 'tier': 'small', 'model': 'test', 'prompt_tokens': 1,
+            'completion_tokens': 1, 'total_tokens': 2, 'latency_ms': 1, 'downgrade_reason': None,
+            'created_at': datetime.utcnow()}
+
+
+def test_ai_usage_is_saved_after_a_flushed_transaction_is_abandoned(case):
+    with flask_app.app_context():
+        db.session.add(CaseNote(case_id=case.id, title='never committed', content='x'))
+        db.session.flush()  # Holds the writer slot and SQLite's write lock, as on an error path
+        g.pending_ai_usage = [usage_row('writer-slot-test')]
+        started = time.monotonic()
+    assert time.monotonic() - started < 2  # No wait for busy_timeout
+    assert AIUsage.query.filter_by(task='writer-slot-test').count() == 1
+    assert CaseNote.query.filter_by(title='never committed').count() == 0
+
+
+def test_database_buckets_take_the_writer_slot(app):
+    writer = app.extensions.get('sqlite_writer')
+    if writer is None:
+        return
+    buckets = DatabaseBuckets(db, app)
+    writes = writer.stats['writes']
+    assert buckets.take('test-client', Limit(60, 5), 1, time.time()) == 0.0
+    assert writer.stats['writes'] > writes
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+def safe_date_parse(date_string):
+    """Safely parse a date string, returning None if invalid or empty"""
+    if not date_string or date_string.strip() == '':
+        return None
+    try:
+        return datetime.strptime(date_string.strip(), '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return None
+
+def safe_datetime_parse(datetime_string, format_string='%Y-%m-%dT%H:%M'):
+    """Safely parse a datetime string, returning None if invalid or empty"""
+    if not datetime_string or datetime_string.strip() == '':
+        return None
+    try:
+        return datetime.strptime(datetime_string.strip(), format_string)
+    except (ValueError, TypeError):
+        return None